@@ -17,7 +17,7 @@ from PySide6.QtWidgets import QGridLayout, QVBoxLayout, QFrame, QLabel, QButtonG
 from PySide6.QtCore import Qt, Signal, QObject, QSize, QMetaObject, QDate
 from PySide6.QtGui import QIcon, QPixmap
 
-from source.util.db import get_config
+from source.util.db import add_config_listener, get_config
 
 class CommonSignal(QObject):
     """ Signal bus """
@@ -26,6 +26,14 @@ class CommonSignal(QObject):
 
 common_signal = CommonSignal()
 
+class ConfigSignal(QObject):
+    """ Config signal bus """
+
+    config_changed = Signal(list) # 发生变化的配置集
+
+config_signal = ConfigSignal()
+add_config_listener(config_signal.config_changed.emit)
+
 # 自定义style
 class StyleSheet(StyleSheetBase, Enum):
 
@@ -231,13 +239,22 @@ class Table(TableWidget):
     def set_data(self, datas: list):
         self.setRowCount(len(datas))
         for i, data in enumerate(datas):
-            for j in range(self.header_len):
-                if isinstance(data[j], QWidget):
-                    self.setCellWidget(i, j, data[j])
-                else:
-                    self.setItem(i, j, QTableWidgetItem(str(data[j])))
+            self.set_row(i, data)
         self.resizeColumnsToContents()
 
+    def set_row(self, i: int, data: list):
+        for j in range(self.header_len):
+            if isinstance(data[j], QWidget):
+                self.setCellWidget(i, j, data[j])
+            elif isinstance(data[j], QTableWidgetItem):
+                self.setItem(i, j, data[j])
+            else:
+                self.setItem(i, j, QTableWidgetItem(str(data[j])))
+
+    def append_row(self, data: list):
+        self.insertRow(self.rowCount())
+        self.set_row(self.rowCount() - 1, data)
+
     def clear_data(self):
         self.clearContents()
         self.setRowCount(0)
@@ -8,6 +8,7 @@ from typing import override
 import qfluentwidgets
 from PySide6.QtWidgets import QApplication, QWidget
 from PySide6.QtGui import Qt, QIcon
+from PySide6.QtCore import QTimer
 
 from gui.custom_widgets import common_signal
 from gui.main_page import MainPage
@@ -15,7 +16,7 @@ from gui.music.music import MusicPage
 from gui.games.main_page import GamePage
 from gui.tools.main_page import ToolPage
 from gui.setting import SettingPage
-from source.util.db import get_config, set_config
+from source.util.db import get_config, set_config, check_config_changes, CONFIG_CHECK_INTERVAL
 
 
 class MainWindow(qfluentwidgets.FluentWindow):
@@ -60,6 +61,11 @@ class MainWindow(qfluentwidgets.FluentWindow):
     def connect_signal_slot(self):
         common_signal.mica_enable_changed.connect(lambda is_enabled: self.enable_changed(is_enabled))
 
+        # 开机自启等场景可能同时运行多个实例, 定时同步其他实例修改的配置
+        self.config_timer = QTimer(self)
+        self.config_timer.timeout.connect(check_config_changes)
+        self.config_timer.start(CONFIG_CHECK_INTERVAL)
+
     @override
     def switchTo(self, interface: QWidget):
         self.stackedWidget.setCurrentWidget(interface, popOut=False)
@@ -3,12 +3,12 @@
 # 功能: 设置界面
 
 from qfluentwidgets import ExpandLayout, SettingCardGroup, FluentIcon, ConfigItem, QConfig, setTheme, BoolValidator, ScrollArea, \
-    HyperlinkCard, PrimaryPushSettingCard, OptionsConfigItem, OptionsValidator
+    HyperlinkCard, PrimaryPushSettingCard, OptionsConfigItem, OptionsValidator, qconfig
 from PySide6.QtWidgets import QWidget, QLabel
 from PySide6.QtCore import Qt, QUrl
 from PySide6.QtGui import QDesktopServices
 
-from gui.custom_widgets import OptionsSettingCard, SwitchSettingCard, common_signal, StyleSheet
+from gui.custom_widgets import OptionsSettingCard, SwitchSettingCard, common_signal, config_signal, StyleSheet
 from source.util.common_util import isWin11
 from source.util.db import set_config, get_config
 from source.util.default_config import README_URL, ISSUE_URL, VERSION, AUTHOR
@@ -40,6 +40,8 @@ class SettingPage(ScrollArea):
         self.setObjectName('setting_page')
         StyleSheet.VIEW_INTERFACE.apply(self, get_config('System', 'Theme'))
 
+        config_signal.config_changed.connect(lambda keys: self.config_changed(keys))
+
     def add_system_group(self):
         self.sys_group = SettingCardGroup('系统', self.scroll_widget)
         self.log_card = OptionsSettingCard(
@@ -142,6 +144,18 @@ class SettingPage(ScrollArea):
 
         self.expand_ayout.addWidget(self.about_group)
 
+    # 其他实例修改了配置时同步界面
+    def config_changed(self, keys: list):
+        if 'System' not in keys:
+            return
+        self.mica_card.setValue(get_config('System', 'MicaEnabled'))
+        self.update_start_card.setValue(get_config('System', 'IsUpdateOnStart'))
+        self.startup_card.setValue(get_config('System', 'PowerOnStartUp'))
+        theme = get_config('System', 'Theme')
+        if theme != qconfig.get(qconfig.themeMode):
+            self.theme_card.setValue(theme)
+            self.set_theme(theme)
+
     def set_theme(self, theme):
         setTheme(theme)
         image_theme_update(theme)
@@ -3,31 +3,86 @@
 # 功能: 进程管理界面
 
 import traceback
-import copy
 from functools import partial
 
 import fuzzywuzzy.process
-from qfluentwidgets import LineEdit, PushButton, ToolButton, FluentIcon, ToolTipFilter, InfoBar, InfoBarPosition
-from PySide6.QtWidgets import QWidget, QGridLayout, QAbstractItemView
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QKeyEvent
+from qfluentwidgets import LineEdit, PushButton, ToolButton, FluentIcon, ToolTipFilter, InfoBar, InfoBarPosition, CheckBox
+from qfluentwidgets import themeColor, TableItemDelegate, TreeWidget
+from PySide6.QtWidgets import QWidget, QGridLayout, QAbstractItemView, QTableWidgetItem, QStyleOptionViewItem, QTreeWidgetItem
+from PySide6.QtCore import Qt, QModelIndex, QPointF
+from PySide6.QtGui import QPainter, QPen, QPolygonF
 
 from gui.custom_widgets import Table, CustomMessageBox
-from source.client.tools.process import get_processes, kill_process
+from source.client.tools.process import ProcessInfo, build_process_tree
+from source.client.tools.process_monitor import ProcessDiff, ProcessKiller, ProcessMonitor
+from source.client.tools.process_sampler import ProcessSample, ProcessSampler, format_bytes
 from source.util.log import log_info
 
+AUTO_REFRESH_INTERVAL = 1 # 自动刷新与资源采样的间隔(秒)
+NAME_COLUMN, PID_COLUMN, TITLE_COLUMN, CPU_COLUMN, RSS_COLUMN, IO_COLUMN, THREADS_COLUMN, TREND_COLUMN = range(8)
+
+class NumericItem(QTableWidgetItem):
+    """ 按数值排序的单元格, 显示的文本可与数值不同 """
+
+    def __init__(self, value: float=None, text: str=''):
+        super().__init__(text)
+        self.setData(Qt.UserRole, value)
+
+    def set_value(self, value: float, text: str):
+        if self.data(Qt.UserRole) == value: # 大部分进程的占用不变, 跳过可减少界面刷新
+            return
+        self.setData(Qt.UserRole, value)
+        self.setText(text)
+
+    def __lt__(self, other: QTableWidgetItem):
+        return (self.data(Qt.UserRole) or 0) < (other.data(Qt.UserRole) or 0)
+
+class SparklineDelegate(TableItemDelegate):
+    """ 在单元格中绘制进程近期的CPU占用曲线 """
+
+    def __init__(self, sampler: ProcessSampler, parent):
+        super().__init__(parent)
+        self.sampler = sampler
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex):
+        super().paint(painter, option, index)
+        pid = index.siblingAtColumn(PID_COLUMN).data(Qt.UserRole)
+        values = self.sampler.history(pid, 'cpu') if pid is not None else ()
+        if len(values) < 2:
+            return
+        rect = option.rect.adjusted(4, 4, -4, -4)
+        top = max(float(values.max()), 100) # 纵轴至少为单核满载
+        step = rect.width() / (self.sampler.history_size - 1)
+        x0 = rect.right() - step * (len(values) - 1)
+        points = [QPointF(x0 + i * step, rect.bottom() - value / top * rect.height()) for i, value in enumerate(values.tolist())]
+        painter.save()
+        painter.setRenderHints(QPainter.Antialiasing)
+        painter.setPen(QPen(themeColor(), 1.5))
+        painter.drawPolyline(QPolygonF(points))
+        painter.restore()
+
 class Process(QWidget):
     def __init__(self):
         super().__init__()
         self._layout = QGridLayout(self)
         self._layout.setSpacing(10)
+        self.processes_info: dict[int, ProcessInfo] = {} # 最新快照, pid -> 进程信息
+        self._rows: dict[int, int] = {} # 表格中展示的进程, pid -> 行号
+        self._searching = False # 展示搜索结果时, 新增的进程不加入表格
+        self._killers: list[ProcessKiller] = [] # 正在执行的终止任务
+        self._tree_items: dict[int, QTreeWidgetItem] = {} # 树形视图中的进程, pid -> 节点
 
         self.process_edit = LineEdit()
         self.process_edit.setClearButtonEnabled(True)
         # 清空输入框的同时, 列表展示所有项
         self.process_edit.clearButton.clicked.connect(lambda: self.show_all_processes())
         self.process_edit.returnPressed.connect(lambda: self.search_process(self.process_edit.text()))
-        self._layout.addWidget(self.process_edit, 0, 0, 1, 3)
+        self._layout.addWidget(self.process_edit, 0, 0, 1, 2)
+
+        self.delete_btn = PushButton('删除所选进程')
+        self.delete_btn.setToolTip('可按住Ctrl或Shift多选')
+        self.delete_btn.clicked.connect(lambda: self.delete_selected())
+        self._layout.addWidget(self.delete_btn, 0, 2, 1, 1)
 
         self.sreach_btn = PushButton('搜索')
         self.sreach_btn.clicked.connect(lambda: self.search_process(self.process_edit.text()))
@@ -39,64 +94,265 @@ class Process(QWidget):
         self.refresh_btn.clicked.connect(lambda: self.comp_init())
         self._layout.addWidget(self.refresh_btn, 0, 4, 1, 1)
 
-        header = ['进程名称', '进程号', '操作']
+        self.auto_refresh = CheckBox('自动刷新')
+        self.auto_refresh.setToolTip(f'每{AUTO_REFRESH_INTERVAL}秒刷新一次, 只更新有变化的进程')
+        self.auto_refresh.stateChanged.connect(lambda: self.set_auto_refresh(self.auto_refresh.isChecked()))
+        self._layout.addWidget(self.auto_refresh, 0, 5, 1, 1)
+
+        header = ['进程名称', '进程号', '窗体标题', 'CPU%', '内存', '读/写(每秒)', '线程数', 'CPU趋势', '操作']
         self.process_table = Table(header)
         self.process_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
-        self._layout.addWidget(self.process_table, 1, 0, 5, 5)
+        self.process_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.process_table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.process_table.setSortingEnabled(True) # 点击CPU%、内存等列头即可查看占用最高的进程
+        self.process_table.horizontalHeader().sortIndicatorChanged.connect(lambda: self.reindex_rows())
+        self._layout.addWidget(self.process_table, 1, 0, 5, 6)
+
+        self.sampler = ProcessSampler()
+        self.process_table.setItemDelegateForColumn(TREND_COLUMN, SparklineDelegate(self.sampler, self.process_table))
+        self.process_table.setColumnWidth(TREND_COLUMN, 120)
+
+        self.process_tree = TreeWidget()
+        self.process_tree.setHeaderLabels(['进程名称', '进程号', '窗体标题'])
+        self.process_tree.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.process_tree.hide()
+        self._layout.addWidget(self.process_tree, 1, 0, 5, 6)
+
+        self.tree_view = CheckBox('树形视图')
+        self.tree_view.setToolTip('按父子关系展示进程')
+        self.tree_view.stateChanged.connect(lambda: self.set_tree_view(self.tree_view.isChecked()))
+        self._layout.addWidget(self.tree_view, 6, 0, 1, 1)
+
+        self.delete_tree_btn = PushButton('结束进程树')
+        self.delete_tree_btn.setToolTip('结束所选进程及其全部子进程, 从最深的子进程开始')
+        self.delete_tree_btn.clicked.connect(lambda: self.delete_selected(tree=True))
+        self._layout.addWidget(self.delete_tree_btn, 6, 1, 1, 1)
+
+        self.monitor = ProcessMonitor(sampler=self.sampler)
+        self.monitor.diff_signal.connect(lambda diff: self.apply_diff(diff))
+        self.monitor.sample_signal.connect(lambda samples: self.apply_samples(samples))
 
     def comp_init(self):
-        self.processes_info = get_processes()
-        datas = self.add_del_btn_to_process(self.processes_info)
-        self.process_table.set_data(datas)
-
-    def add_del_btn_to_process(self, datas):
-        def delete_process(process_info, index):
-            w = CustomMessageBox('确定要删除进程吗', self)
-            if w.exec():
-                log_info(f'删除的进程名称: {process_info[0]}, 进程id: {process_info[1]}')
-                ok = kill_process(process_info[1])
-                if ok:
-                    self.process_table.removeRow(index)
-                else:
-                    InfoBar.success(
-                        title='删除失败!',
-                        content='所选进程不存在, 请重新查询',
-                        orient=Qt.Horizontal,
-                        isClosable=True,
-                        position=InfoBarPosition.TOP,
-                        duration=2000,
-                        parent=self
-                    )
-
-        new_datas = copy.deepcopy(datas)
-        for index, process_info in enumerate(new_datas):
-            btn = PushButton('删除进程')
-            btn.clicked.connect(partial(delete_process, process_info, index))
-            process_info.append(btn)
-        return new_datas
+        self.monitor.refresh()
+
+    def set_auto_refresh(self, enabled: bool):
+        self.monitor.set_interval(AUTO_REFRESH_INTERVAL if enabled else 0)
+        if enabled:
+            self.monitor.refresh()
+
+    def row_data(self, process_info: ProcessInfo) -> list:
+        btn = PushButton('删除进程')
+        btn.clicked.connect(partial(self.delete_process, process_info.pid))
+        pid = NumericItem(process_info.pid, str(process_info.pid))
+        metrics = [NumericItem() for _ in range(CPU_COLUMN, TREND_COLUMN)]
+        sample = self.sampler.latest.get(process_info.pid)
+        if sample is not None:
+            self.set_metrics(metrics, sample)
+        return [process_info.name, pid, process_info.title, *metrics, NumericItem(), btn]
+
+    @staticmethod
+    def set_metrics(items: list[NumericItem], sample: ProcessSample):
+        cpu, rss, io, threads = items
+        cpu.set_value(sample.cpu, f'{sample.cpu:.1f}')
+        rss.set_value(sample.rss, format_bytes(sample.rss))
+        io.set_value(sample.read_rate + sample.write_rate, f'{format_bytes(sample.read_rate)}/{format_bytes(sample.write_rate)}')
+        threads.set_value(sample.threads, str(sample.threads))
+
+    def begin_patch(self):
+        # 排序开启时修改单元格会立即移动行, 修改期间暂停排序
+        self.process_table.setUpdatesEnabled(False)
+        self.process_table.setSortingEnabled(False)
+
+    def end_patch(self):
+        self.process_table.setSortingEnabled(True) # 按当前的排序列重新排序
+        self.reindex_rows()
+        self.process_table.setUpdatesEnabled(True)
+
+    def reindex_rows(self):
+        self._rows = {self.process_table.item(i, PID_COLUMN).data(Qt.UserRole): i for i in range(self.process_table.rowCount())}
+
+    def apply_samples(self, samples: dict[int, ProcessSample]):
+        """ 更新表格中进程的资源占用 """
+        self.begin_patch()
+        try:
+            for pid, row in self._rows.items():
+                sample = samples.get(pid)
+                if sample is not None:
+                    self.set_metrics([self.process_table.item(row, column) for column in range(CPU_COLUMN, TREND_COLUMN)], sample)
+        finally:
+            self.end_patch()
+        self.process_table.viewport().update() # 重绘趋势列
+
+    def delete_process(self, pid: int):
+        self.kill_processes([pid])
+
+    def selected_pids(self) -> list[int]:
+        if self.process_tree.isVisible():
+            return [item.data(0, Qt.UserRole) for item in self.process_tree.selectedItems()]
+        rows = sorted({index.row() for index in self.process_table.selectionModel().selectedRows()})
+        return [self.process_table.item(row, PID_COLUMN).data(Qt.UserRole) for row in rows]
+
+    def delete_selected(self, tree=False):
+        pids = self.selected_pids()
+        if not pids:
+            InfoBar.warning(title='请先选择要删除的进程', content='', orient=Qt.Horizontal, isClosable=True,
+                            position=InfoBarPosition.TOP, duration=2000, parent=self)
+            return
+        self.kill_processes(pids, tree)
+
+    def kill_processes(self, pids: list[int], tree=False):
+        """ 在工作线程中批量终止, 每个进程终止后立即删除对应的行; tree为True时连同子进程一起终止 """
+        if tree:
+            message = '确定要结束所选进程及其全部子进程吗'
+        else:
+            message = '确定要删除进程吗' if len(pids) == 1 else f'确定要删除所选的{len(pids)}个进程吗'
+        w = CustomMessageBox(message, self)
+        if not w.exec():
+            return
+        for pid in pids:
+            process_info = self.processes_info.get(pid, ProcessInfo(pid, '', '', 0))
+            log_info(f'删除的{"进程树" if tree else "进程"}名称: {process_info.name}, 进程id: {process_info.pid}')
+        killer = ProcessKiller(pids, tree=tree)
+        killer.killed_signal.connect(self.process_killed)
+        killer.finished.connect(self.kill_finished)
+        self._killers.append(killer)
+        killer.start()
+
+    def process_killed(self, pid: int, ok: bool):
+        if ok:
+            self.remove_rows([pid])
+            self.remove_tree_items([pid])
+
+    def kill_finished(self):
+        failed = []
+        for killer in [killer for killer in self._killers if killer.isFinished()]:
+            self._killers.remove(killer)
+            failed += [pid for pid, ok in killer.results.items() if not ok]
+        if failed:
+            InfoBar.error(
+                title='删除失败!',
+                content=f'进程{", ".join(map(str, failed))}不存在或无法终止, 请重新查询',
+                orient=Qt.Horizontal,
+                isClosable=True,
+                position=InfoBarPosition.TOP,
+                duration=2000,
+                parent=self
+            )
+        self.monitor.refresh()
+
+    def show_processes(self, datas: list[ProcessInfo]):
+        """ 整表重建, 只在搜索或清空搜索时使用 """
+        self.begin_patch()
+        try:
+            self.process_table.clear_data()
+            self.process_table.set_data([self.row_data(process_info) for process_info in datas])
+            self.process_table.setColumnWidth(TREND_COLUMN, 120)
+        finally:
+            self.end_patch()
+
+    def remove_rows(self, pids: list[int]):
+        rows = sorted((self._rows[pid] for pid in pids if pid in self._rows), reverse=True)
+        if not rows:
+            return
+        for row in rows: # 从下往上删除, 不影响未删除行的行号
+            self.process_table.removeRow(row)
+        self.reindex_rows()
+
+    def apply_diff(self, diff: ProcessDiff):
+        """ 按快照差异只修改变化的行 """
+        for pid in diff.removed:
+            self.processes_info.pop(pid, None)
+        for process_info in diff.added + diff.changed:
+            self.processes_info[process_info.pid] = process_info
+
+        first_fill = not self._rows and not self._searching
+        self.begin_patch()
+        try:
+            self.remove_rows(diff.removed)
+            for process_info in diff.changed:
+                row = self._rows.get(process_info.pid)
+                if row is not None:
+                    self.process_table.item(row, NAME_COLUMN).setText(process_info.name)
+                    self.process_table.item(row, TITLE_COLUMN).setText(process_info.title)
+            if not self._searching:
+                for process_info in diff.added:
+                    self._rows[process_info.pid] = self.process_table.rowCount()
+                    self.process_table.append_row(self.row_data(process_info))
+        finally:
+            self.end_patch()
+        if first_fill:
+            self.process_table.resizeColumnsToContents()
+            self.process_table.setColumnWidth(TREND_COLUMN, 120)
+        if self.process_tree.isVisible():
+            self.show_tree()
+
+    def set_tree_view(self, enabled: bool):
+        self.process_table.setVisible(not enabled)
+        self.process_tree.setVisible(enabled)
+        if enabled:
+            self.show_tree()
+
+    def show_tree(self):
+        """ 按最新快照重建树形视图, 保留已展开的节点与选中项 """
+        expanded = {pid for pid, item in self._tree_items.items() if item.isExpanded()}
+        selected = {item.data(0, Qt.UserRole) for item in self.process_tree.selectedItems()}
+        tree = build_process_tree(self.processes_info.values())
+        self.process_tree.setUpdatesEnabled(False)
+        try:
+            self.process_tree.clear()
+            self._tree_items = {}
+            # 逐层建立节点, 不使用递归, 进程树较深时也不会超出递归深度
+            level = [(None, pid) for pid in sorted(tree.roots)]
+            while level:
+                next_level = []
+                for parent, pid in level:
+                    process_info = self.processes_info[pid]
+                    item = QTreeWidgetItem([process_info.name, str(pid), process_info.title])
+                    item.setData(0, Qt.UserRole, pid)
+                    if parent is None:
+                        self.process_tree.addTopLevelItem(item)
+                    else:
+                        parent.addChild(item)
+                    self._tree_items[pid] = item
+                    next_level += [(item, child) for child in sorted(tree.children.get(pid, ()))]
+                level = next_level
+            for pid, item in self._tree_items.items():
+                item.setExpanded(pid in expanded)
+                item.setSelected(pid in selected)
+        finally:
+            self.process_tree.setUpdatesEnabled(True)
+
+    def remove_tree_items(self, pids: list[int]):
+        for pid in pids:
+            item = self._tree_items.pop(pid, None)
+            if item is None:
+                continue
+            # 子进程暂时挂到上一级, 下次刷新时按实际的父进程重建
+            parent = item.parent()
+            children = item.takeChildren()
+            if parent is None:
+                self.process_tree.takeTopLevelItem(self.process_tree.indexOfTopLevelItem(item))
+                self.process_tree.addTopLevelItems(children)
+            else:
+                parent.removeChild(item)
+                parent.addChildren(children)
 
     def search_process(self, s: str):
         try:
             if not s:
                 self.show_all_processes()
                 return
-            results = fuzzywuzzy.process.extract(s, [process_info[0] for process_info in self.processes_info], limit=20)
-            search_result = []
-            for result in results:
-                if result[1] > 0:
-                    search_result.append(result[0])
+            # 同时按进程名称与窗体标题匹配
+            processes = list(self.processes_info.values())
+            choices = {i: f'{process_info.name} {process_info.title}' for i, process_info in enumerate(processes)}
+            results = fuzzywuzzy.process.extract(s, choices, limit=20)
+            search_result = {result[2] for result in results if result[1] > 0}
 
-            datas = [] 
-            for process_info in self.processes_info:
-                if process_info[0] in search_result:
-                    datas.append(process_info)
-
-            self.process_table.clear_data()
-            datas = self.add_del_btn_to_process(datas)
-            self.process_table.set_data(datas)
+            self._searching = True
+            self.show_processes([process_info for i, process_info in enumerate(processes) if i in search_result])
         except Exception:
             traceback.print_exc()
 
     def show_all_processes(self):
-        self.process_table.clear_data()
-        self.process_table.set_data(self.processes_info)
\ No newline at end of file
+        self._searching = False
+        self.show_processes(list(self.processes_info.values()))
@@ -2,14 +2,97 @@
 # 作者: 拓跋龙
 # 功能: 工时记录界面
 
-from qfluentwidgets import SubtitleLabel, TimePicker, BodyLabel, PushButton, ComboBox, TextEdit
-from qfluentwidgets.components.date_time.calendar_view import DayCalendarView
-from PySide6.QtWidgets import QWidget, QGridLayout, QApplication
-from PySide6.QtCore import Qt, QDate
+from qfluentwidgets import SubtitleLabel, TimePicker, DatePicker, BodyLabel, PushButton, ComboBox, TextEdit, ProgressBar, LineEdit
+from qfluentwidgets import themeColor, isDarkTheme
+from qfluentwidgets.components.date_time.calendar_view import DayCalendarView, DayScrollItemDelegate
+from PySide6.QtWidgets import QWidget, QGridLayout, QApplication, QFileDialog, QStyleOptionViewItem
+from PySide6.QtCore import Qt, QDate, QTime, QThread, QModelIndex
+from PySide6.QtGui import QPainter, QColor
 
-from gui.custom_widgets import MonthPicker
+from gui.custom_widgets import MonthPicker, config_signal
+from source.client.tools.punch_capture import default_providers, fill_missing_days
+from source.client.tools.punch_import import import_punches
+from source.client.tools.team_work_hours import format_team_month, team_month
+from source.client.tools.work_calendar import work_calendar
+from source.client.tools.work_hours_analytics import format_trends, get_trends
 from source.client.tools.work_hours import is_work_day, set_work_hours_to_db, get_curr_day_work_hours, get_work_hours_from_db, \
-    query_work_hours
+    get_month_heat, \
+    query_work_hours, query_work_hours_quarter, query_work_hours_year, query_work_hours_range, load_shift_rules, \
+    export_work_hours, edit_history, current_profile, switch_work_hours_profile, new_work_hours_profile
+from source.util.db import profile_names
+from source.util.log import log_error
+from source.util.thread import Asynchronous
+
+JULIAN_DAY_OFFSET = 1721425 # QDate儒略日与datetime.date序数的差值
+HEAT_FULL_HOURS = 10 # 有效工时达到该值时热力颜色最深
+
+# Qt类型与工时核心整数时间模型间的转换
+def to_minutes(time: QTime) -> int | None:
+    return time.hour() * 60 + time.minute() if time.isValid() else None
+
+def to_ordinal(date: QDate) -> int:
+    return date.toJulianDay() - JULIAN_DAY_OFFSET
+
+class HeatmapDelegate(DayScrollItemDelegate):
+    """ 按有效工时着色的日期单元格, 休息日加灰色底纹 """
+
+    def __init__(self, min, max):
+        super().__init__(min, max)
+        self._heat: dict[tuple[int, int], tuple] = {} # 当前可见月份的数据, 避免逐格查询
+
+    def refresh(self):
+        self._heat.clear()
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex):
+        date = index.data(Qt.UserRole)
+        if date is not None:
+            self._drawHeat(painter, option, date)
+        super().paint(painter, option, index)
+
+    def _drawHeat(self, painter: QPainter, option: QStyleOptionViewItem, date: QDate):
+        key = date.year(), date.month()
+        heat = self._heat.get(key)
+        if heat is None:
+            if len(self._heat) > 8: # 翻页后可见月份已变化
+                self._heat.clear()
+            heat = self._heat[key] = get_month_heat(*key)
+        effect, mask = heat
+        hours = effect[date.day() - 1]
+        is_work_day = mask >> (date.day() - 1) & 1
+        if hours <= 0 and is_work_day:
+            return
+        painter.save()
+        painter.setRenderHints(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        m = self._itemMargin()
+        rect = option.rect.adjusted(m, m, -m, -m)
+        if not is_work_day:
+            c = 255 if isDarkTheme() else 0
+            painter.setBrush(QColor(c, c, c, 18))
+            painter.drawRoundedRect(rect, 6, 6)
+        if hours > 0:
+            color = QColor(themeColor())
+            color.setAlpha(int(40 + 150 * min(hours / HEAT_FULL_HOURS, 1)))
+            painter.setBrush(color)
+            painter.drawEllipse(rect)
+        painter.restore()
+
+class HeatmapCalendarView(DayCalendarView):
+    """ 工时热力图日历 """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        view = self.scrollView
+        delegate = HeatmapDelegate(*view.currentPageRange())
+        delegate.setCurrentIndex(view.delegate.currentIndex)
+        delegate.setSelectedIndex(view.delegate.selectedIndex)
+        view.delegate = delegate
+        view.setItemDelegate(delegate)
+
+    def refresh(self):
+        """ 工时数据变化后重绘 """
+        self.scrollView.delegate.refresh()
+        self.scrollView.viewport().update()
 
 class WorkHours(QWidget):
     def __init__(self):
@@ -18,7 +101,7 @@ class WorkHours(QWidget):
         self._layout.setSpacing(10)
         self.clicked_day = QDate.currentDate()
 
-        self._date = DayCalendarView()
+        self._date = HeatmapCalendarView()
         self._date.itemClicked.connect(lambda date: self.set_date_type(date))
         self._layout.addWidget(self._date, 0, 0, 5, 3, alignment=Qt.AlignmentFlag.AlignTop)
 
@@ -32,7 +115,7 @@ class WorkHours(QWidget):
         self._layout.addWidget(tmp_label, 1, 3, 1, 1, alignment=Qt.AlignmentFlag.AlignRight)
 
         self._select_work_type = ComboBox()
-        self._select_work_type.addItems(['8点班次', '8点半班次'])
+        config_signal.config_changed.connect(lambda keys: self.config_changed(keys))
         self._layout.addWidget(self._select_work_type, 1, 5, 1, 1)
 
         self._start_time = TimePicker()
@@ -46,50 +129,189 @@ class WorkHours(QWidget):
 
         self._set_work_hours = PushButton('设置工时')
         self._set_work_hours.clicked.connect(lambda: self.set_work_hours())
-        self._layout.addWidget(self._set_work_hours, 3, 3, 1, 3)
+        self._layout.addWidget(self._set_work_hours, 3, 3, 1, 1)
 
-        self._month_select = MonthPicker()
-        self._layout.addWidget(self._month_select, 4, 3, 1, 1)
+        self._undo_btn = PushButton('撤销')
+        self._undo_btn.clicked.connect(lambda: self.undo_work_hours())
+        self._layout.addWidget(self._undo_btn, 3, 4, 1, 1)
+
+        self._redo_btn = PushButton('重做')
+        self._redo_btn.clicked.connect(lambda: self.redo_work_hours())
+        self._layout.addWidget(self._redo_btn, 3, 5, 1, 1)
+        self.update_history_buttons()
+
+        self._query_mode = ComboBox()
+        self._query_mode.addItems(['按月', '按季度', '按年', '按范围'])
+        self._query_mode.currentIndexChanged.connect(lambda _: self.set_query_mode())
+        self._layout.addWidget(self._query_mode, 4, 3, 1, 1)
 
         self._show_work_hours = PushButton('查看工时')
         self._show_work_hours.clicked.connect(lambda: self.counter_work_hours())
         self._layout.addWidget(self._show_work_hours, 4, 5, 1, 1)
 
+        # 按月/季度/年查询时取所选月份所在的季度和年份
+        self._month_select = MonthPicker()
+        self._layout.addWidget(self._month_select, 5, 3, 1, 3)
+
+        self._range_start = DatePicker()
+        self._layout.addWidget(self._range_start, 5, 3, 1, 1)
+
+        self._range_label = BodyLabel('-')
+        self._layout.addWidget(self._range_label, 5, 4, 1, 1)
+
+        self._range_end = DatePicker()
+        self._layout.addWidget(self._range_end, 5, 5, 1, 1)
+        self.set_query_mode()
+
+        self._import_btn = PushButton('导入打卡记录')
+        self._import_btn.clicked.connect(lambda: self.import_punch_file())
+        self._layout.addWidget(self._import_btn, 5, 0, 1, 1)
+
+        self._export_btn = PushButton('导出工时')
+        self._export_btn.clicked.connect(lambda: self.export_report())
+        self._layout.addWidget(self._export_btn, 5, 1, 1, 1)
+
+        self._trend_btn = PushButton('趋势分析')
+        self._trend_btn.clicked.connect(lambda: self.show_trends())
+        self._layout.addWidget(self._trend_btn, 5, 2, 1, 1)
+
+        self._import_progress = ProgressBar()
+        self._import_progress.setVisible(False)
+        self._layout.addWidget(self._import_progress, 6, 0, 1, 3)
+        self._import_thread = None
+
+        self._capture_btn = PushButton('自动补录')
+        self._capture_btn.setToolTip('按系统登录记录补录所选时间内没有工时的日期')
+        self._capture_btn.clicked.connect(lambda: self.capture_punches())
+        self._layout.addWidget(self._capture_btn, 6, 3, 1, 3)
+        self._capture_thread = None
+        self._export_thread = None
+
+        self._profile = ComboBox()
+        self._profile.setToolTip('当前档案')
+        self._profile.currentTextChanged.connect(lambda name: self.change_profile(name))
+        self._layout.addWidget(self._profile, 7, 0, 1, 1)
+
+        self._profile_name = LineEdit()
+        self._profile_name.setPlaceholderText('新档案名称')
+        self._layout.addWidget(self._profile_name, 7, 1, 1, 1)
+
+        self._new_profile_btn = PushButton('新建档案')
+        self._new_profile_btn.clicked.connect(lambda: self.new_profile())
+        self._layout.addWidget(self._new_profile_btn, 7, 2, 1, 1)
+
+        self._team_btn = PushButton('团队汇总')
+        self._team_btn.setToolTip('统计所有档案在所选月份的工时')
+        self._team_btn.clicked.connect(lambda: self.show_team_month())
+        self._layout.addWidget(self._team_btn, 7, 3, 1, 3)
+
         self.oled_screen = TextEdit()
         self.oled_screen.setReadOnly(True)
-        self._layout.addWidget(self.oled_screen, 6, 0, 5, 6)
+        self._layout.addWidget(self.oled_screen, 8, 0, 5, 6)
 
     def comp_init(self):
+        work_calendar.refresh() # 自定义日历可能已修改
+        self._date.refresh()
+        self.set_shift_items()
+        self.set_profile_items()
         self.set_date_type(QDate.currentDate())
 
+    def set_shift_items(self):
+        current = self._select_work_type.currentText()
+        names = load_shift_rules()
+        self._select_work_type.clear()
+        self._select_work_type.addItems(names)
+        if current in names:
+            self._select_work_type.setCurrentText(current)
+
+    def set_profile_items(self, names: list[str]=None):
+        self._profile.blockSignals(True) # 重新填充列表时不触发切换
+        self._profile.clear()
+        self._profile.addItems(names or profile_names())
+        self._profile.setCurrentText(current_profile())
+        self._profile.blockSignals(False)
+
+    def change_profile(self, name: str):
+        if not name or name == current_profile():
+            return
+        try:
+            switch_work_hours_profile(name)
+        except ValueError as e:
+            self.print_msg(str(e))
+            return
+        self._date.refresh()
+        self.update_history_buttons()
+        self.set_date_type(self.clicked_day)
+        self.print_msg(f'已切换到档案: {name}')
+
+    def new_profile(self):
+        name = self._profile_name.text().strip()
+        try:
+            names = new_work_hours_profile(name)
+        except ValueError as e:
+            self.print_msg(str(e))
+            return
+        self._profile_name.clear()
+        self.set_profile_items(names)
+        self._profile.setCurrentText(name) # 新建后切换到该档案
+        self.print_msg(f'已新建档案: {name}')
+
+    def show_team_month(self):
+        year, month = self._month_select.get_month()
+        if not year or not month:
+            self.print_msg('请选择年份和月份进行统计')
+            return
+        self.print_msg(format_team_month(year, month, team_month(year, month)))
+
+    def config_changed(self, keys: list):
+        if 'Shifts' in keys:
+            self.set_shift_items()
+
     def set_date_type(self, date):
         self.clicked_day = date
-        ret, not_ok = is_work_day(date)
-        if not_ok:
-            self.date_type.setText(not_ok)
-            return
-        if ret:
-            self.date_type.setText('工作日')
-            self.is_work_day = True
-        else:
-            self.date_type.setText('休息日')
-            self.is_work_day = False
+        self.is_work_day, note = is_work_day(to_ordinal(date))
+        date_type = '工作日' if self.is_work_day else '休息日'
+        self.date_type.setText(f'{date_type}(推算)' if note else date_type)
+        self.date_type.setToolTip(note)
 
-        effect_hours, _ = get_work_hours_from_db(self.clicked_day)
+        effect_hours, _ = get_work_hours_from_db(to_ordinal(self.clicked_day))
         self.set_info_label(effect_hours)
 
     def set_work_hours(self):
-        effect_hours, total_hours = get_curr_day_work_hours(self._start_time.getTime(), self._end_time.getTime())
+        start_time, end_time = to_minutes(self._start_time.getTime()), to_minutes(self._end_time.getTime())
+        effect_hours, total_hours = get_curr_day_work_hours(start_time, end_time, self._select_work_type.currentText())
         if effect_hours < 0:
             self.print_msg('时间异常, 请检查后重新设置!')
             return
-        set_work_hours_to_db(self.clicked_day, effect_hours, total_hours, self.is_work_day)
+        set_work_hours_to_db(to_ordinal(self.clicked_day), effect_hours, total_hours, self.is_work_day, start_time, end_time)
+        self._date.refresh()
+        self.update_history_buttons()
         self.set_info_label(effect_hours)
         if effect_hours == 0 and total_hours == 0:
             self.print_msg('当日工时已清空')
         else:
             self.print_msg('设置成功')
 
+    def update_history_buttons(self):
+        self._undo_btn.setEnabled(edit_history.can_undo())
+        self._redo_btn.setEnabled(edit_history.can_redo())
+
+    def undo_work_hours(self):
+        self.apply_history(edit_history.undo(), '已撤销')
+
+    def redo_work_hours(self):
+        self.apply_history(edit_history.redo(), '已重做')
+
+    def apply_history(self, day: int | None, action: str):
+        self.update_history_buttons()
+        if day is None:
+            return
+        self._date.refresh()
+        if to_ordinal(self.clicked_day) == day:
+            self.set_date_type(self.clicked_day)
+        date = QDate.fromJulianDay(day + JULIAN_DAY_OFFSET)
+        self.print_msg(f'{action}{date.year()}年{date.month()}月{date.day()}日的工时修改')
+
     def set_info_label(self, effect_hours):
         if self.is_work_day:
             if effect_hours == 0:
@@ -99,13 +321,161 @@ class WorkHours(QWidget):
         else:
             self.info_label.setText('请好好放松')
 
-    def counter_work_hours(self):
+    def set_query_mode(self):
+        is_range = self._query_mode.currentText() == '按范围'
+        self._month_select.setVisible(not is_range)
+        for widget in (self._range_start, self._range_label, self._range_end):
+            widget.setVisible(is_range)
+
+    def selected_range(self) -> tuple[QDate, QDate] | None:
+        """ 按查询方式返回所选的起止日期, 未选择时提示并返回None """
+        mode = self._query_mode.currentText()
+        if mode == '按范围':
+            start, end = self._range_start.getDate(), self._range_end.getDate()
+            if not start.isValid() or not end.isValid():
+                self.print_msg('请选择起止日期进行查询')
+                return None
+            if start > end:
+                self.print_msg('开始日期不能晚于结束日期')
+                return None
+            return start, end
         year, month = self._month_select.get_month()
         if not year or not month:
             self.print_msg('请选择年份和月份进行查询')
+            return None
+        if mode == '按季度':
+            start = QDate(year, (month - 1) // 3 * 3 + 1, 1)
+            return start, start.addMonths(3).addDays(-1)
+        if mode == '按年':
+            return QDate(year, 1, 1), QDate(year, 12, 31)
+        start = QDate(year, month, 1)
+        return start, start.addMonths(1).addDays(-1)
+
+    def counter_work_hours(self):
+        mode = self._query_mode.currentText()
+        if mode == '按范围':
+            dates = self.selected_range()
+            if dates is None:
+                return
+            start, end = dates
+            effect_hours, total_hours = query_work_hours_range(to_ordinal(start), to_ordinal(end))
+            title = f'{start.toString("yyyy年M月d日")}至{end.toString("yyyy年M月d日")}'
+        else:
+            year, month = self._month_select.get_month()
+            if not year or not month:
+                self.print_msg('请选择年份和月份进行查询')
+                return
+            if mode == '按季度':
+                quarter = (month - 1) // 3 + 1
+                effect_hours, total_hours = query_work_hours_quarter(year, quarter)
+                title = f'{year}年第{quarter}季度'
+            elif mode == '按年':
+                effect_hours, total_hours = query_work_hours_year(year)
+                title = f'{year}年'
+            else:
+                effect_hours, total_hours = query_work_hours(year, month)
+                title = f'{year}年{month}月'
+        # 汇总按差值累加, 取两位小数消除浮点误差
+        self.print_msg(f'{title}的有效工时为: {round(effect_hours, 2)}, 总工时为: {round(total_hours, 2)}')
+
+    def show_trends(self):
+        dates = self.selected_range()
+        if dates is None:
+            return
+        start, end = dates
+        trends = get_trends(to_ordinal(start), to_ordinal(end))
+        self.print_msg(f'{start.toString("yyyy年M月d日")}至{end.toString("yyyy年M月d日")}\n{format_trends(trends)}')
+
+    def export_report(self):
+        dates = self.selected_range()
+        if dates is None:
             return
-        effect_hours, total_hours = query_work_hours(year, month)
-        self.print_msg(f'{year}年{month}月的有效工时为: {effect_hours}, 总工时为: {total_hours}')
+        start, end = dates
+        path, _ = QFileDialog.getSaveFileName(self, '导出工时', f'工时_{start.toString("yyyyMMdd")}_{end.toString("yyyyMMdd")}.xlsx',
+                                              '工时报表 (*.xlsx *.csv *.json)')
+        if not path:
+            return
+        self._export_btn.setEnabled(False)
+        self.print_msg('正在导出中, 请稍后……')
+        self._export_thread = Asynchronous(self.export_report_task, self.stop_export, [path, to_ordinal(start), to_ordinal(end)])
+        self._export_thread.start()
+
+    def export_report_task(self, args):
+        path, start_day, end_day = args
+        try:
+            export_work_hours(start_day, end_day, path)
+        except Exception as e:
+            log_error(f'导出工时 {path} 失败: {e}')
+            return f'导出失败: {e}'
+        return f'已导出到: {path}'
+
+    def stop_export(self, thread: QThread, ret):
+        thread.quit()
+        self._export_btn.setEnabled(True)
+        self.print_msg(ret)
+
+    def import_punch_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, '选择打卡记录', '', '打卡记录 (*.csv *.xlsx)')
+        if not path:
+            return
+        self._import_btn.setEnabled(False)
+        self._import_progress.setValue(0)
+        self._import_progress.setVisible(True)
+        self.print_msg('正在导入中, 请稍后……')
+        # 文件中没有班次列时按当前选择的班次计算
+        self._import_thread = Asynchronous(self.import_punch_task, self.stop_import, [path, self._select_work_type.currentText()],
+                                           progress_func=self._import_progress.setValue)
+        self._import_thread.start()
+
+    def import_punch_task(self, args):
+        path, classes = args
+        try:
+            ret = import_punches(path, classes=classes, progress=self._import_thread.progress_signal.emit)
+        except Exception as e:
+            log_error(f'导入打卡记录 {path} 失败: {e}')
+            return f'导入失败: {e}'
+        message = f'导入完成, 共{ret.imported}天, 跳过{ret.skipped}行无效记录'
+        if ret.unknown_shifts:
+            message += f', 其中包含不存在的班次: {", ".join(sorted(ret.unknown_shifts))}'
+        return message
+
+    def stop_import(self, thread: QThread, ret):
+        thread.quit()
+        self._import_btn.setEnabled(True)
+        self._import_progress.setVisible(False)
+        self.print_msg(ret)
+        self._date.refresh()
+        self.set_date_type(self.clicked_day) # 刷新当天工时
+
+    def capture_punches(self):
+        dates = self.selected_range()
+        if dates is None:
+            return
+        if not default_providers():
+            self.print_msg('本机没有可用的登录记录, 无法自动补录')
+            return
+        start, end = dates
+        self._capture_btn.setEnabled(False)
+        self.print_msg('正在补录中, 请稍后……')
+        self._capture_thread = Asynchronous(self.capture_punches_task, self.stop_capture,
+                                            [to_ordinal(start), to_ordinal(end), self._select_work_type.currentText()])
+        self._capture_thread.start()
+
+    def capture_punches_task(self, args):
+        start_day, end_day, classes = args
+        try:
+            ret = fill_missing_days(start_day, end_day, classes)
+        except Exception as e:
+            log_error(f'自动补录工时失败: {e}')
+            return f'补录失败: {e}'
+        return f'补录完成, 共{ret.imported}天, {ret.skipped}天的登录记录无法推算上下班时间'
+
+    def stop_capture(self, thread: QThread, ret):
+        thread.quit()
+        self._capture_btn.setEnabled(True)
+        self.print_msg(ret)
+        self._date.refresh()
+        self.set_date_type(self.clicked_day)
 
     def print_msg(self, text):
         self.oled_screen.setPlainText(text)
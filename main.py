@@ -10,7 +10,7 @@ from PySide6.QtWidgets import QApplication
 from PySide6.QtCore import QTranslator, QLocale
 
 from source.util.log import log_error
-from source.util.db import config_init
+from source.util.db import config_init, config_close
 from source.util.common_util import isWin11
 from gui.main_window import MainWindow
 
@@ -38,7 +38,9 @@ def main():
 
         application = MainWindow()
         application.show()
-        sys.exit(app.exec())
+        ret = app.exec()
+        config_close() # 落盘尚未写入的配置
+        sys.exit(ret)
     except SystemExit: # 系统退出会抛出异常, 无需关注
         pass
     except Exception:
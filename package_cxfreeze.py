@@ -40,7 +40,7 @@ setup(
     description = 'MindLeader',
     auther = '拓跋龙',
     options = {'build_exe': {
-        'includes': ['dbm.dumb'], # 需要额外打包的库
+        'includes': ['dbm.dumb'], # 需要额外打包的库, dbm.dumb用于迁移旧版本配置DB
         'excludes': [], # 不需要打包的库
     }},
     executables = [main_target]
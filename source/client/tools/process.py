@@ -4,23 +4,188 @@
 
 '''
 提供了一些用于处理进程的工具类，包括通过窗体标题获取PID、终止进程等功能。
-所有的功能为Windows系统专用，不支持Unix系统
+进程列表由ProcessProvider提供, 按平台选择:
+    Windows: psutil枚举全部进程, EnumWindows补充可见窗体的标题
+    Linux: 直接读取/proc/<pid>/stat
+    其他: psutil
+Windows API的函数原型在导入时绑定一次, 之后每次枚举直接调用。
+按标题查找进程时使用iter_windows, 同一进程的每个窗体(包括隐藏的窗体)都参与匹配。
 '''
 
 import ctypes
-import ctypes.wintypes as wintypes
 import fnmatch
 import os
 import re
 import signal
 import subprocess
 import sys
-from typing import Literal
+import time
+from typing import Any, Callable, Iterable, Iterator, Literal, NamedTuple
 
 import psutil
 
 from source.util.log import log_error, log_info
 
+class ProcessInfo(NamedTuple):
+    pid: int
+    name: str
+    title: str # 第一个可见窗体的标题, 只用于展示, 没有窗体时为空
+    ppid: int
+    create_time: float = 0 # 启动时间(Unix时间戳), 用于识别pid复用, 未知时为0
+
+class WindowInfo(NamedTuple):
+    hwnd: int # 非Windows平台为0
+    pid: int
+    title: str
+    visible: bool
+
+if sys.platform == 'win32':
+    import ctypes.wintypes as wintypes
+
+    _user32 = ctypes.WinDLL('user32', use_last_error=True)
+
+    _EnumWindowsProc = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)
+
+    _EnumWindows = _user32.EnumWindows
+    _EnumWindows.argtypes = [_EnumWindowsProc, wintypes.LPARAM]
+    _EnumWindows.restype = wintypes.BOOL
+
+    _FindWindow = _user32.FindWindowW
+    _FindWindow.argtypes = [wintypes.LPCWSTR, wintypes.LPCWSTR]
+    _FindWindow.restype = wintypes.HWND
+
+    _IsWindowVisible = _user32.IsWindowVisible
+    _IsWindowVisible.argtypes = [wintypes.HWND]
+    _IsWindowVisible.restype = wintypes.BOOL
+
+    _GetWindowTextLength = _user32.GetWindowTextLengthW
+    _GetWindowTextLength.argtypes = [wintypes.HWND]
+    _GetWindowTextLength.restype = ctypes.c_int
+
+    _GetWindowText = _user32.GetWindowTextW
+    _GetWindowText.argtypes = [wintypes.HWND, wintypes.LPWSTR, ctypes.c_int]
+    _GetWindowText.restype = ctypes.c_int
+
+    _GetWindowThreadProcessId = _user32.GetWindowThreadProcessId
+    _GetWindowThreadProcessId.argtypes = [wintypes.HWND, ctypes.POINTER(wintypes.DWORD)]
+    _GetWindowThreadProcessId.restype = wintypes.DWORD
+
+    def _window_pid(hwnd) -> int:
+        pid = wintypes.DWORD()
+        _GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+        return pid.value
+
+    def _enum_windows() -> list[WindowInfo]:
+        """ 全部有标题的顶层窗体, 包括隐藏的窗体, 同一进程的多个窗体各占一项 """
+        windows = []
+        buffer = ctypes.create_unicode_buffer(512)
+
+        def foreach_window(hwnd, _):
+            length = _GetWindowTextLength(hwnd)
+            if length > 0:
+                if length >= len(buffer):
+                    title = ctypes.create_unicode_buffer(length + 1)
+                    _GetWindowText(hwnd, title, length + 1)
+                    text = title.value
+                else:
+                    _GetWindowText(hwnd, buffer, len(buffer))
+                    text = buffer.value
+                windows.append(WindowInfo(hwnd, _window_pid(hwnd), text, bool(_IsWindowVisible(hwnd))))
+            return True
+
+        _EnumWindows(_EnumWindowsProc(foreach_window), 0)
+        return windows
+
+    def _window_titles() -> dict[int, str]:
+        """ 用于展示的标题, 进程号 -> 该进程第一个可见且有标题的窗体 """
+        titles = {}
+        for window in _enum_windows():
+            if window.visible:
+                titles.setdefault(window.pid, window.title)
+        return titles
+
+class ProcessProvider:
+    """ 进程列表来源 """
+
+    def iter_processes(self) -> Iterator[ProcessInfo]:
+        raise NotImplementedError
+
+class PsutilProvider(ProcessProvider):
+    """ 通用实现, 不提供窗体标题 """
+
+    def _titles(self) -> dict[int, str]:
+        return {}
+
+    def iter_processes(self) -> Iterator[ProcessInfo]:
+        titles = self._titles()
+        for process in psutil.process_iter(['pid', 'name', 'ppid', 'create_time']):
+            info = process.info
+            yield ProcessInfo(info['pid'], info['name'] or '', titles.get(info['pid'], ''), info['ppid'] or 0,
+                              info['create_time'] or 0)
+
+class WindowsProvider(PsutilProvider):
+    def _titles(self) -> dict[int, str]:
+        return _window_titles()
+
+class ProcProvider(ProcessProvider):
+    """ Linux下直接读取/proc, 每个进程只读一个stat文件 """
+
+    COMM_LENGTH = 15 # 内核截断进程名的长度
+
+    def __init__(self, root='/proc'):
+        self.root = root
+        self._clock_ticks = os.sysconf('SC_CLK_TCK')
+        self._boot_time = psutil.boot_time() # stat中的启动时间为开机后的时钟周期数
+
+    def _full_name(self, pid: str, comm: str) -> str:
+        """ 进程名被截断时由命令行补全, 与psutil一致 """
+        try:
+            with open(f'{self.root}/{pid}/cmdline', 'rb') as f:
+                exe = f.read().split(b'\0', 1)[0].decode(errors='replace')
+        except OSError:
+            return comm
+        name = os.path.basename(exe)
+        return name if name.startswith(comm) else comm
+
+    def iter_processes(self) -> Iterator[ProcessInfo]:
+        for entry in os.scandir(self.root):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f'{self.root}/{entry.name}/stat', 'rb') as f:
+                    data = f.read()
+            except OSError: # 进程已退出
+                continue
+            # 格式为: pid (comm) state ppid ..., comm中可能包含空格和括号; ")"之后第19项为starttime
+            left, right = data.index(b'('), data.rindex(b')')
+            name = data[left + 1:right].decode(errors='replace')
+            if len(name) >= self.COMM_LENGTH:
+                name = self._full_name(entry.name, name)
+            fields = data[right + 2:].split(None, 20)
+            yield ProcessInfo(int(entry.name), name, '', int(fields[1]),
+                              self._boot_time + int(fields[19]) / self._clock_ticks)
+
+def default_provider() -> ProcessProvider:
+    if sys.platform == 'win32':
+        return WindowsProvider()
+    if sys.platform.startswith('linux') and os.path.isdir('/proc'):
+        return ProcProvider()
+    return PsutilProvider()
+
+process_provider = default_provider()
+
+def iter_processes(windowed_only=False) -> Iterator[ProcessInfo]:
+    """ 逐个返回进程信息
+
+    Parameters
+    ----------
+    windowed_only: bool
+        只返回有可见窗体的进程
+    """
+    for info in process_provider.iter_processes():
+        if info.title or not windowed_only:
+            yield info
+
 """
 一个用于处理系统进程的工具类，专为Windows系统设计。
 
@@ -67,7 +232,6 @@ from source.util.log import log_error, log_info
     ```
 """
 
-@staticmethod
 def get_pid_by_full_window_title(title: str) -> int:
     """通过完整的窗体标题获取对应程序的PID
 
@@ -77,31 +241,15 @@ def get_pid_by_full_window_title(title: str) -> int:
     Returns:
         int: 对应的进程PID，如果未找到返回-1。
     """
-    # 定义所需的Windows API函数
-    user32 = ctypes.WinDLL('user32', use_last_error=True)
-
-    # FindWindow函数，用于查找窗体句柄
-    FindWindow = user32.FindWindowW
-    FindWindow.argtypes = [wintypes.LPCWSTR, wintypes.LPCWSTR]
-    FindWindow.restype = wintypes.HWND
-
-    # GetWindowThreadProcessId函数，用于获取进程ID
-    GetWindowThreadProcessId = user32.GetWindowThreadProcessId
-    GetWindowThreadProcessId.argtypes = [wintypes.HWND, ctypes.POINTER(wintypes.DWORD)]
-    GetWindowThreadProcessId.restype = wintypes.DWORD
-
+    if sys.platform != 'win32':
+        return _get_pid(title, "full")
     try:
         # 查找窗体句柄
-        hwnd = FindWindow(None, title)
+        hwnd = _FindWindow(None, title)
         if not hwnd:
             print(f"未找到标题为 '{title}' 的窗体。")
             return -1
-
-        # 获取进程ID
-        pid = wintypes.DWORD()
-        GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
-
-        return pid.value
+        return _window_pid(hwnd)
 
     except Exception as e:
         print(f"发生错误: {e}")
@@ -140,144 +288,330 @@ def get_pid_by_partial_window_title(title: str) -> int:
     """
     return _get_pid(title, "partial")
 
-def kill_process(pid: int) -> bool:
-    """通过PID终止指定的进程
+def _wait_procs(processes: list[psutil.Process], timeout: float, callback: Callable[[psutil.Process], Any]) -> list[psutil.Process]:
+    """ 同psutil.wait_procs, 但已退出而未被父进程回收的僵尸进程也视为已停止, 返回仍在运行的进程 """
+    deadline = time.monotonic() + timeout
+    while processes:
+        remaining = max(deadline - time.monotonic(), 0)
+        _, alive = psutil.wait_procs(processes, timeout=min(remaining, 0.1), callback=callback)
+        processes = []
+        for process in alive:
+            try:
+                zombie = process.status() == psutil.STATUS_ZOMBIE
+            except psutil.NoSuchProcess:
+                zombie = True
+            if zombie:
+                callback(process)
+            else:
+                processes.append(process)
+        if remaining <= 0:
+            break
+    return processes
+
+def kill_processes(pids: Iterable[int], timeout: float=5, callback: Callable[[int, bool], Any]=None) -> dict[int, bool]:
+    """通过PID批量终止进程
 
-    尝试终止指定的进程，通过以下步骤：
-    1. 发送SIGTERM信号优雅停止。
-    2. 发送SIGKILL信号强制停止。
-    3. 如果依旧无法停止，则请求管理员权限并使用os.kill。
-    4. 如果依旧无法停止，则使用taskkill命令。
+    所有进程同时处理, 每一步只对上一步未停止的进程继续：
+    1. 发送SIGTERM信号优雅停止, 用psutil.wait_procs一起等待。
+    2. 仍未停止的发送SIGKILL信号强制停止, 再一起等待。
+    3. 仍未停止或权限不足的使用os.kill, Windows上再使用taskkill。
 
     Args:
-        pid (int): 要终止的进程ID。
+        pids (Iterable[int]): 要终止的进程ID。
+        timeout (float): 每一步最多等待的秒数。
+        callback (Callable[[int, bool], Any]): 每个进程有结果时立即调用, 参数为进程ID与是否已终止。
 
     Returns:
-        bool: 如果进程成功终止，返回True；否则返回False。
+        dict[int, bool]: 进程ID -> 是否已终止。
     """
-    try:
-        process = psutil.Process(pid)
+    results = {}
+
+    def report(pid: int, ok: bool, message: str):
+        if pid in results:
+            return
+        results[pid] = ok
+        if ok:
+            log_info(f"进程 {pid} {message}")
+        else:
+            log_error(f"进程 {pid} {message}")
+        if callback is not None:
+            callback(pid, ok)
 
-        # Step 1: 尝试发送SIGTERM信号优雅停止
-        process.terminate()
+    processes = []
+    for pid in dict.fromkeys(pids):
         try:
-            process.wait(timeout=5)
-        except psutil.TimeoutExpired:
-            pass
+            processes.append(psutil.Process(pid))
+        except psutil.NoSuchProcess:
+            report(pid, False, "不存在。")
+
+    denied = []
+    for step, message in (('terminate', '已优雅停止。'), ('kill', '已强制停止。')):
+        alive = []
+        for process in processes:
+            try:
+                getattr(process, step)()
+                alive.append(process)
+            except psutil.ZombieProcess:
+                report(process.pid, False, "是僵尸进程。")
+            except psutil.NoSuchProcess: # 发送信号前已退出
+                report(process.pid, True, message)
+            except psutil.AccessDenied:
+                denied.append(process)
+        if not alive:
+            processes = []
+            break
+        processes = _wait_procs(alive, timeout, lambda process: report(process.pid, True, message))
+
+    for process in processes + denied:
+        pid = process.pid
+        try:
+            os.kill(pid, signal.SIGKILL if hasattr(signal, 'SIGKILL') else signal.SIGTERM)
+            report(pid, True, "已使用os.kill成功终止。")
+            continue
+        except (PermissionError, ProcessLookupError, OSError) as e:
+            log_error(f"使用os.kill终止 {pid} 失败: {e}")
+        if os.name == 'nt':
+            try:
+                subprocess.check_call(['taskkill', '/F', '/PID', str(pid)])
+                report(pid, True, "已使用taskkill成功终止。")
+                continue
+            except subprocess.CalledProcessError as e:
+                log_error(f"使用taskkill终止 {pid} 失败: {e}")
+        report(pid, False, "无法终止。")
+    return results
 
-        if not process.is_running():
-            log_info(f"进程 {pid} 已优雅停止。")
-            return True
+def kill_process(pid: int) -> bool:
+    """通过PID终止指定的进程, 步骤见kill_processes
 
-        # Step 2: 发送SIGKILL信号强制停止
-        process.kill()
-        try:
-            process.wait(timeout=5)
-        except psutil.TimeoutExpired:
-            pass
+    Args:
+        pid (int): 要终止的进程ID。
 
-        if not process.is_running():
-            log_info(f"进程 {pid} 已强制停止。")
-            return True
+    Returns:
+        bool: 如果进程成功终止，返回True；否则返回False。
+    """
+    return kill_processes([pid])[pid]
 
-    except (psutil.NoSuchProcess, psutil.ZombieProcess):
-        # 如果进程不存在或是僵尸进程，返回False
-        log_error(f"进程 {pid} 不存在或是僵尸进程。")
-        return False
-    except psutil.AccessDenied:
-        # 如果权限不足，尝试提升权限
-        try:
-            ctypes.windll.shell32.ShellExecuteW(
-                    None, "runas", sys.executable, f"{__file__} {pid}", None, 1
-                    )
-            return True
-        except Exception as e:
-            log_error(f"管理员权限请求失败: {e}")
+class ProcessTree(NamedTuple):
+    children: dict[int, list[int]] # 父进程ID -> 子进程ID
+    roots: list[int] # 父进程不在快照中的进程
 
-    # Step 3: 提升权限后再尝试使用os.kill
-    try:
-        os.kill(pid, signal.SIGKILL)
-        log_info(f"进程 {pid} 已使用os.kill成功终止。")
-        return True
-    except (PermissionError, ProcessLookupError) as e:
-        log_error(f"使用os.kill终止失败: {e}")
-
-    # Step 4: 最后一步，尝试在Windows上使用taskkill强制终止进程
-    if os.name == 'nt':
-        try:
-            subprocess.check_call(['taskkill', '/F', '/PID', str(pid)])
-            log_info(f"进程 {pid} 已使用taskkill成功终止。")
-            return True
-        except subprocess.CalledProcessError as e:
-            log_error(f"使用taskkill终止失败: {e}")
-
-    # 如果所有尝试都失败，返回False
-    log_error(f"无法终止进程 {pid}。")
-    return False
-
-def _get_pid(search_title: str, current_mode: Literal["regex", "fnmatch", "partial"]) -> int:
-    """通过正则表达式匹配窗体标题获取对应程序的PID"""
-    # 定义所需的Windows API函数
-    user32 = ctypes.WinDLL('user32', use_last_error=True)
-
-    GetWindowThreadProcessId = user32.GetWindowThreadProcessId
-    GetWindowThreadProcessId.argtypes = [wintypes.HWND, ctypes.POINTER(wintypes.DWORD)]
-    GetWindowThreadProcessId.restype = wintypes.DWORD
-
-    windows = get_processes()
-
-    for title, pid in windows:
-        if current_mode == "regex":
-            if re.search(search_title, title):
-                return pid
-        elif current_mode == "fnmatch":
-            if fnmatch.fnmatch(title, search_title):
-                return pid
-        elif current_mode == "partial":
-            if search_title.lower() in title.lower():
-                return pid
-    return -1
-
-def get_processes():
-    # 定义所需的Windows API函数
-    user32 = ctypes.WinDLL('user32', use_last_error=True)
-    
-    # 定义用于枚举窗口的回调函数类型
-    EnumWindowsProc = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)
-
-    # 定义所需的Windows API函数
-    EnumWindows = user32.EnumWindows
-    EnumWindows.argtypes = [EnumWindowsProc, wintypes.LPARAM]
-    EnumWindows.restype = wintypes.BOOL
-
-    GetWindowTextLength = user32.GetWindowTextLengthW
-    GetWindowTextLength.argtypes = [wintypes.HWND]
-    GetWindowTextLength.restype = ctypes.c_int
-
-    GetWindowText = user32.GetWindowTextW
-    GetWindowText.argtypes = [wintypes.HWND, wintypes.LPWSTR, ctypes.c_int]
-    GetWindowText.restype = ctypes.c_int
-    processes = []
+def build_process_tree(processes: Iterable[ProcessInfo]) -> ProcessTree:
+    """ 由一次快照按ppid建立父子关系, 只遍历快照一次
 
-    GetWindowThreadProcessId = user32.GetWindowThreadProcessId
-    GetWindowThreadProcessId.argtypes = [wintypes.HWND, ctypes.POINTER(wintypes.DWORD)]
-    GetWindowThreadProcessId.restype = wintypes.DWORD
+    父进程退出后其pid可能被新进程复用(Windows上很常见), 此时ppid指向的是无关的进程;
+    与psutil.Process.children一致, 只有子进程的启动时间不早于父进程时才视为父子, 否则作为根。
+    """
+    processes = list(processes)
+    create_times = {info.pid: info.create_time for info in processes}
+    children: dict[int, list[int]] = {}
+    roots = []
+    for info in processes:
+        # Windows的System Idle Process(0)的父进程是自身
+        parent_time = create_times.get(info.ppid)
+        if parent_time is not None and info.ppid != info.pid and info.create_time >= parent_time:
+            children.setdefault(info.ppid, []).append(info.pid)
+        else:
+            roots.append(info.pid)
+    return ProcessTree(children, roots)
+
+def subtree_levels(tree: ProcessTree, pids: Iterable[int]) -> list[list[int]]:
+    """ 以pids为根的子树按深度分层, 第0层为根; 根之间有包含关系时按外层的深度计算 """
+    depths: dict[int, int] = {}
+    for root in pids:
+        level = [root]
+        depth = 0
+        while level:
+            next_level = []
+            for pid in level:
+                if depths.get(pid, -1) < depth:
+                    depths[pid] = depth
+                    next_level += tree.children.get(pid, ())
+            level = next_level
+            depth += 1
+    levels: list[list[int]] = [[] for _ in range(max(depths.values(), default=-1) + 1)]
+    for pid, depth in depths.items():
+        levels[depth].append(pid)
+    return levels
+
+def kill_process_trees(pids: Iterable[int], timeout: float=5, callback: Callable[[int, bool], Any]=None,
+                       processes: Iterable[ProcessInfo]=None) -> dict[int, bool]:
+    """通过PID终止进程及其全部子进程
+
+    从最深的一层开始逐层终止, 同一层的进程作为一批同时终止(见kill_processes),
+    避免父进程先退出后子进程被系统收养而遗留。
 
-    def foreach_window(hwnd, _):
-        length = GetWindowTextLength(hwnd)
-        if length > 0:
-            buffer = ctypes.create_unicode_buffer(length + 1)
-            GetWindowText(hwnd, buffer, length + 1)
-            pid = wintypes.DWORD()
-            GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
-            processes.append([buffer.value, pid.value])
-        return True
+    Args:
+        pids (Iterable[int]): 进程树的根进程ID。
+        processes (Iterable[ProcessInfo]): 进程快照, 默认重新枚举一次。
+
+    Returns:
+        dict[int, bool]: 进程ID -> 是否已终止。
+    """
+    tree = build_process_tree(iter_processes() if processes is None else processes)
+    results = {}
+    for level in reversed(subtree_levels(tree, pids)):
+        results.update(kill_processes(level, timeout, callback))
+    return results
+
+MatchMode = Literal["regex", "fnmatch", "partial", "full"]
+
+class WindowMatch(NamedTuple):
+    index: int # 模式在WindowMatcher.patterns中的下标, 同一字符串以不同方式匹配时可区分
+    pattern: str
+    pid: int
+    title: str
+
+class WindowMatcher:
+    """ 预编译的窗体标题匹配器, 一次枚举即可匹配全部模式
+
+    模式可为字符串(按默认匹配方式)或(模式, 匹配方式)元组, 匹配方式:
+        regex: 正则表达式, 同re.search
+        fnmatch: 通配符, 同fnmatch.fnmatch
+        partial: 忽略大小写的部分标题
+        full: 完整标题
+    """
 
-    EnumWindows(EnumWindowsProc(foreach_window), 0)
+    def __init__(self, patterns: Iterable[str | tuple[str, MatchMode]], mode: MatchMode="partial"):
+        self.patterns: list[str] = []
+        self._regex: list[tuple[int, re.Pattern]] = []
+        self._fnmatch: list[tuple[int, re.Pattern]] = []
+        self._partial: list[tuple[int, str]] = []
+        self._full: dict[str, list[int]] = {}
+        for item in patterns:
+            pattern, pattern_mode = (item, mode) if isinstance(item, str) else item
+            i = len(self.patterns)
+            self.patterns.append(pattern)
+            if pattern_mode == "regex":
+                self._regex.append((i, re.compile(pattern)))
+            elif pattern_mode == "fnmatch":
+                self._fnmatch.append((i, re.compile(fnmatch.translate(os.path.normcase(pattern)))))
+            elif pattern_mode == "partial":
+                self._partial.append((i, pattern.lower()))
+            elif pattern_mode == "full":
+                self._full.setdefault(pattern, []).append(i)
+            else:
+                raise ValueError(f"不支持的匹配方式: {pattern_mode}")
+
+    def match_title(self, title: str) -> list[int]:
+        """ 与标题匹配的模式下标 """
+        matched = [i for i, pattern in self._regex if pattern.search(title)]
+        if self._fnmatch:
+            normcase = os.path.normcase(title)
+            matched += [i for i, pattern in self._fnmatch if pattern.match(normcase)]
+        if self._partial:
+            lower = title.lower()
+            matched += [i for i, pattern in self._partial if pattern in lower]
+        matched += self._full.get(title, ())
+        return matched
+
+    def match(self, windows: Iterable[WindowInfo | ProcessInfo]=None) -> list[WindowMatch]:
+        """ 在一次窗体快照中匹配全部模式
+
+        Args:
+            windows (Iterable[WindowInfo | ProcessInfo]): 窗体快照, 默认枚举一次全部窗体(见iter_windows),
+                同一进程的每个窗体分别匹配。
+
+        Returns:
+            list[WindowMatch]: 所有匹配的(模式下标, 模式, 进程ID, 标题), 按快照顺序排列。
+        """
+        windows = iter_windows() if windows is None else windows
+        matches = []
+        for window in windows:
+            if window.title:
+                matches += [WindowMatch(i, self.patterns[i], window.pid, window.title) for i in sorted(self.match_title(window.title))]
+        return matches
+
+    def first_pids(self, windows: Iterable[WindowInfo | ProcessInfo]=None) -> list[int]:
+        """ 按模式的顺序返回每个模式第一个匹配的进程ID, 未匹配的为-1 """
+        pids = [-1] * len(self.patterns)
+        for match in self.match(windows):
+            if pids[match.index] == -1:
+                pids[match.index] = match.pid
+        return pids
+
+def find_windows(patterns: Iterable[str | tuple[str, MatchMode]], mode: MatchMode="partial") -> list[WindowMatch]:
+    """ 批量查找窗体, 见WindowMatcher """
+    return WindowMatcher(patterns, mode).match()
+
+def _get_pid(search_title: str, current_mode: MatchMode) -> int:
+    """通过窗体标题匹配对应程序的PID"""
+    return WindowMatcher([(search_title, current_mode)]).first_pids()[0]
+
+def iter_windows() -> Iterator[WindowInfo]:
+    """ 逐个返回有标题的窗体, 用于按标题查找进程
+
+    Windows下枚举全部顶层窗体(与ProcessInfo.title不同, 包括隐藏的窗体和同一进程的其他窗体),
+    其他平台没有窗体枚举, 使用进程列表中的标题。
+    """
+    if sys.platform == 'win32':
+        yield from _enum_windows()
+        return
+    for info in iter_processes(windowed_only=True):
+        yield WindowInfo(0, info.pid, info.title, True)
 
-    return processes
+def get_processes(windowed_only=False) -> list[ProcessInfo]:
+    return list(iter_processes(windowed_only))
 
 if __name__ == '__main__':
+    # 比较各进程列表来源的刷新耗时, 并检查结果与psutil一致
+    count = 20
+    providers = [PsutilProvider(), process_provider] if type(process_provider) is not PsutilProvider else [process_provider]
+    for provider in providers:
+        begin = time.perf_counter()
+        for _ in range(count):
+            processes = list(provider.iter_processes())
+        cost = (time.perf_counter() - begin) / count
+        print(f'{type(provider).__name__}: {len(processes)}个进程, 每次刷新 {cost * 1000:.2f}ms')
+    expect = {(info.pid, info.name, info.ppid, round(info.create_time, 1)) for info in PsutilProvider().iter_processes()}
+    actual = {(info.pid, info.name, info.ppid, round(info.create_time, 1)) for info in process_provider.iter_processes()}
+    print(f'与psutil结果差异: {len(expect ^ actual)}项(期间启动或退出的进程)')
+
+    # 50个模式逐个查找与一次批量匹配的耗时, 使用同一份模拟的窗体快照(每个进程两个窗体), 不含枚举本身的开销
+    snapshot = [WindowInfo(hwnd, hwnd % 150 + 1, f'文档{hwnd} - 编辑器 {hwnd % 7}', hwnd % 2 == 0) for hwnd in range(1, 301)]
+    patterns = ([(f'文档{i} - ', 'partial') for i in range(0, 300, 15)] + [(rf'编辑器 {i}$', 'regex') for i in range(5)]
+                + [(f'*{i}[0-9] - *', 'fnmatch') for i in range(25)])
+    begin = time.perf_counter()
+    for _ in range(count):
+        expect = []
+        for i, (pattern, mode) in enumerate(patterns): # 旧实现: 每个模式遍历一次, 逐行解释模式
+            for window in snapshot:
+                title = window.title
+                if (mode == 'regex' and re.search(pattern, title)) or (mode == 'fnmatch' and fnmatch.fnmatch(title, pattern)) \
+                        or (mode == 'partial' and pattern.lower() in title.lower()):
+                    expect.append((i, window.pid, title))
+    old_cost = (time.perf_counter() - begin) / count
+    begin = time.perf_counter()
+    for _ in range(count):
+        matches = WindowMatcher(patterns).match(snapshot)
+    cost = (time.perf_counter() - begin) / count
+    same = sorted(expect) == sorted((match.index, match.pid, match.title) for match in matches)
+    print(f'{len(patterns)}个模式 x {len(snapshot)}个窗体: 逐个匹配 {old_cost * 1000:.2f}ms, '
+          f'预编译批量匹配 {cost * 1000:.2f}ms, 共{len(matches)}个匹配, 结果{"一致" if same else "不一致"}')
+    # 同一字符串以不同方式匹配时各自返回结果
+    pids = WindowMatcher([('文档1?? - *', 'fnmatch'), ('文档1?? - *', 'partial')]).first_pids(snapshot)
+    print(f'同一模式按通配符/部分标题匹配的进程: {pids}')
+
+    # 父进程退出后pid被复用: 启动时间早于新父进程的"子进程"不挂到它下面
+    snapshot = [ProcessInfo(1, 'init', '', 0, 100), ProcessInfo(500, 'reused', '', 1, 300),
+                ProcessInfo(600, 'orphan', '', 500, 200), ProcessInfo(700, 'child', '', 500, 400)]
+    tree = build_process_tree(snapshot)
+    print(f'pid复用: 500的子进程 {tree.children.get(500)}, 根 {tree.roots}')
+
+    # 三层的进程树(每个进程启动两个子进程), 从底层开始逐层终止
+    code = ('import subprocess, sys, time\n'
+            'depth = int(sys.argv[1])\n'
+            'children = [subprocess.Popen([sys.executable, "-c", sys.argv[2], str(depth - 1), sys.argv[2]]) for _ in range(2 if depth else 0)]\n'
+            'time.sleep(60)\n')
+    root = subprocess.Popen([sys.executable, '-c', code, '2', code])
+    time.sleep(2)
+    tree = build_process_tree(iter_processes())
+    levels = subtree_levels(tree, [root.pid])
+    begin = time.perf_counter()
+    results = kill_process_trees([root.pid], timeout=2)
+    cost = time.perf_counter() - begin
+    root.wait()
+    print(f'进程树各层进程数: {[len(level) for level in levels]}, 终止{sum(results.values())}/{len(results)}个, 耗时{cost:.2f}s')
+
     # 通过完整的窗体标题获取PID
     pid = get_pid_by_full_window_title('思维导航')
     print(pid)
@@ -0,0 +1,135 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 后台进程快照与终止
+
+'''
+在工作线程中定时枚举进程, 与上一次快照按pid比较, 只把新增、退出、变化的进程通过信号发给界面,
+界面据此只修改对应的行。pid被复用时名称或父进程会变化, 作为变化的进程处理。
+同一线程中按相同的频率采集进程资源(见process_sampler), 采样结果整体通过信号发给界面。
+终止进程同样在工作线程中批量执行, 每个进程的结果一有结论就通过信号发给界面。
+'''
+
+import threading
+from typing import NamedTuple
+
+from PySide6.QtCore import QCoreApplication, QThread, Signal
+
+from source.client.tools.process import ProcessInfo, iter_processes, kill_process_trees, kill_processes
+from source.client.tools.process_sampler import ProcessSampler
+
+class ProcessDiff(NamedTuple):
+    added: list[ProcessInfo]
+    removed: list[int] # 退出的pid
+    changed: list[ProcessInfo]
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+def diff_snapshots(old: dict[int, ProcessInfo], new: dict[int, ProcessInfo]) -> ProcessDiff:
+    """ 按pid比较两次快照 """
+    added = []
+    changed = []
+    for pid, info in new.items():
+        old_info = old.get(pid)
+        if old_info is None:
+            added.append(info)
+        elif old_info != info:
+            changed.append(info)
+    removed = [pid for pid in old if pid not in new]
+    return ProcessDiff(added, removed, changed)
+
+class ProcessMonitor(QThread):
+    """ 进程快照线程, interval为0时只在调用refresh时枚举 """
+
+    diff_signal = Signal(object) # ProcessDiff, 在工作线程中发出
+    sample_signal = Signal(object) # dict[int, ProcessSample], 在diff_signal之后发出
+
+    def __init__(self, interval: float=0, sampler: ProcessSampler=None):
+        super().__init__()
+        self.interval = interval
+        self.sampler = sampler
+        self._wake = threading.Event()
+        self._stopped = False
+        self._snapshot: dict[int, ProcessInfo] = {}
+        app = QCoreApplication.instance()
+        if app is not None: # 程序退出前结束线程
+            app.aboutToQuit.connect(self.stop)
+
+    def set_interval(self, interval: float):
+        self.interval = interval
+        self._wake.set()
+
+    def refresh(self):
+        """ 立即枚举一次, 线程未启动时启动 """
+        self._wake.set()
+        if not self.isRunning():
+            self._stopped = False
+            self.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        self.wait()
+
+    def run(self):
+        while not self._stopped:
+            self._wake.clear() # 枚举期间再次请求刷新时, 枚举完成后立即再刷新一次
+            snapshot = {info.pid: info for info in iter_processes()}
+            diff = diff_snapshots(self._snapshot, snapshot)
+            self._snapshot = snapshot
+            if not diff.is_empty:
+                self.diff_signal.emit(diff)
+            if self.sampler is not None:
+                self.sample_signal.emit(self.sampler.sample())
+            self._wake.wait(self.interval if self.interval > 0 else None)
+
+class ProcessKiller(QThread):
+    """ 批量终止进程的线程, 界面线程不等待; tree为True时连同全部子进程一起终止 """
+
+    killed_signal = Signal(int, bool) # 进程ID, 是否已终止
+
+    def __init__(self, pids: list[int], timeout: float=5, tree=False):
+        super().__init__()
+        self.pids = pids
+        self.timeout = timeout
+        self.tree = tree
+        self.results: dict[int, bool] = {}
+
+    def run(self):
+        kill = kill_process_trees if self.tree else kill_processes
+        self.results = kill(self.pids, self.timeout, self.killed_signal.emit)
+
+if __name__ == '__main__':
+    import time
+
+    # 500个进程中有少量变化时, 快照比较的耗时
+    base = {pid: ProcessInfo(pid, f'process{pid}', '', 1) for pid in range(1, 501)}
+    new = dict(base)
+    for pid in range(1, 6):
+        del new[pid]
+    new[1000] = ProcessInfo(1000, 'new', '', 1)
+    new[100] = ProcessInfo(100, 'reused', '', 1)
+    count = 1000
+    begin = time.perf_counter()
+    for _ in range(count):
+        diff = diff_snapshots(base, new)
+    cost = (time.perf_counter() - begin) / count
+    print(f'新增{len(diff.added)}, 退出{len(diff.removed)}, 变化{len(diff.changed)}, 比较耗时: {cost * 1000:.3f}ms')
+    begin = time.perf_counter()
+    snapshot = {info.pid: info for info in iter_processes()}
+    print(f'本机{len(snapshot)}个进程, 枚举耗时: {(time.perf_counter() - begin) * 1000:.2f}ms')
+
+    # 批量终止: 一半进程忽略SIGTERM, 只有这一半需要升级为SIGKILL
+    import subprocess
+    import sys
+    code = 'import signal, sys, time; signal.signal(signal.SIGTERM, signal.SIG_IGN) if sys.argv[1] == "1" else None; time.sleep(60)'
+    children = [subprocess.Popen([sys.executable, '-c', code, str(i % 2)]) for i in range(20)]
+    time.sleep(1)
+    begin = time.perf_counter()
+    results = kill_processes([child.pid for child in children], timeout=1)
+    cost = time.perf_counter() - begin
+    for child in children:
+        child.wait()
+    print(f'批量终止{len(children)}个进程: 成功{sum(results.values())}个, 耗时{cost:.2f}s '
+          f'(逐个终止时, 忽略SIGTERM的{len(children) // 2}个进程各需等待1s)')
@@ -0,0 +1,186 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 进程资源采样
+
+'''
+定时采集每个进程的CPU占用、常驻内存、IO速率与线程数, 每个进程的历史保存在定长的环形缓冲中,
+进程退出后即丢弃, 内存占用只与进程数和缓冲长度有关。
+Linux下直接读取/proc/<pid>/stat(CPU时间、线程数、常驻内存在同一个文件中)与/proc/<pid>/io,
+其他平台使用psutil。CPU占用与IO速率由相邻两次采样的差值计算, 首次采样时为0。
+'''
+
+import os
+import sys
+import time
+from typing import Iterator, NamedTuple
+
+import numpy as np
+import psutil
+
+FIELDS = ('cpu', 'rss', 'read_rate', 'write_rate', 'threads')
+HISTORY_SIZE = 60 # 每个进程保留的采样次数
+
+class ProcessSample(NamedTuple):
+    pid: int
+    cpu: float # 占用单核的百分比, 多核满载时可超过100
+    rss: int # 常驻内存(字节)
+    read_rate: float # 每秒读取字节数
+    write_rate: float # 每秒写入字节数
+    threads: int
+
+class RawCounters(NamedTuple):
+    """ 单次读取的累计值 """
+    start: float # 进程启动时间, 用于识别pid复用
+    cpu_seconds: float
+    rss: int
+    read_bytes: int
+    write_bytes: int
+    threads: int
+
+class RingBuffer:
+    """ 定长环形缓冲, 每行为一次采样, 每列为一个指标 """
+
+    __slots__ = ('data', 'count', 'next')
+
+    def __init__(self, capacity: int, fields: int):
+        self.data = np.zeros((capacity, fields), dtype=np.float32)
+        self.count = 0
+        self.next = 0 # 下一次写入的行
+
+    def append(self, values):
+        self.data[self.next] = values
+        self.next = (self.next + 1) % len(self.data)
+        self.count = min(self.count + 1, len(self.data))
+
+    def values(self, field: int) -> np.ndarray:
+        """ 按时间先后排列的某一指标 """
+        if self.count < len(self.data):
+            return self.data[:self.count, field].copy()
+        return np.concatenate((self.data[self.next:, field], self.data[:self.next, field]))
+
+    def latest(self) -> np.ndarray | None:
+        return self.data[self.next - 1] if self.count else None
+
+if sys.platform.startswith('linux') and os.path.isdir('/proc'):
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+    def _read_io(pid: str) -> tuple[int, int]:
+        try:
+            with open(f'/proc/{pid}/io', 'rb') as f:
+                lines = f.read().split(b'\n')
+        except OSError: # 其他用户的进程没有权限读取
+            return 0, 0
+        # 依次为rchar, wchar, syscr, syscw, read_bytes, write_bytes, cancelled_write_bytes
+        return int(lines[4].split()[1]), int(lines[5].split()[1])
+
+    def iter_counters(io=True) -> Iterator[tuple[int, RawCounters]]:
+        for entry in os.scandir('/proc'):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry.name}/stat', 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            fields = data[data.rindex(b')') + 2:].split()
+            # state为第0项, 之后utime=11, stime=12, num_threads=17, starttime=19, rss=21
+            read_bytes, write_bytes = _read_io(entry.name) if io else (0, 0)
+            yield int(entry.name), RawCounters(int(fields[19]), (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS,
+                                               int(fields[21]) * _PAGE_SIZE, read_bytes, write_bytes, int(fields[17]))
+else:
+    def iter_counters(io=True) -> Iterator[tuple[int, RawCounters]]:
+        attrs = ['pid', 'create_time', 'cpu_times', 'memory_info', 'num_threads'] + (['io_counters'] if io else [])
+        for process in psutil.process_iter(attrs):
+            info = process.info
+            if info['cpu_times'] is None or info['memory_info'] is None: # 没有权限
+                continue
+            io_counters = info.get('io_counters')
+            yield info['pid'], RawCounters(info['create_time'] or 0, info['cpu_times'].user + info['cpu_times'].system,
+                                           info['memory_info'].rss, io_counters.read_bytes if io_counters else 0,
+                                           io_counters.write_bytes if io_counters else 0, info['num_threads'] or 0)
+
+class ProcessSampler:
+    """ 进程资源采样, 每次sample采集全部进程 """
+
+    def __init__(self, history_size=HISTORY_SIZE, io=True):
+        self.history_size = history_size
+        self.io = io
+        self.latest: dict[int, ProcessSample] = {}
+        self._history: dict[int, RingBuffer] = {}
+        self._counters: dict[int, RawCounters] = {}
+        self._last_time = 0.0
+
+    def sample(self) -> dict[int, ProcessSample]:
+        """ 采集一次, 返回本次每个进程的采样 """
+        now = time.monotonic()
+        elapsed = now - self._last_time if self._last_time else 0
+        counters = {}
+        latest = {}
+        for pid, raw in iter_counters(self.io):
+            counters[pid] = raw
+            old = self._counters.get(pid)
+            if old is None or old.start != raw.start or elapsed <= 0: # 新进程或pid被复用
+                cpu = read_rate = write_rate = 0
+                history = self._history[pid] = RingBuffer(self.history_size, len(FIELDS))
+            else:
+                cpu = max(raw.cpu_seconds - old.cpu_seconds, 0) / elapsed * 100
+                read_rate = max(raw.read_bytes - old.read_bytes, 0) / elapsed
+                write_rate = max(raw.write_bytes - old.write_bytes, 0) / elapsed
+                history = self._history[pid]
+            sample = ProcessSample(pid, cpu, raw.rss, read_rate, write_rate, raw.threads)
+            history.append(sample[1:])
+            latest[pid] = sample
+        for pid in self._history.keys() - counters.keys(): # 已退出的进程
+            del self._history[pid]
+        self._counters = counters
+        self._last_time = now
+        self.latest = latest
+        return latest
+
+    def history(self, pid: int, field='cpu') -> np.ndarray:
+        """ 进程某一指标的历史, 按时间先后排列 """
+        buffer = self._history.get(pid)
+        if buffer is None:
+            return np.empty(0, dtype=np.float32)
+        return buffer.values(FIELDS.index(field))
+
+    def top(self, n=10, field='cpu') -> list[ProcessSample]:
+        """ 最近一次采样中某一指标最高的n个进程 """
+        samples = list(self.latest.values())
+        if len(samples) <= n:
+            return sorted(samples, key=lambda sample: getattr(sample, field), reverse=True)
+        values = np.array([getattr(sample, field) for sample in samples])
+        index = np.argpartition(values, -n)[-n:]
+        return sorted((samples[i] for i in index), key=lambda sample: getattr(sample, field), reverse=True)
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024:
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}T'
+
+if __name__ == '__main__':
+    import subprocess
+
+    # 启动300个空闲进程, 按1秒1次的频率计算采样本身占用单核的比例
+    children = [subprocess.Popen(['sleep', '120']) if sys.platform != 'win32' else
+                subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(120)']) for _ in range(300)]
+    try:
+        sampler = ProcessSampler()
+        sampler.sample()
+        count = 10
+        begin = time.process_time()
+        for _ in range(count):
+            samples = sampler.sample()
+        cost = (time.process_time() - begin) / count
+        print(f'{len(samples)}个进程, 每次采样CPU时间 {cost * 1000:.2f}ms, 1秒1次约占单核 {cost * 100:.2f}%')
+        for sample in sampler.top(3, 'rss'):
+            print(f'    pid {sample.pid}: 内存 {format_bytes(sample.rss)}, 线程 {sample.threads}')
+        memory = sum(buffer.data.nbytes for buffer in sampler._history.values())
+        print(f'历史缓冲共 {format_bytes(memory)}, 每个进程 {format_bytes(HISTORY_SIZE * len(FIELDS) * 4)}')
+    finally:
+        for child in children:
+            child.kill()
+            child.wait()
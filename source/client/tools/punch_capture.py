@@ -0,0 +1,201 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 从系统登录记录自动补录上下班时间
+
+'''
+由本机的会话记录推算每天的上下班时间: 当天最早的活动时间为上班时间, 最晚的为下班时间。
+活动记录来源由ActivityProvider提供, 目前支持Linux的wtmp/utmp(登录、注销),
+其他来源(如Windows事件日志)继承ActivityProvider实现timestamps即可。
+
+wtmp为定长记录的二进制文件, 以mmap映射后用struct.iter_unpack只解出类型与时间两个字段,
+之后的时区换算、按天取最早/最晚时间均为numpy向量化计算。
+补录只写入数据库中没有记录的日期, 工时由批量计算引擎计算。
+'''
+
+import datetime
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from source.client.tools.punch_import import ImportResult
+from source.client.tools.work_calendar import work_calendar
+from source.client.tools.work_hours_batch import eval_work_hours_batch, shift_id, shift_rule_list
+from source.util.db import work_hours_db
+
+UNIX_EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+# glibc的struct utmp共384字节, 只取ut_type与ut_tv.tv_sec, 其余字段以填充字节跳过
+UTMP_RECORD = struct.Struct('<h2x4x32x4x32x256x4x4xi4x16x20x')
+BOOT_TIME = 2
+USER_PROCESS = 7
+DEAD_PROCESS = 8
+# 只统计用户登录与注销; 开机记录不算活动, 夜间无人值守的自动更新重启不应成为当天的上班时间
+ACTIVITY_TYPES = (USER_PROCESS, DEAD_PROCESS)
+
+class ActivityProvider:
+    """ 活动记录来源 """
+
+    name = ''
+
+    def available(self) -> bool:
+        return False
+
+    def timestamps(self, start: float, end: float) -> np.ndarray:
+        """ [start, end)内的活动时间, 为int64的Unix时间戳(秒) """
+        raise NotImplementedError
+
+class WtmpProvider(ActivityProvider):
+    """ Linux登录记录, wtmp为历史记录, utmp为当前会话 """
+
+    name = 'wtmp'
+
+    def __init__(self, paths=('/var/log/wtmp', '/var/run/utmp')):
+        self.paths = paths
+
+    def available(self) -> bool:
+        return sys.platform.startswith('linux') and any(os.path.isfile(path) for path in self.paths)
+
+    @staticmethod
+    def parse(data) -> np.ndarray:
+        """ 解析utmp格式的数据, 返回活动记录的时间戳, 末尾不完整的记录忽略 """
+        view = memoryview(data)
+        view = view[:len(view) - len(view) % UTMP_RECORD.size]
+        records = np.array(list(UTMP_RECORD.iter_unpack(view)), dtype=np.int64).reshape(-1, 2)
+        view.release()
+        return records[np.isin(records[:, 0], ACTIVITY_TYPES), 1]
+
+    def timestamps(self, start: float, end: float) -> np.ndarray:
+        result = []
+        for path in self.paths:
+            try:
+                with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    result.append(self.parse(data))
+            except (OSError, ValueError): # 文件不存在、无权限或为空
+                continue
+        if not result:
+            return np.empty(0, dtype=np.int64)
+        stamps = np.concatenate(result)
+        return stamps[(stamps >= start) & (stamps < end)]
+
+def default_providers() -> list[ActivityProvider]:
+    return [provider for provider in (WtmpProvider(),) if provider.available()]
+
+def day_timestamp(day: int) -> float:
+    """ 本地时间该天0点的时间戳 """
+    return time.mktime(datetime.date.fromordinal(day).timetuple())
+
+def daily_activity(stamps: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ 按本地时间汇总每天最早与最晚的活动时间
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        日期序数, 最早活动时间, 最晚活动时间; 时间为当天0点起的分钟数
+    """
+    if not len(stamps):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    # 夏令时只在整点切换, 按小时取本地时区偏移, 不同的小时数远少于记录数
+    hours, inverse = np.unique(stamps // 3600, return_inverse=True)
+    offsets = np.array([time.localtime(hour * 3600).tm_gmtoff for hour in hours.tolist()], dtype=np.int64)
+    local = stamps + offsets[inverse]
+    days, day_index = np.unique(local // 86400, return_inverse=True)
+    minutes = local % 86400 // 60
+    first = np.full(len(days), 86400, dtype=np.int64)
+    last = np.full(len(days), -1, dtype=np.int64)
+    np.minimum.at(first, day_index, minutes)
+    np.maximum.at(last, day_index, minutes)
+    return days + UNIX_EPOCH, first, last
+
+def capture_activity(start_day: int, end_day: int,
+                     providers: list[ActivityProvider]=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ [start_day, end_day]内每天的活动时间, 返回值同daily_activity """
+    providers = default_providers() if providers is None else providers
+    start, end = day_timestamp(start_day), day_timestamp(end_day + 1)
+    stamps = [provider.timestamps(start, end) for provider in providers]
+    return daily_activity(np.concatenate(stamps) if stamps else np.empty(0, dtype=np.int64))
+
+def missing_days(start_day: int, end_day: int) -> set[int]:
+    """ [start_day, end_day]内数据库中没有记录的日期 """
+    missing = set()
+    for day in range(start_day, end_day + 1):
+        date = datetime.date.fromordinal(day)
+        records = work_hours_db.year_records(date.year)
+        if date.timetuple().tm_yday - 1 not in records:
+            missing.add(day)
+    return missing
+
+def fill_missing_days(start_day: int, end_day: int, classes='8点班次',
+                      providers: list[ActivityProvider]=None) -> ImportResult:
+    """ 用系统活动记录补录[start_day, end_day]内没有工时记录的日期, 今天及以后的日期尚未结束, 不补录
+
+    Returns
+    -------
+    ImportResult
+        imported为补录的天数, skipped为有活动记录但无法计算工时的天数
+    """
+    result = ImportResult()
+    rules = shift_rule_list()
+    shift = shift_id(classes, rules) # 班次不存在时在解析登录记录前抛出ValueError
+    end_day = min(end_day, datetime.date.today().toordinal() - 1)
+    if start_day > end_day:
+        return result
+    days, first, last = capture_activity(start_day, end_day, providers)
+    missing = missing_days(start_day, end_day)
+    keep = np.array([day in missing for day in days.tolist()], dtype=bool)
+    days, first, last = days[keep], first[keep], last[keep]
+    keep = last > first # 只有一个活动时间时无法区分上下班
+    result.skipped = int(np.count_nonzero(~keep))
+    days, first, last = days[keep], first[keep], last[keep]
+    if not len(days):
+        return result
+
+    effect, total = eval_work_hours_batch(first, last, np.full(len(days), shift), rules)
+    records = []
+    for day, start, end, effect_hours, total_hours in zip(days.tolist(), first.tolist(), last.tolist(),
+                                                          effect.tolist(), total.tolist()):
+        if effect_hours < 0:
+            result.skipped += 1
+            continue
+        if not work_calendar.is_workday(day)[0]: # 休息日不计入有效工时
+            effect_hours = 0
+        date = datetime.date.fromordinal(day)
+        records.append((date.year, date.month, date.day, effect_hours, total_hours, start, end))
+    work_hours_db.set_days(records, overwrite=False, source='capture')
+    result.imported = len(records)
+    return result
+
+if __name__ == '__main__':
+    import random
+    import tempfile
+
+    # 生成一年的wtmp记录(每天约30次登录/注销), 检查解析耗时, 并与逐条datetime换算的结果比对
+    rng = random.Random(0)
+    full_record = struct.Struct('<hxxi32s4s32s256shhiii4i20s')
+    first_day = datetime.date.today().toordinal() - 365
+    expect = {}
+    path = os.path.join(tempfile.mkdtemp(), 'wtmp')
+    with open(path, 'wb') as f:
+        for day in range(first_day, first_day + 365):
+            base = day_timestamp(day)
+            for _ in range(30):
+                stamp = int(base) + rng.randint(6 * 3600, 23 * 3600)
+                record_type = rng.choice((USER_PROCESS, DEAD_PROCESS, BOOT_TIME, 6)) # 开机与LOGIN_PROCESS(6)不计入活动
+                f.write(full_record.pack(record_type, 1000, b'pts/0', b'ts/0', b'user', b'', 0, 0, 0, stamp, 0, 0, 0, 0, 0, b''))
+                if record_type in ACTIVITY_TYPES:
+                    local = datetime.datetime.fromtimestamp(stamp)
+                    minute = local.hour * 60 + local.minute
+                    begin, end = expect.get(local.toordinal(), (minute, minute))
+                    expect[local.toordinal()] = min(begin, minute), max(end, minute)
+
+    provider = WtmpProvider((path,))
+    begin = time.perf_counter()
+    days, first, last = capture_activity(first_day, first_day + 364, [provider])
+    cost = time.perf_counter() - begin
+    result = {day: (start, end) for day, start, end in zip(days.tolist(), first.tolist(), last.tolist())}
+    print(f'解析{os.path.getsize(path) // UTMP_RECORD.size}条记录耗时: {cost * 1000:.1f}ms, '
+          f'共{len(result)}天, 与逐条换算{"一致" if result == expect else "不一致"}')
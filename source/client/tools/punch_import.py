@@ -0,0 +1,246 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 打卡记录批量导入
+
+'''
+流式导入CSV/XLSX格式的打卡记录, 每行为一天: 日期, 上班时间, 下班时间, 班次(可选)。
+文件逐行读取, 每chunk_size行批量计算工时并在一个事务中写入数据库, 内存占用与文件大小无关。
+列按表头名称匹配, 表头不同时可通过columns参数指定。
+'''
+
+import csv
+import datetime
+import io
+import itertools
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+
+import openpyxl
+
+from source.client.tools.work_calendar import work_calendar
+from source.client.tools.work_hours_batch import MISSING, eval_work_hours_batch, shift_id, shift_rule_list
+from source.client.tools.work_hours_core import ShiftRule
+from source.util.db import work_hours_db
+
+CHUNK_SIZE = 5000
+COLUMN_ALIASES = {
+    'date': ('日期', '考勤日期', 'date'),
+    'start': ('上班时间', '上班打卡', '上班', 'start'),
+    'end': ('下班时间', '下班打卡', '下班', 'end'),
+    'classes': ('班次', 'shift')
+}
+EXCEL_EPOCH = datetime.date(1899, 12, 30).toordinal() # Excel日期序列号的起点
+
+@dataclass(slots=True)
+class ImportResult:
+    imported: int = 0 # 写入的天数
+    skipped: int = 0 # 无法解析或时间异常的行数
+    unknown_shifts: set[str] = field(default_factory=set) # 文件中出现的不存在的班次, 这些行计入skipped
+
+def _iter_csv(path: str) -> Iterator[tuple[list, int]]:
+    size = os.path.getsize(path) or 1
+    with open(path, 'rb') as raw:
+        # 以二进制文件的读取位置估算进度, 文本包装层的tell在迭代时不可用
+        text = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        for row in csv.reader(text):
+            yield row, raw.tell() * 100 // size
+
+def _iter_xlsx(path: str) -> Iterator[tuple[tuple, int]]:
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        max_row = sheet.max_row or 0
+        for i, row in enumerate(sheet.iter_rows(values_only=True), 1):
+            yield row, i * 100 // max_row if max_row else 0
+    finally:
+        workbook.close()
+
+def iter_rows(path: str) -> Iterator[tuple[Any, int]]:
+    """ 逐行读取文件, 同时返回读取进度(百分比) """
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        return _iter_xlsx(path)
+    return _iter_csv(path)
+
+def _match_columns(header, columns: dict[str, str] | None) -> dict[str, int]:
+    names = [str(name).strip() if name is not None else '' for name in header]
+    index = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        candidates = (columns[field],) if columns and field in columns else aliases
+        for name in candidates:
+            if name in names:
+                index[field] = names.index(name)
+                break
+    missing = [field for field in ('date', 'start', 'end') if field not in index]
+    if missing:
+        raise ValueError(f'未找到{"、".join(COLUMN_ALIASES[field][0] for field in missing)}列, 表头为: {names}')
+    return index
+
+def parse_date(value) -> int:
+    """ 解析日期, 返回日期序数 """
+    if isinstance(value, datetime.datetime):
+        return value.toordinal()
+    if isinstance(value, datetime.date):
+        return value.toordinal()
+    if isinstance(value, (int, float)):
+        return EXCEL_EPOCH + int(value)
+    text = str(value).strip()
+    try:
+        return datetime.date.fromisoformat(text).toordinal()
+    except ValueError: # 2024/5/6、2024.5.6或带时间的格式
+        text = text.split(' ')[0].replace('/', '-').replace('.', '-')
+        return datetime.date.fromisoformat('-'.join(part.zfill(2) for part in text.split('-'))).toordinal()
+
+def parse_time(value) -> int:
+    """ 解析时间, 返回当天0点起的分钟数, 空值为MISSING """
+    if value is None or value == '':
+        return MISSING
+    if isinstance(value, (datetime.datetime, datetime.time)):
+        return value.hour * 60 + value.minute
+    if isinstance(value, (int, float)): # Excel以一天的比例保存时间
+        return round(value % 1 * 24 * 60)
+    text = str(value).strip()
+    if not text:
+        return MISSING
+    parts = text.split(' ')[-1].split(':')
+    return int(parts[0]) * 60 + int(parts[1])
+
+def iter_punches(path: str, columns: dict[str, str]=None, classes='8点班次', rules: list[ShiftRule]=None,
+                 unknown_shifts: set[str]=None) -> Iterator[tuple[int, int, int, int, int] | None]:
+    """ 逐行解析打卡记录
+
+    Parameters
+    ----------
+    path: str
+        CSV或XLSX文件路径, 第一行为表头
+
+    columns: dict[str, str]
+        date/start/end/classes对应的表头名称, 未指定的按COLUMN_ALIASES匹配
+
+    classes: str
+        文件中没有班次列时使用的班次
+
+    rules: list[ShiftRule]
+        班次id对应的班次列表, 默认为当前班次
+
+    unknown_shifts: set[str]
+        收集文件中出现的不存在的班次名称
+
+    Returns
+    -------
+    Iterator
+        (日期序数, 上班分钟数, 下班分钟数, 班次id, 进度), 无法解析的行为None
+    """
+    rows = iter_rows(path)
+    header = next(rows, None)
+    if header is None:
+        return
+    index = _match_columns(header[0], columns)
+    rules = shift_rule_list() if rules is None else rules
+    shift_ids = {rule.name: i for i, rule in enumerate(rules)}
+    default_shift = shift_id(classes, rules)
+    for row, progress in rows:
+        if not any(cell not in (None, '') for cell in row):
+            continue
+        try:
+            day = parse_date(row[index['date']])
+            start = parse_time(row[index['start']])
+            end = parse_time(row[index['end']])
+            shift = default_shift
+            if 'classes' in index and row[index['classes']] not in (None, ''):
+                name = str(row[index['classes']]).strip()
+                shift = shift_ids.get(name)
+                if shift is None:
+                    if unknown_shifts is not None:
+                        unknown_shifts.add(name)
+                    yield None
+                    continue
+        except (ValueError, IndexError, KeyError, TypeError):
+            yield None
+            continue
+        yield day, start, end, shift, progress
+
+def import_punches(path: str, columns: dict[str, str]=None, classes='8点班次', chunk_size=CHUNK_SIZE,
+                   progress: Callable[[int], Any]=None) -> ImportResult:
+    """ 导入打卡记录, 分批计算工时并写入数据库, 同一天出现多次时以最后一行为准;
+        上下班时间都为空的行计入跳过, 不覆盖数据库中已有的记录
+
+    Parameters
+    ----------
+    progress: Callable[[int], Any]
+        进度回调, 参数为百分比, 只在进度变化时调用
+    """
+    result = ImportResult()
+    rules = shift_rule_list() # 导入过程中班次配置可能被修改, 全程使用同一份班次
+    shift_id(classes, rules) # 默认班次不存在时在读取文件前抛出ValueError
+    punches = iter_punches(path, columns, classes, rules, result.unknown_shifts)
+    last_progress = -1
+    while True:
+        chunk = list(itertools.islice(punches, chunk_size))
+        if not chunk:
+            break
+        valid = [punch for punch in chunk if punch is not None]
+        result.skipped += len(chunk) - len(valid)
+        if not valid:
+            continue
+        days, starts, ends, shifts, percents = zip(*valid)
+        effect, total = eval_work_hours_batch(starts, ends, shifts, rules)
+        records = []
+        for day, start, end, effect_hours, total_hours in zip(days, starts, ends, effect.tolist(), total.tolist()):
+            if effect_hours < 0: # 上班时间晚于下班时间
+                result.skipped += 1
+                continue
+            if start == MISSING and end == MISSING: # 没有打卡时间的空行, 写入0工时会覆盖已有的记录
+                result.skipped += 1
+                continue
+            if not work_calendar.is_workday(day)[0]: # 休息日不计入有效工时
+                effect_hours = 0
+            date = datetime.date.fromordinal(day)
+            records.append((date.year, date.month, date.day, effect_hours, total_hours,
+                            None if start == MISSING else start, None if end == MISSING else end))
+        work_hours_db.set_days(records)
+        result.imported += len(records)
+        if progress is not None and percents[-1] != last_progress:
+            last_progress = percents[-1]
+            progress(last_progress)
+    if progress is not None:
+        progress(100)
+    return result
+
+if __name__ == '__main__':
+    import random
+    import tempfile
+    import time
+    import tracemalloc
+
+    # 生成10万行的打卡记录, 检查导入耗时与内存占用
+    rng = random.Random(0)
+    shift_names = [rule.name for rule in shift_rule_list()]
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'punch.csv')
+    work_hours_db.db_file = os.path.join(tmp_dir, 'work_hours.db')
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['日期', '上班时间', '下班时间', '班次'])
+        first_day = datetime.date(2000, 1, 1).toordinal()
+        for i in range(100000):
+            writer.writerow([datetime.date.fromordinal(first_day + i).isoformat(),
+                             f'{rng.randint(7, 10)}:{rng.randint(0, 59):02d}', f'{rng.randint(16, 21)}:{rng.randint(0, 59):02d}',
+                             shift_names[rng.randint(0, len(shift_names) - 1)]])
+
+    begin = time.perf_counter()
+    ret = import_punches(path)
+    cost = time.perf_counter() - begin
+    tracemalloc.start() # 跟踪内存会明显拖慢速度, 单独再导入一次统计内存峰值
+    import_punches(path)
+    _, peak = tracemalloc.get_traced_memory()
+    print(f'导入{ret.imported}天, 跳过{ret.skipped}行, 耗时: {cost:.2f}s, 内存峰值: {peak / 1024 / 1024:.1f}M')
+
+    # 上下班时间都为空的行不覆盖已有的记录
+    blank_path = os.path.join(tmp_dir, 'blank.csv')
+    with open(blank_path, 'w', encoding='utf-8-sig', newline='') as f:
+        csv.writer(f).writerows([['日期', '上班时间', '下班时间'], ['2000-01-03', '', '']])
+    before = work_hours_db.get_day(2000, 1, 3)
+    ret = import_punches(blank_path)
+    print(f'空行: 导入{ret.imported}天, 跳过{ret.skipped}行, 已有记录{"未被覆盖" if work_hours_db.get_day(2000, 1, 3) == before else "被覆盖"}')
+    work_hours_db.close()
@@ -0,0 +1,151 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 多档案工时汇总
+
+'''
+每个档案的工时存放在各自的SQLite分片中(见db.get_profile_db), 跨档案统计只读取各分片的月汇总表,
+每个分片只有几十行, 依次查询即可。实测20个档案时, 首次统计的耗时主要是打开各分片连接(建表检查),
+线程池并行查询并不更快; 连接打开后保持, 之后每个分片的查询约0.1ms。
+读到的月汇总按档案缓存, 该档案写入后(generation变化)失效, 团队看板反复刷新时不会重新查询。
+'''
+
+import threading
+from typing import NamedTuple
+
+from source.client.tools.work_calendar import work_calendar
+from source.util.db import get_config, get_profile_db, profile_names, WorkHoursDB
+
+class ProfileMonth(NamedTuple):
+    profile: str
+    effect_hours: float
+    total_hours: float
+    target_hours: float # 当月工作日数 * 每日目标工时
+
+    @property
+    def under_target(self) -> bool:
+        return self.effect_hours < self.target_hours
+
+_summaries: dict[str, tuple[WorkHoursDB, int, dict]] = {} # 档案 -> (数据库, generation, 月汇总)
+_summary_lock = threading.Lock()
+
+def _cached_summaries(profile: str) -> dict | None:
+    db = get_profile_db(profile)
+    cached = _summaries.get(profile)
+    # 切换档案后同一档案可能对应新的数据库对象, 需同时比较对象与generation
+    if cached is not None and cached[0] is db and cached[1] == db.generation:
+        return cached[2]
+    return None
+
+def profile_month_summaries(profile: str) -> dict[tuple[int, int], tuple[float, float]]:
+    """ 档案的全部月汇总, 数据未变化时直接返回缓存 """
+    summaries = _cached_summaries(profile)
+    if summaries is not None:
+        return summaries
+    db = get_profile_db(profile)
+    generation = db.generation # 先取generation, 查询期间有写入时下次重新读取
+    summaries = db.month_summaries()
+    with _summary_lock:
+        _summaries[profile] = db, generation, summaries
+    return summaries
+
+def collect_summaries(profiles: list[str]=None) -> dict[str, dict[tuple[int, int], tuple[float, float]]]:
+    """ 读取各档案的月汇总, 命中缓存的档案不再查询 """
+    profiles = profile_names() if profiles is None else profiles
+    return {profile: profile_month_summaries(profile) for profile in profiles}
+
+def month_target(year: int, month: int, daily_hours: float=None) -> float:
+    """ 当月目标有效工时 """
+    if daily_hours is None:
+        daily_hours = get_config('Profiles', 'DailyTarget')
+    return work_calendar.month_mask(year, month).bit_count() * daily_hours
+
+def team_month(year: int, month: int, profiles: list[str]=None, daily_hours: float=None) -> list[ProfileMonth]:
+    """ 各档案当月的工时及目标, 按有效工时从低到高排列 """
+    target = month_target(year, month, daily_hours)
+    rows = [ProfileMonth(profile, *summaries.get((year, month), (0, 0)), target)
+            for profile, summaries in collect_summaries(profiles).items()]
+    return sorted(rows, key=lambda row: row.effect_hours)
+
+def under_target(year: int, month: int, profiles: list[str]=None, daily_hours: float=None) -> list[ProfileMonth]:
+    return [row for row in team_month(year, month, profiles, daily_hours) if row.under_target]
+
+def team_year(year: int, profiles: list[str]=None) -> dict[str, list[tuple[float, float]]]:
+    """ 各档案全年每月的(有效工时, 总工时), 下标为月份-1 """
+    return {profile: [summaries.get((year, month), (0, 0)) for month in range(1, 13)]
+            for profile, summaries in collect_summaries(profiles).items()}
+
+def format_team_month(year: int, month: int, rows: list[ProfileMonth]) -> str:
+    lines = [f'{year}年{month}月团队工时(目标有效工时 {rows[0].target_hours:.2f}小时):' if rows else f'{year}年{month}月没有档案']
+    for row in rows:
+        mark = ', 低于目标' if row.under_target else ''
+        lines.append(f'    {row.profile}: 有效工时 {row.effect_hours:.2f}, 总工时 {row.total_hours:.2f}{mark}')
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    import datetime
+    import random
+    import shutil
+    import statistics
+    import tempfile
+    import time
+
+    # 生成20个档案各3年的数据, 比较读取月汇总(首次/连接已打开/命中缓存)与逐天扫描的耗时和结果
+    from source.util import db as db_module
+    db_module.PROFILE_DIR = tempfile.mkdtemp()
+    rng = random.Random(0)
+    first_day = datetime.date(2022, 1, 1).toordinal()
+    profiles = [f'成员{i}' for i in range(20)]
+    for profile in profiles:
+        db_module.create_profile(profile)
+        records = []
+        for day in range(first_day, first_day + 3 * 365):
+            date = datetime.date.fromordinal(day)
+            records.append((date.year, date.month, date.day, rng.randint(0, 44) / 4, rng.randint(0, 52) / 4, None, None))
+        get_profile_db(profile).set_days(records)
+
+    month_target(2023, 6, 8) # 预先生成日历
+
+    def close_all():
+        for profile in profiles:
+            get_profile_db(profile).close()
+
+    def invalidate():
+        _summaries.clear()
+
+    def measure(prepare, func, runs=10) -> float:
+        """ 多次运行取中位数, 单次耗时受磁盘缓存影响波动较大 """
+        costs = []
+        for _ in range(runs):
+            prepare()
+            begin = time.perf_counter()
+            func()
+            costs.append(time.perf_counter() - begin)
+        return statistics.median(costs)
+
+    def scan_year():
+        result = {}
+        for profile in profiles:
+            months = [0.0] * 12
+            for record in get_profile_db(profile).iter_days(datetime.date(2023, 1, 1), datetime.date(2023, 12, 31)):
+                months[record[1] - 1] += record[3]
+            result[profile] = [round(hours, 6) for hours in months]
+        return result
+
+    def cold():
+        close_all()
+        invalidate()
+
+    cold_cost = measure(cold, lambda: team_year(2023, profiles)) # 首次打开看板: 含打开连接
+    warm_cost = measure(invalidate, lambda: team_year(2023, profiles)) # 连接已打开, 数据有变化
+    cached_cost = measure(lambda: None, lambda: team_year(2023, profiles))
+    scan_cost = measure(close_all, scan_year) # 不使用月汇总, 逐天扫描
+    table = team_year(2023, profiles)
+    expect = scan_year()
+    same = all([round(effect, 6) for effect, _ in table[profile]] == expect[profile] for profile in profiles)
+    print(f'{len(profiles)}个档案全年按月汇总(中位数): 首次读取 {cold_cost * 1000:.1f}ms, 连接已打开 {warm_cost * 1000:.2f}ms, '
+          f'命中缓存 {cached_cost * 1000:.3f}ms, 逐天扫描 {scan_cost * 1000:.1f}ms, 结果{"一致" if same else "不一致"}')
+    rows = team_month(2023, 6, profiles, 8)
+    print(format_team_month(2023, 6, rows[:3]))
+    for profile in profiles:
+        get_profile_db(profile).close()
+    shutil.rmtree(db_module.PROFILE_DIR)
@@ -0,0 +1,260 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 工作日日历
+
+'''
+每年的工作日预先编译为366位的位图(第i位对应当年第i+1天, 1为工作日), 查询只需一次位运算。
+位图由若干数据源依次生成:
+    year_bits: 第一个能提供该年数据的数据源生成整年的位图
+    adjust: 所有数据源依次在位图上修正, 用于用户自定义的调休/请假
+编译结果保存在config/db/calendar.bin, 数据源签名(库版本、自定义文件修改时间等)变化时整体失效重建。
+
+自定义文件config/calendar_overrides.json格式:
+    {"workdays": ["2025-09-28"], "holidays": ["2025-10-09"]}
+'''
+
+import calendar
+import datetime
+import json
+import os
+import struct
+import threading
+
+import chinese_calendar
+
+from source.util.log import log_error
+
+CALENDAR_FILE = os.path.join(os.getcwd(), 'config/db/calendar.bin') # 编译后的位图缓存
+OVERRIDES_FILE = os.path.join(os.getcwd(), 'config/calendar_overrides.json') # 用户自定义的工作日/休息日
+MAGIC = b'MLC1'
+FILE_HEADER = struct.Struct('<4sH') # 魔数, 签名长度
+YEAR_BYTES = 46 # 366位
+YEAR_RECORD = struct.Struct(f'<HB{YEAR_BYTES}s') # 年份, 是否为推算数据, 位图
+
+class CalendarProvider:
+    """ 工作日数据源, 地区数据源实现year_bits, 修正数据源实现adjust """
+
+    name = ''
+    estimated = False # 数据是否为推算(非官方节假日安排)
+
+    def signature(self) -> str:
+        """ 数据版本, 变化时已编译的位图失效 """
+        return self.name
+
+    def year_bits(self, year: int) -> int | None:
+        """ 生成整年的工作日位图, 不支持该年时返回None """
+        return None
+
+    def adjust(self, year: int, bits: int) -> int:
+        return bits
+
+class ChineseCalendarProvider(CalendarProvider):
+    """ 中国法定节假日, 数据来自chinese_calendar """
+
+    name = '中国法定节假日'
+
+    def signature(self) -> str:
+        return f'chinese_calendar-{chinese_calendar.__version__}'
+
+    def year_bits(self, year: int) -> int | None:
+        first_day = datetime.date(year, 1, 1)
+        try:
+            chinese_calendar.is_workday(first_day)
+        except NotImplementedError: # 库中没有该年的数据
+            return None
+        bits = 0
+        for i in range(366 if calendar.isleap(year) else 365):
+            if chinese_calendar.is_workday(first_day + datetime.timedelta(days=i)):
+                bits |= 1 << i
+        return bits
+
+class WeekendProvider(CalendarProvider):
+    """ 按固定周末推算, 作为没有节假日数据时的兜底, 也可用于其他周末制度的地区 """
+
+    estimated = True
+
+    def __init__(self, weekend: tuple[int, ...]=(5, 6), name='双休'):
+        self.weekend = weekend # 0为周一
+        self.name = name
+
+    def signature(self) -> str:
+        return f'{self.name}-{self.weekend}'
+
+    def year_bits(self, year: int) -> int | None:
+        first_weekday = datetime.date(year, 1, 1).weekday()
+        bits = 0
+        for i in range(366 if calendar.isleap(year) else 365):
+            if (first_weekday + i) % 7 not in self.weekend:
+                bits |= 1 << i
+        return bits
+
+class OverridesProvider(CalendarProvider):
+    """ 用户自定义的工作日/休息日 """
+
+    name = '自定义'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._days: dict[int, list[tuple[int, bool]]] = None # 年份 -> [(当年第几天, 是否工作日)]
+
+    def signature(self) -> str:
+        try:
+            st = os.stat(self.path)
+            return f'{self.name}-{st.st_size}-{st.st_mtime_ns}'
+        except OSError:
+            return f'{self.name}-none'
+
+    def _load(self):
+        self._days = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for key, is_work in (('workdays', True), ('holidays', False)):
+                for day in data.get(key, []):
+                    date = datetime.date.fromisoformat(day)
+                    self._days.setdefault(date.year, []).append((date.timetuple().tm_yday - 1, is_work))
+        except Exception as e:
+            log_error(f'读取自定义日历 {self.path} 失败: {e}')
+
+    def adjust(self, year: int, bits: int) -> int:
+        if self._days is None:
+            self._load()
+        for i, is_work in self._days.get(year, []):
+            bits = bits | (1 << i) if is_work else bits & ~(1 << i)
+        return bits
+
+    def reset(self):
+        self._days = None
+
+class WorkCalendar:
+    """ 按年编译并缓存的工作日日历 """
+
+    def __init__(self, providers: list[CalendarProvider], path: str=CALENDAR_FILE):
+        self.providers = providers
+        self.path = path
+        self._years: dict[int, tuple[int, bool]] = None # 年份 -> (位图, 是否为推算数据)
+        self._signature = ''
+        self._lock = threading.Lock()
+
+    def signature(self) -> str:
+        return '|'.join(provider.signature() for provider in self.providers)
+
+    def add_provider(self, provider: CalendarProvider, index: int=None):
+        """ 添加数据源, index越小优先级越高, 默认放在最后 """
+        with self._lock:
+            self.providers.insert(len(self.providers) if index is None else index, provider)
+            self._years = None
+
+    def refresh(self):
+        """ 数据源有变化(如修改了自定义文件)时丢弃已编译的位图 """
+        with self._lock:
+            if self._years is not None and self.signature() != self._signature:
+                self._years = None
+
+    # 需持有self._lock调用
+    def _load(self):
+        self._signature = self.signature()
+        self._years = {}
+        for provider in self.providers:
+            if isinstance(provider, OverridesProvider):
+                provider.reset()
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            magic, sign_len = FILE_HEADER.unpack_from(data)
+            offset = FILE_HEADER.size + sign_len
+            if magic != MAGIC or data[FILE_HEADER.size:offset].decode('utf-8') != self._signature:
+                return
+            for year, estimated, bits in YEAR_RECORD.iter_unpack(data[offset:]):
+                self._years[year] = int.from_bytes(bits, 'little'), bool(estimated)
+        except Exception as e:
+            log_error(f'读取日历缓存 {self.path} 失败: {e}')
+            self._years = {}
+
+    # 需持有self._lock调用
+    def _save(self):
+        sign = self._signature.encode('utf-8')
+        records = [YEAR_RECORD.pack(year, estimated, bits.to_bytes(YEAR_BYTES, 'little'))
+                   for year, (bits, estimated) in sorted(self._years.items())]
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(FILE_HEADER.pack(MAGIC, len(sign)) + sign + b''.join(records))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            log_error(f'保存日历缓存 {self.path} 失败: {e}')
+
+    def _year(self, year: int) -> tuple[int, bool]:
+        years = self._years
+        if years is not None and year in years:
+            return years[year]
+        with self._lock:
+            if self._years is None:
+                self._load()
+            if year not in self._years:
+                bits, source = None, None
+                for provider in self.providers:
+                    bits = provider.year_bits(year)
+                    if bits is not None:
+                        source = provider
+                        break
+                if bits is None:
+                    raise ValueError(f'没有可用于{year}年的日历数据源')
+                for provider in self.providers:
+                    bits = provider.adjust(year, bits)
+                self._years[year] = bits, source.estimated
+                self._save()
+            return self._years[year]
+
+    def is_workday(self, day: int) -> tuple[bool, bool]:
+        """ 查询是否为工作日
+
+        Parameters
+        ----------
+        day: int
+            日期序数, 同datetime.date.toordinal
+
+        Returns
+        -------
+        tuple[bool, bool]
+            是否为工作日, 是否为推算数据
+        """
+        year = datetime.date.fromordinal(day).year
+        bits, estimated = self._year(year)
+        return bool(bits >> (day - datetime.date(year, 1, 1).toordinal()) & 1), estimated
+
+    def month_mask(self, year: int, month: int) -> int:
+        """ 整月的工作日掩码, 第i位对应该月第i+1天 """
+        bits, _ = self._year(year)
+        offset = datetime.date(year, month, 1).timetuple().tm_yday - 1
+        return bits >> offset & ((1 << calendar.monthrange(year, month)[1]) - 1)
+
+    def year_mask(self, year: int) -> int:
+        """ 全年的工作日位图, 第i位对应当年第i+1天 """
+        return self._year(year)[0]
+
+    def is_estimated(self, year: int) -> bool:
+        return self._year(year)[1]
+
+work_calendar = WorkCalendar([ChineseCalendarProvider(), OverridesProvider(OVERRIDES_FILE), WeekendProvider()])
+
+if __name__ == '__main__':
+    import time
+
+    today = datetime.date.today()
+    begin = time.perf_counter()
+    for i in range(10000):
+        chinese_calendar.is_workday(today - datetime.timedelta(days=i % 300))
+    library_cost = time.perf_counter() - begin
+
+    work_calendar.is_workday(today.toordinal() - 299) # 编译位图
+    begin = time.perf_counter()
+    for i in range(10000):
+        work_calendar.is_workday(today.toordinal() - i % 300)
+    bitmap_cost = time.perf_counter() - begin
+    print(f'查询1万次, chinese_calendar: {library_cost * 1000:.1f}ms, 位图: {bitmap_cost * 1000:.1f}ms')
+    print(f'{today.year}年{today.month}月工作日掩码: {work_calendar.month_mask(today.year, today.month):031b}')
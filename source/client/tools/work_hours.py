@@ -2,156 +2,291 @@
 # 作者: 拓跋龙
 # 功能: 工时相关功能
 
+import csv
 import datetime
-from dataclasses import dataclass
-
-import chinese_calendar
-from PySide6.QtCore import QDate, QTime
-
-from source.util.db import get_config, set_config
-
-@dataclass
-class TimeNode:
-    business_time: QTime
-    flexible_business_time: QTime
-    noon_rest_time: QTime
-    noon_business_time: QTime
-    closing_time: QTime
-    afnoon_business_time: QTime
-    flexible_closing_time: QTime
-
-classes_time = {
-    '8点班次': TimeNode(QTime(8, 0), QTime(9, 5), QTime(12, 0), QTime(13, 30), QTime(17, 30), QTime(18, 0), QTime(19, 5)),
-    '8点半班次': TimeNode(QTime(8, 30), QTime(9, 35), QTime(12, 30), QTime(14, 00), QTime(18, 00), QTime(18, 30), QTime(19, 35))
-}
+import json
+import os
+from typing import Iterator, NamedTuple
+
+from source.client.tools.work_calendar import work_calendar
+from source.client.tools.work_hours_core import ShiftRule, get_curr_day_work_hours, get_shift_rules, set_shift_rules
+from source.util.db import create_profile, get_config, profile_names, set_config, switch_profile, work_hours_db
+from source.util.log import log_error
 
-def is_work_day(date: QDate) -> tuple[bool, str]:
+def load_shift_rules() -> list[str]:
+    """ 按配置编译班次, 配置有误时沿用原有班次, 返回班次名称列表 """
     try:
-        date = datetime.date(date.year(), date.month(), date.day())
-        return chinese_calendar.is_workday(date), ''
+        set_shift_rules(get_config('Shifts'))
     except Exception as e:
-        return None, ''.join(str(arg) for arg in e.args)
-
-def time_diff(start_time: QTime, end_time: QTime):
-    time = start_time.secsTo(end_time) / 3600
-    return time if time > 0 else 0
-
-# 正点上班
-def eval_standard_hours(start_time: QTime, end_time: QTime, classes='8点班次'):
-    if end_time < classes_time[classes].noon_rest_time: # 上午下班
-        return time_diff(classes_time[classes].business_time, end_time), time_diff(start_time, end_time)
-    elif classes_time[classes].noon_rest_time <= end_time < classes_time[classes].noon_business_time: # 中午下班
-        return 4, time_diff(start_time, classes_time[classes].noon_rest_time)
-    elif classes_time[classes].noon_business_time <= end_time < classes_time[classes].closing_time: # 下午下班
-        return time_diff(classes_time[classes].business_time, end_time) - 1.5, time_diff(start_time, end_time) - 1.5
-    elif classes_time[classes].closing_time <= end_time < classes_time[classes].afnoon_business_time: # 下午休息时间下班
-        return 8, time_diff(start_time, classes_time[classes].closing_time)
-    elif classes_time[classes].afnoon_business_time <= end_time: # 晚上下班
-        return 8, time_diff(start_time, end_time) - 2
-    return 0, 0
-
-# 弹性上班
-def eval_flexible_hours(start_time: QTime, end_time: QTime, classes='8点班次'):
-    flexible_closing_time = start_time.addSecs(10 * 3600)
-    if end_time < classes_time[classes].noon_rest_time: # 上午下班
-        return time_diff(start_time, end_time), time_diff(start_time, end_time)
-    elif classes_time[classes].noon_rest_time <= end_time < classes_time[classes].noon_business_time: # 中午下班
-        return time_diff(start_time, classes_time[classes].noon_rest_time), time_diff(start_time, classes_time[classes].noon_rest_time)
-    elif classes_time[classes].noon_business_time <= end_time < classes_time[classes].closing_time: # 下午下班
-        return time_diff(start_time, end_time) - 1.5, time_diff(start_time, end_time) - 1.5
-    elif classes_time[classes].closing_time <= end_time < classes_time[classes].afnoon_business_time: # 下午休息时间下班
-        return time_diff(start_time, classes_time[classes].closing_time) - 1.5, time_diff(start_time, classes_time[classes].closing_time) - 1.5
-    elif classes_time[classes].afnoon_business_time <= end_time < flexible_closing_time: # 傍晚下班
-        return time_diff(start_time, end_time) - 2, time_diff(start_time, end_time) - 2
-    elif flexible_closing_time <= end_time: # 晚上下班
-        return 8, time_diff(start_time, end_time) - 2
-    return 0, 0
-
-# 迟到
-def eval_other_hours(start_time: QTime, end_time: QTime, classes='8点班次'):
-    rest_time = 0
-    if start_time < classes_time[classes].noon_rest_time:
-        rest_time = 2
-    elif classes_time[classes].noon_rest_time <= start_time < classes_time[classes].noon_business_time:
-        rest_time = time_diff(start_time, classes_time[classes].noon_business_time) + 0.5
-    elif classes_time[classes].noon_business_time <= start_time < classes_time[classes].closing_time:
-        rest_time = 0.5
-    elif classes_time[classes].closing_time <= start_time < classes_time[classes].afnoon_business_time:
-        rest_time = time_diff(start_time, classes_time[classes].afnoon_business_time)
-
-    if end_time < classes_time[classes].noon_rest_time: # 上午下班
-        return time_diff(start_time, end_time), time_diff(start_time, end_time)
-    elif classes_time[classes].noon_rest_time <= end_time < classes_time[classes].noon_business_time: # 中午下班
-        return time_diff(start_time, classes_time[classes].noon_rest_time), time_diff(start_time, classes_time[classes].noon_rest_time)
-    elif classes_time[classes].noon_business_time <= end_time < classes_time[classes].closing_time: # 下午下班, 休息时间扣除下午的
-        return time_diff(start_time, end_time) - rest_time + 0.5, time_diff(start_time, end_time) - rest_time + 0.5
-    elif classes_time[classes].closing_time <= end_time < classes_time[classes].afnoon_business_time: # 下午休息时间下班, 休息时间扣除下午的
-        return time_diff(start_time, classes_time[classes].closing_time) - rest_time + 0.5, time_diff(start_time, classes_time[classes].closing_time) - rest_time + 0.5
-    elif classes_time[classes].afnoon_business_time <= end_time < classes_time[classes].flexible_closing_time: # 傍晚下班
-        return time_diff(start_time, end_time) - rest_time, time_diff(start_time, end_time) - rest_time
-    elif classes_time[classes].flexible_closing_time <= end_time: # 晚上下班
-        return time_diff(start_time, classes_time[classes].flexible_closing_time) - rest_time, time_diff(start_time, end_time) - rest_time
-    return 0, 0
-
-def get_curr_day_work_hours(start_time: QTime=None, end_time: QTime=None, classes='8点班次') -> tuple[float, float]:
-    '''
-        return: 有效工时, 总工时
-    '''
-    if not classes_time.get(classes):
-        return -1, -1
-    if not start_time or not end_time: # 旷工
-        return 0, 0
-    if start_time > end_time:
-        return -1, -1
-    # 无效上班
-    if end_time < classes_time[classes].business_time or start_time >= classes_time[classes].flexible_closing_time:
-        return 0, time_diff(start_time, end_time)
-    if start_time < classes_time[classes].business_time:
-        return eval_standard_hours(start_time, end_time, classes)
-    elif classes_time[classes].business_time <= start_time < classes_time[classes].flexible_business_time:
-        return eval_flexible_hours(start_time, end_time, classes)
-    else:
-        return eval_other_hours(start_time, end_time, classes)
-
-def set_work_hours_to_db(date: QDate, effect_hours: float, total_hours: float, is_work_day: bool):
-    work_hours_config = get_config('WorkHours')
-    year = date.year()
-    month = date.month()
-    day = date.day()
-    year_config = work_hours_config.get(year)
-    if year_config is None:
-        work_hours_config[year] = {}
-    month_config = work_hours_config[year].get(month)
-    if month_config is None:
-        work_hours_config[year][month] = {}
+        log_error(f'班次配置有误, 沿用原有班次: {e}')
+    return list(get_shift_rules())
+
+def set_shift_field(name: str, field: str, value):
+    """ 修改一个班次的单个字段, 如set_shift_field('8点班次', 'overtime_unit', 30)
+
+    班次的规则作为'Shifts'的一个配置项整体保存, 这里复制后修改再整体写回;
+    修改后的规则编译失败时抛出ValueError, 配置不变。
+    """
+    shift = dict(get_config('Shifts', name))
+    if field not in shift:
+        raise ValueError(f'班次{name}没有字段: {field}')
+    shift[field] = value
+    ShiftRule(name, shift) # 先校验, 避免写入无法编译的班次
+    set_config('Shifts', shift, name)
+
+def is_work_day(day: int) -> tuple[bool, str]:
+    """ 返回是否为工作日及说明, 没有节假日数据的年份按双休推算并给出说明 """
+    ret, estimated = work_calendar.is_workday(day)
+    return ret, f'{datetime.date.fromordinal(day).year}年暂无节假日数据, 按双休推算' if estimated else ''
+
+def set_work_hours_to_db(day: int, effect_hours: float, total_hours: float, is_work_day: bool,
+                         start_time: int | None=None, end_time: int | None=None):
+    """ 保存单日工时, 上下班时间(当天0点起的分钟数)一并保存, 供趋势分析使用; 修改可撤销 """
     if not is_work_day: # 休息日不计入有效工时
         effect_hours = 0
-    work_hours_config[year][month][day] = {'effect_hours': effect_hours, 'total_hours': total_hours}
-    set_config('WorkHours', work_hours_config)
-
-def get_work_hours_from_db(date: QDate) -> tuple[float, float]:
-    work_hours_config = get_config('WorkHours')
-    year = date.year()
-    month = date.month()
-    day = date.day()
-    day_config = work_hours_config.get(year, {}).get(month, {}).get(day, {})
-    if not day_config:
-        return 0, 0
-    return day_config['effect_hours'], day_config['total_hours']
-
-def query_work_hours(year: int, month: int) -> tuple[int, int]:
-    work_hours_config = get_config('WorkHours')
-    year_config = work_hours_config.get(year)
-    if not year_config:
-        return 0, 0
-
-    month_config = year_config.get(month)
-    if not month_config:
-        return 0, 0
-
-    effect_hours = 0
-    total_hours = 0
-    for v in month_config.values():
-        effect_hours += v['effect_hours']
-        total_hours += v['total_hours']
-    return effect_hours, total_hours
\ No newline at end of file
+    date = datetime.date.fromordinal(day)
+    edit_history.record(work_hours_db.set_day(date.year, date.month, date.day, effect_hours, total_hours, start_time, end_time))
+
+class EditHistory:
+    """ 界面中修改工时的撤销/重做栈
+
+    栈中只保存修改历史的序号, 撤销与重做本身也作为一次修改追加到数据库的修改历史中, 历史记录始终只追加
+    """
+
+    def __init__(self):
+        self._undo: list[int] = []
+        self._redo: list[int] = []
+
+    def record(self, seq: int | None):
+        """ 记录一次新的修改, 清空重做栈; 内容未变化(seq为None)时忽略 """
+        if seq is None:
+            return
+        self._undo.append(seq)
+        self._redo.clear()
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    @staticmethod
+    def _apply(seq: int, restore_old: bool, source: str) -> int | None:
+        entry = work_hours_db.history_entry(seq)
+        if entry is None:
+            return None
+        year, month, day = entry[2:5]
+        values = entry[5:9] if restore_old else entry[9:13]
+        if values[0] is None: # 修改前没有记录
+            work_hours_db.delete_day(year, month, day, source)
+        else:
+            work_hours_db.set_day(year, month, day, *values, source=source)
+        return datetime.date(year, month, day).toordinal()
+
+    def _move(self, src: list[int], dst: list[int], restore_old: bool, source: str) -> int | None:
+        # 写入失败抛出异常时两个栈保持不变; 修改历史已不存在时丢弃该序号, 不移到另一个栈
+        seq = src[-1]
+        day = self._apply(seq, restore_old, source)
+        src.pop()
+        if day is not None:
+            dst.append(seq)
+        return day
+
+    def undo(self) -> int | None:
+        """ 撤销最近一次修改, 恢复修改前的值
+
+        Returns
+        -------
+        int | None
+            被撤销的日期序数, 没有可撤销的修改时为None
+        """
+        if not self._undo:
+            return None
+        return self._move(self._undo, self._redo, True, 'undo')
+
+    def redo(self) -> int | None:
+        """ 重做最近一次撤销的修改, 返回值同undo """
+        if not self._redo:
+            return None
+        return self._move(self._redo, self._undo, False, 'redo')
+
+edit_history = EditHistory()
+
+def current_profile() -> str:
+    return work_hours_db.profile
+
+def switch_work_hours_profile(profile: str):
+    """ 切换当前档案并记住选择, 撤销记录只对原档案有效, 一并清空 """
+    switch_profile(profile)
+    set_config('Profiles', profile, 'Current')
+    edit_history.clear()
+
+def new_work_hours_profile(profile: str) -> list[str]:
+    """ 新建档案, 返回全部档案名 """
+    create_profile(profile)
+    return profile_names()
+
+def get_work_hours_as_of(day: int, timestamp: float) -> tuple[float, float] | None:
+    """ 某一时刻(time.time()格式)该天的有效工时与总工时, 当时没有记录时为None """
+    date = datetime.date.fromordinal(day)
+    record = work_hours_db.get_day_as_of(date.year, date.month, date.day, timestamp)
+    return None if record is None else record[:2]
+
+def get_work_hours_from_db(day: int) -> tuple[float, float]:
+    date = datetime.date.fromordinal(day)
+    effect, total = work_hours_db.month_days(date.year, date.month) # 同月的日期共用一次查询
+    return effect[date.day - 1], total[date.day - 1]
+
+def get_month_heat(year: int, month: int) -> tuple[memoryview, int]:
+    """ 日历热力图所需的整月数据, 均来自按月的缓存
+
+    Returns
+    -------
+    tuple[memoryview, int]
+        每日有效工时(下标为日期-1), 工作日掩码(第i位对应该月第i+1天)
+    """
+    return work_hours_db.month_days(year, month)[0], work_calendar.month_mask(year, month)
+
+def query_work_hours(year: int, month: int) -> tuple[float, float]:
+    return work_hours_db.sum_month(year, month)
+
+def query_work_hours_quarter(year: int, quarter: int) -> tuple[float, float]:
+    return work_hours_db.sum_quarter(year, quarter)
+
+def query_work_hours_year(year: int) -> tuple[float, float]:
+    return work_hours_db.sum_year(year)
+
+def query_work_hours_range(start_day: int, end_day: int) -> tuple[float, float]:
+    """ 统计[start_day, end_day]内的工时, 参数为日期序数 """
+    return work_hours_db.sum_range(datetime.date.fromordinal(start_day), datetime.date.fromordinal(end_day))
+
+REPORT_HEADER = ('日期', '类型', '有效工时', '总工时')
+
+class ReportRow(NamedTuple):
+    kind: str # day: 单日, month: 月小计, total: 合计
+    label: str
+    day_type: str
+    effect_hours: float
+    total_hours: float
+
+    def values(self) -> tuple:
+        return self.label, self.day_type, round(self.effect_hours, 2), round(self.total_hours, 2)
+
+def iter_report_rows(start_day: int, end_day: int, fill_days=True) -> Iterator[ReportRow]:
+    """ 逐行生成[start_day, end_day]内的工时报表, 每月末尾附月小计, 最后附合计
+
+    Parameters
+    ----------
+    start_day, end_day: int
+        起止日期序数
+
+    fill_days: bool
+        是否输出没有工时记录的日期
+    """
+    records = work_hours_db.iter_days(datetime.date.fromordinal(start_day), datetime.date.fromordinal(end_day))
+    record = next(records, None)
+    month = None
+    month_rows = 0
+    month_effect = month_total = all_effect = all_total = 0
+    for day in range(start_day, end_day + 1):
+        date = datetime.date.fromordinal(day)
+        if month is not None and (date.year, date.month) != month:
+            if month_rows:
+                yield ReportRow('month', f'{month[0]}年{month[1]}月小计', '', month_effect, month_total)
+            month_rows = 0
+            month_effect = month_total = 0
+        month = date.year, date.month
+
+        effect_hours = total_hours = 0
+        has_record = record is not None and record[:3] == (date.year, date.month, date.day)
+        if has_record:
+            effect_hours, total_hours = record[3:5]
+            record = next(records, None)
+        elif not fill_days:
+            continue
+        ret, note = is_work_day(day)
+        day_type = ('工作日' if ret else '休息日') + ('(推算)' if note else '')
+        month_rows += 1
+        month_effect += effect_hours
+        month_total += total_hours
+        all_effect += effect_hours
+        all_total += total_hours
+        yield ReportRow('day', date.isoformat(), day_type, effect_hours, total_hours)
+    if month_rows:
+        yield ReportRow('month', f'{month[0]}年{month[1]}月小计', '', month_effect, month_total)
+    yield ReportRow('total', '合计', '', all_effect, all_total)
+
+def write_report_csv(rows: Iterator[ReportRow], path: str):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f: # 带BOM, Excel可直接打开
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADER)
+        for row in rows:
+            writer.writerow(row.values())
+
+def write_report_json(rows: Iterator[ReportRow], path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for i, row in enumerate(rows):
+            f.write(',\n' if i else '\n')
+            f.write(json.dumps(dict(zip(('kind',) + REPORT_HEADER, (row.kind,) + row.values())), ensure_ascii=False))
+        f.write('\n]\n')
+
+def write_report_xlsx(rows: Iterator[ReportRow], path: str):
+    import openpyxl # 只有导出xlsx时才用到, 避免导入本模块时加载
+    workbook = openpyxl.Workbook(write_only=True) # 只写模式逐行落盘, 不保留整张表
+    sheet = workbook.create_sheet('工时')
+    sheet.append(REPORT_HEADER)
+    for row in rows:
+        sheet.append(row.values())
+    workbook.save(path)
+
+REPORT_WRITERS = {
+    '.csv': write_report_csv,
+    '.json': write_report_json,
+    '.xlsx': write_report_xlsx,
+}
+
+def export_work_hours(start_day: int, end_day: int, path: str, fill_days=True):
+    """ 导出工时报表, 格式由文件后缀决定(csv/json/xlsx) """
+    writer = REPORT_WRITERS.get(os.path.splitext(path)[1].lower())
+    if writer is None:
+        raise ValueError(f'不支持的导出格式: {path}, 仅支持{"/".join(REPORT_WRITERS)}')
+    writer(iter_report_rows(start_day, end_day, fill_days), path)
+
+if __name__ == '__main__':
+    import argparse
+
+    from source.util.db import config_close, config_init
+
+    parser = argparse.ArgumentParser(description='导出工时报表')
+    parser.add_argument('output', help='输出文件, 格式由后缀决定: csv/json/xlsx')
+    parser.add_argument('--month', help='导出整月, 格式为YYYY-MM, 默认为上个月')
+    parser.add_argument('--start', help='起始日期, 格式为YYYY-MM-DD')
+    parser.add_argument('--end', help='结束日期, 格式为YYYY-MM-DD')
+    parser.add_argument('--skip-empty', action='store_true', help='不输出没有工时记录的日期')
+    args = parser.parse_args()
+
+    if args.start or args.end:
+        if not args.start or not args.end:
+            parser.error('--start与--end需同时指定')
+        start = datetime.date.fromisoformat(args.start)
+        end = datetime.date.fromisoformat(args.end)
+    else:
+        if args.month:
+            start = datetime.date.fromisoformat(f'{args.month}-01')
+        else:
+            start = (datetime.date.today().replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+        end = (start + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+    if start > end:
+        parser.error('起始日期不能晚于结束日期')
+
+    config_init()
+    try:
+        export_work_hours(start.toordinal(), end.toordinal(), args.output, not args.skip_empty)
+    finally:
+        config_close()
+    print(f'已导出{start}至{end}的工时到{args.output}')
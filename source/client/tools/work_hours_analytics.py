@@ -0,0 +1,223 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 工时趋势分析
+
+'''
+将一段日期内的工时一次读入按天连续排列的numpy数组(下标为距起始日期的天数), 之后的滚动平均、
+按周/月/星期分组、百分位数均为向量化计算。
+读入的数据与分析结果按日期范围缓存, 工时数据库写入后(generation变化)失效。
+'''
+
+import datetime
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from source.client.tools.work_calendar import YEAR_BYTES, work_calendar
+from source.util.db import work_hours_db
+
+CACHE_SIZE = 8
+RECENT_WEEKS = 8 # 文字报告中逐周列出的周数
+UNIX_EPOCH = datetime.date(1970, 1, 1).toordinal() # datetime64的起点
+
+class WorkHoursFrame:
+    """ 按天连续排列的工时数据, 没有记录的日期工时为0, 上下班时间为nan """
+
+    __slots__ = ('first_day', 'days', 'effect', 'total', 'start', 'end', 'recorded', 'workday')
+
+    def __init__(self, start_day: int, end_day: int):
+        count = end_day - start_day + 1
+        self.first_day = start_day
+        self.days = np.arange(start_day, end_day + 1, dtype=np.int64) # 日期序数
+        self.effect = np.zeros(count)
+        self.total = np.zeros(count)
+        self.start = np.full(count, np.nan)
+        self.end = np.full(count, np.nan)
+        self.recorded = np.zeros(count, dtype=bool)
+        self.workday = self._workdays(start_day, end_day)
+        self._load(start_day, end_day)
+
+    def _load(self, start_day: int, end_day: int):
+        start = datetime.date.fromordinal(start_day)
+        end = datetime.date.fromordinal(end_day)
+        for year, month, day, effect_hours, total_hours, start_time, end_time in work_hours_db.iter_days(start, end):
+            i = datetime.date(year, month, day).toordinal() - start_day
+            self.effect[i] = effect_hours
+            self.total[i] = total_hours
+            self.start[i] = np.nan if start_time is None else start_time
+            self.end[i] = np.nan if end_time is None else end_time
+            self.recorded[i] = True
+
+    @staticmethod
+    def _workdays(start_day: int, end_day: int) -> np.ndarray:
+        """ 由日历的年位图展开为按天的布尔数组 """
+        first_year = datetime.date.fromordinal(start_day).year
+        last_year = datetime.date.fromordinal(end_day).year
+        masks = []
+        for year in range(first_year, last_year + 1):
+            bits = np.frombuffer(work_calendar.year_mask(year).to_bytes(YEAR_BYTES, 'little'), dtype=np.uint8)
+            days = (datetime.date(year + 1, 1, 1) - datetime.date(year, 1, 1)).days
+            masks.append(np.unpackbits(bits, bitorder='little')[:days])
+        offset = start_day - datetime.date(first_year, 1, 1).toordinal()
+        return np.concatenate(masks)[offset:offset + end_day - start_day + 1].astype(bool)
+
+    def dates(self) -> np.ndarray:
+        return self.to_dates(self.days)
+
+    def week_keys(self) -> np.ndarray:
+        """ 每天所在周的周一(日期序数) """
+        return self.days - (self.days - 1) % 7
+
+    @staticmethod
+    def to_dates(days: np.ndarray) -> np.ndarray:
+        return np.datetime64('1970-01-01', 'D') + (days - UNIX_EPOCH)
+
+    def month_keys(self) -> np.ndarray:
+        return self.dates().astype('datetime64[M]')
+
+    def weekdays(self) -> np.ndarray:
+        """ 0为周一 """
+        return (self.days - 1) % 7
+
+    @property
+    def overtime(self) -> np.ndarray:
+        return self.total - self.effect
+
+def group_sum(keys: np.ndarray, values: np.ndarray, mask: np.ndarray=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ 按keys分组求和
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        分组的key, 各组的和, 各组参与计算的天数
+    """
+    if mask is not None:
+        keys = keys[mask]
+        values = values[mask]
+    groups, inverse = np.unique(keys, return_inverse=True)
+    return groups, np.bincount(inverse, weights=values, minlength=len(groups)), np.bincount(inverse, minlength=len(groups))
+
+def rolling_weekly_average(frame: WorkHoursFrame, weeks=4) -> np.ndarray:
+    """ 截至每一天的最近weeks周内平均每周的有效工时, 不满weeks周的日期为nan """
+    window = weeks * 7
+    result = np.full(len(frame.days), np.nan)
+    if len(frame.days) >= window:
+        cumsum = np.concatenate(([0], np.cumsum(frame.effect)))
+        result[window - 1:] = (cumsum[window:] - cumsum[:-window]) / weeks
+    return result
+
+def leave_time_percentiles(frame: WorkHoursFrame, percents=(50, 90)) -> np.ndarray:
+    """ 工作日下班时间的百分位数(当天0点起的分钟数), 没有数据时为nan """
+    ends = frame.end[frame.workday & ~np.isnan(frame.end)]
+    if not len(ends):
+        return np.full(len(percents), np.nan)
+    return np.percentile(ends, percents)
+
+@dataclass(slots=True)
+class WorkHoursTrends:
+    dates: np.ndarray # datetime64[D]
+    rolling_average: np.ndarray # 近4周平均每周有效工时
+    weeks: np.ndarray # 每周的周一, datetime64[D]
+    week_effect: np.ndarray
+    week_overtime: np.ndarray
+    months: np.ndarray # datetime64[M]
+    month_effect: np.ndarray
+    month_overtime: np.ndarray
+    weekday_average: np.ndarray # 周一至周日有记录日期的平均有效工时
+    leave_p50: float # 下班时间, 当天0点起的分钟数
+    leave_p90: float
+
+def compute_trends(frame: WorkHoursFrame) -> WorkHoursTrends:
+    weeks, week_effect, _ = group_sum(frame.week_keys(), frame.effect)
+    _, week_overtime, _ = group_sum(frame.week_keys(), frame.overtime)
+    months, month_effect, _ = group_sum(frame.month_keys(), frame.effect)
+    _, month_overtime, _ = group_sum(frame.month_keys(), frame.overtime)
+    weekday_effect = np.bincount(frame.weekdays()[frame.recorded], weights=frame.effect[frame.recorded], minlength=7)
+    weekday_count = np.bincount(frame.weekdays()[frame.recorded], minlength=7)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weekday_average = weekday_effect / weekday_count
+    leave_p50, leave_p90 = leave_time_percentiles(frame)
+    return WorkHoursTrends(frame.dates(), rolling_weekly_average(frame), frame.to_dates(weeks), week_effect, week_overtime,
+                           months, month_effect, month_overtime,
+                           weekday_average, float(leave_p50), float(leave_p90))
+
+_cache: OrderedDict[tuple[int, int], tuple[int, WorkHoursFrame, WorkHoursTrends]] = OrderedDict()
+
+def get_trends(start_day: int, end_day: int) -> WorkHoursTrends:
+    """ 分析[start_day, end_day]内的工时趋势, 数据未变化时直接返回缓存结果 """
+    key = start_day, end_day
+    generation = work_hours_db.generation
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == generation:
+        _cache.move_to_end(key)
+        return cached[2]
+    frame = WorkHoursFrame(start_day, end_day)
+    trends = compute_trends(frame)
+    _cache[key] = generation, frame, trends
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return trends
+
+def format_minutes(minutes: float) -> str:
+    if np.isnan(minutes):
+        return '--:--'
+    minutes = round(minutes)
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+def format_trends(trends: WorkHoursTrends) -> str:
+    weekday_names = ('一', '二', '三', '四', '五', '六', '日')
+    lines = [f'下班时间: 中位数 {format_minutes(trends.leave_p50)}, 90%在 {format_minutes(trends.leave_p90)} 之前']
+    valid = ~np.isnan(trends.rolling_average)
+    if valid.any():
+        lines.append(f'近4周平均每周有效工时: {trends.rolling_average[valid][-1]:.2f}小时, '
+                     f'区间内最高 {trends.rolling_average[valid].max():.2f}, 最低 {trends.rolling_average[valid].min():.2f}')
+    lines.append('按星期平均有效工时: ' + ', '.join(f'周{name} {"-" if np.isnan(hours) else round(hours, 2)}'
+                                                  for name, hours in zip(weekday_names, trends.weekday_average)))
+    lines.append(f'最近{min(RECENT_WEEKS, len(trends.weeks))}周有效工时 / 加班(按周一所在日期):')
+    for week, effect, overtime in zip(trends.weeks[-RECENT_WEEKS:], trends.week_effect[-RECENT_WEEKS:],
+                                      trends.week_overtime[-RECENT_WEEKS:]):
+        lines.append(f'    {week}: {effect:.2f} / {overtime:.2f}')
+    lines.append('每月有效工时 / 加班:')
+    for month, effect, overtime in zip(trends.months, trends.month_effect, trends.month_overtime):
+        lines.append(f'    {month}: {effect:.2f} / {overtime:.2f}')
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    import os
+    import random
+    import tempfile
+    import time
+
+    # 在临时数据库中生成3年的工时, 与逐天遍历的计算结果比对, 并统计耗时
+    rng = random.Random(0)
+    work_hours_db.db_file = os.path.join(tempfile.mkdtemp(), 'work_hours.db')
+    end_day = datetime.date.today().toordinal()
+    start_day = end_day - 3 * 365
+    records = []
+    for day in range(start_day, end_day + 1):
+        if rng.random() < 0.2: # 部分日期没有记录
+            continue
+        date = datetime.date.fromordinal(day)
+        start, end = rng.randint(420, 600), rng.randint(960, 1260)
+        effect = (end - start) / 60 - 1.5
+        records.append((date.year, date.month, date.day, effect if work_calendar.is_workday(day)[0] else 0,
+                        effect + 1.5, start, end))
+    work_hours_db.set_days(records)
+
+    begin = time.perf_counter()
+    trends = get_trends(start_day, end_day)
+    cost = time.perf_counter() - begin
+    begin = time.perf_counter()
+    get_trends(start_day, end_day)
+    cached_cost = time.perf_counter() - begin
+
+    effect = [work_hours_db.month_days(*datetime.date.fromordinal(day).timetuple()[:2])[0][datetime.date.fromordinal(day).day - 1]
+              for day in range(start_day, end_day + 1)]
+    expect = sum(effect[-28:]) / 4
+    print(f'近4周平均: 向量化 {trends.rolling_average[-1]:.4f}, 逐天 {expect:.4f}')
+    monday = end_day - (end_day - 1) % 7
+    print(f'本周有效工时: 向量化 {trends.week_effect[-1]:.4f}, 逐天 {sum(effect[monday - start_day:]):.4f}')
+    print(f'3年数据分析耗时: {cost * 1000:.1f}ms, 命中缓存: {cached_cost * 1000:.3f}ms')
+    print(format_trends(trends))
+    work_hours_db.close()
@@ -0,0 +1,215 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 工时批量计算
+
+'''
+与get_curr_day_work_hours相同的算法: 班次编译为累计工作分钟数W(t)的区间表(见work_hours_core),
+任意时间段内的工时即为 W(结束) - W(开始), 各种上班情况只是计算有效工时的起止时间不同。
+整批记录的W(t)通过numpy.interp在同一张区间表上插值得到, 结果与逐条计算一致。
+'''
+
+import numpy as np
+
+from source.client.tools.work_hours_core import DAY_MINUTES, ShiftRule, get_shift_rules
+
+MISSING = -1 # 缺少上班或下班时间(旷工)
+
+def shift_rule_list() -> list[ShiftRule]:
+    """ 当前班次列表, 班次id即班次在此列表中的下标 """
+    return list(get_shift_rules().values())
+
+def shift_id(classes: str, rules: list[ShiftRule]=None) -> int:
+    rules = shift_rule_list() if rules is None else rules
+    for i, rule in enumerate(rules):
+        if rule.name == classes:
+            return i
+    raise ValueError(f'班次{classes}不存在')
+
+def eval_work_hours_batch(start_minutes, end_minutes, shift_ids, rules: list[ShiftRule]=None) -> tuple[np.ndarray, np.ndarray]:
+    """ 批量计算工时
+
+    Parameters
+    ----------
+    start_minutes: array_like
+        上班时间, 当天0点起的分钟数, 缺失时为MISSING
+
+    end_minutes: array_like
+        下班时间, 当天0点起的分钟数, 缺失时为MISSING
+
+    shift_ids: array_like
+        班次id, 见shift_rule_list
+
+    rules: list[ShiftRule]
+        计算shift_ids时使用的班次列表, 默认为当前班次
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        有效工时, 总工时; 与get_curr_day_work_hours一致, 时间异常的记录为-1
+    """
+    rules = shift_rule_list() if rules is None else rules
+    start = np.asarray(start_minutes, dtype=np.float64)
+    end = np.asarray(end_minutes, dtype=np.float64).copy()
+    shifts = np.asarray(shift_ids, dtype=np.int64)
+    missing = (start == MISSING) | (end == MISSING)
+    effect_hours = np.zeros(start.shape, dtype=np.float64)
+    total_hours = np.zeros(start.shape, dtype=np.float64)
+    error = (shifts < 0) | (shifts >= len(rules))
+
+    for sid, rule in enumerate(rules):
+        mask = (shifts == sid) & ~missing
+        if not mask.any():
+            continue
+        xp = np.asarray(rule.xp, dtype=np.float64)
+        fp = np.asarray(rule.fp, dtype=np.float64)
+        s = start[mask]
+        e = end[mask]
+        if rule.overnight: # 跨天班次次日下班
+            e = np.where(e < s, e + DAY_MINUTES, e)
+        total = np.interp(e, xp, fp) - np.interp(s, xp, fp)
+
+        standard = s < rule.business
+        flexible = ~standard & (s < rule.flexible_business)
+        count_start = np.where(standard, rule.business, s)
+        count_end = np.where(standard, rule.closing, np.where(flexible, s + rule.flexible_minutes, rule.flexible_closing))
+        effect = np.interp(np.minimum(e, count_end), xp, fp) - np.interp(count_start, xp, fp)
+        if rule.overtime_unit > 0:
+            total = effect + (total - effect) // rule.overtime_unit * rule.overtime_unit
+
+        # 无效上班: 上班前就已下班, 或弹性下班后才上班
+        invalid = (e < rule.business) | (s >= rule.flexible_closing)
+        effect[invalid] = 0
+        total[invalid] = e[invalid] - s[invalid]
+        effect_hours[mask] = effect / 60
+        total_hours[mask] = total / 60
+        error[mask] = s > e
+
+    effect_hours[error] = -1
+    total_hours[error] = -1
+    return effect_hours, total_hours
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from source.client.tools.work_hours_core import DEFAULT_SHIFTS, get_curr_day_work_hours, parse_clock, set_shift_rules
+
+    def to_time(minutes: int) -> int | None:
+        return None if minutes == MISSING else minutes
+
+    def time_diff(start_time: int, end_time: int) -> float:
+        time = (end_time - start_time) / 60
+        return time if time > 0 else 0
+
+    def reference_hours(start_time: int | None, end_time: int | None, shift: dict) -> tuple[float, float]:
+        """ 区间表之前按情况分支的逐条算法, 作为独立的参照, 只适用于有午休和傍晚休息的默认班次 """
+        (noon_rest, noon_business), (closing_rest, afnoon_business) = [map(parse_clock, item) for item in shift['breaks']]
+        business, flexible_business = parse_clock(shift['business']), parse_clock(shift['flexible_business'])
+        closing, flexible_closing = parse_clock(shift['closing']), parse_clock(shift['flexible_closing'])
+        assert closing_rest == closing
+        if start_time is None or end_time is None: # 旷工
+            return 0, 0
+        if start_time > end_time:
+            return -1, -1
+        if end_time < business or start_time >= flexible_closing: # 无效上班
+            return 0, time_diff(start_time, end_time)
+        if start_time < business: # 正点上班
+            if end_time < noon_rest:
+                return time_diff(business, end_time), time_diff(start_time, end_time)
+            if end_time < noon_business:
+                return 4, time_diff(start_time, noon_rest)
+            if end_time < closing:
+                return time_diff(business, end_time) - 1.5, time_diff(start_time, end_time) - 1.5
+            if end_time < afnoon_business:
+                return 8, time_diff(start_time, closing) - 1.5
+            return 8, time_diff(start_time, end_time) - 2
+        if start_time < flexible_business: # 弹性上班
+            flexible_end = start_time + 10 * 60
+            if end_time < noon_rest:
+                return time_diff(start_time, end_time), time_diff(start_time, end_time)
+            if end_time < noon_business:
+                return time_diff(start_time, noon_rest), time_diff(start_time, noon_rest)
+            if end_time < closing:
+                return time_diff(start_time, end_time) - 1.5, time_diff(start_time, end_time) - 1.5
+            if end_time < afnoon_business:
+                return time_diff(start_time, closing) - 1.5, time_diff(start_time, closing) - 1.5
+            if end_time < flexible_end:
+                return time_diff(start_time, end_time) - 2, time_diff(start_time, end_time) - 2
+            return 8, time_diff(start_time, end_time) - 2
+        # 迟到
+        rest_time = 0
+        if start_time < noon_rest:
+            rest_time = 2
+        elif start_time < noon_business:
+            rest_time = time_diff(start_time, noon_business) + 0.5
+        elif start_time < closing:
+            rest_time = 0.5
+        elif start_time < afnoon_business:
+            rest_time = time_diff(start_time, afnoon_business)
+        if end_time < noon_rest:
+            return time_diff(start_time, end_time), time_diff(start_time, end_time)
+        if end_time < noon_business:
+            return time_diff(start_time, noon_rest), time_diff(start_time, noon_rest)
+        if end_time < closing:
+            return time_diff(start_time, end_time) - rest_time + 0.5, time_diff(start_time, end_time) - rest_time + 0.5
+        if end_time < afnoon_business:
+            if start_time >= closing: # 休息时间内上下班
+                return 0, 0
+            return time_diff(start_time, closing) - rest_time + 0.5, time_diff(start_time, closing) - rest_time + 0.5
+        if end_time < flexible_closing:
+            return time_diff(start_time, end_time) - rest_time, time_diff(start_time, end_time) - rest_time
+        return time_diff(start_time, flexible_closing) - rest_time, time_diff(start_time, end_time) - rest_time
+
+    # 除默认班次外, 加入跨天的夜班和按半小时计加班的班次
+    set_shift_rules(DEFAULT_SHIFTS | {
+        '夜班': {'business': '20:00', 'flexible_business': '20:30', 'closing': '29:00', 'flexible_closing': '30:00',
+                 'flexible_hours': 9, 'breaks': [['24:00', '25:00']], 'overtime_unit': 0},
+        '加班半小时计': dict(DEFAULT_SHIFTS['8点班次'], overtime_unit=30)
+    })
+    SHIFT_NAMES = list(get_shift_rules())
+
+    # 一致性校验: 遍历所有班次的上下班时间组合(上班时间步长1分钟, 下班时间步长5分钟), 并覆盖缺失时间。
+    # 默认班次与上面独立的分支算法比较; 参照算法无法表达的夜班与加班取整班次, 与逐条计算比较
+    grid = [MISSING] + list(range(0, DAY_MINUTES, 5))
+    starts, ends, shifts = [], [], []
+    for sid in range(len(SHIFT_NAMES)):
+        for s in [MISSING] + list(range(DAY_MINUTES)):
+            for e in grid:
+                starts.append(s)
+                ends.append(e)
+                shifts.append(sid)
+    effect, total = eval_work_hours_batch(starts, ends, shifts)
+    mismatch = 0
+    for i, (s, e, sid) in enumerate(zip(starts, ends, shifts)):
+        name = SHIFT_NAMES[sid]
+        if name in DEFAULT_SHIFTS:
+            expect = reference_hours(to_time(s), to_time(e), DEFAULT_SHIFTS[name])
+            scalar = get_curr_day_work_hours(to_time(s), to_time(e), name)
+            if abs(expect[0] - scalar[0]) > 1e-9 or abs(expect[1] - scalar[1]) > 1e-9:
+                mismatch += 1
+                print(f'不一致: {name} {s}-{e} 参照: {expect} 逐条: {scalar}')
+        else:
+            expect = get_curr_day_work_hours(to_time(s), to_time(e), name)
+        if abs(expect[0] - effect[i]) > 1e-9 or abs(expect[1] - total[i]) > 1e-9:
+            mismatch += 1
+            print(f'不一致: {name} {s}-{e} 参照: {expect} 批量: {effect[i]}, {total[i]}')
+    print(f'一致性校验: {len(starts)}条, 不一致: {mismatch}条')
+    if mismatch:
+        sys.exit(1)
+
+    # 性能测试: 10万天的随机上下班时间
+    rng = np.random.default_rng(0)
+    count = 100000
+    starts = rng.integers(7 * 60, 11 * 60, count)
+    ends = rng.integers(16 * 60, 22 * 60, count)
+    shifts = rng.integers(0, len(SHIFT_NAMES), count)
+
+    begin = time.perf_counter()
+    for s, e, sid in zip(starts.tolist(), ends.tolist(), shifts.tolist()):
+        get_curr_day_work_hours(to_time(s), to_time(e), SHIFT_NAMES[sid])
+    scalar_cost = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    eval_work_hours_batch(starts, ends, shifts)
+    batch_cost = time.perf_counter() - begin
+    print(f'{count}天, 逐条计算: {scalar_cost * 1000:.1f}ms, 批量计算: {batch_cost * 1000:.1f}ms')
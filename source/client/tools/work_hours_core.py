@@ -0,0 +1,145 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 工时计算核心
+
+'''
+工时计算只依赖整数时间: 时间为当天0点起的分钟数, 日期为datetime.date.toordinal()的序数。
+不依赖Qt, 可在无界面脚本、进程池中使用, 所有结构均可序列化; Qt类型的转换在界面层完成。
+
+班次由配置描述(见source.util.default_shifts), 编译为有序的区间表: 以休息时段的起止为断点, 记录每个断点处的
+累计工作分钟数W(t), 休息时段内W不增长。任意时间段的工时为W(结束) - W(开始), 一次二分查找即可求出。
+各种上班情况只是计算有效工时的起止时间不同:
+    正点上班(上班时间前到岗): 从上班时间算起, 到下班时间为止
+    弹性上班(弹性上班截止前到岗): 从到岗时间算起, 满弹性时长(含休息)为止
+    迟到: 从到岗时间算起, 到弹性下班时间为止
+总工时超出有效工时的部分为加班, 可按加班单位向下取整。
+'''
+
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Mapping
+
+from source.util.default_shifts import DEFAULT_SHIFTS
+
+DAY_MINUTES = 24 * 60
+HORIZON = 3 * DAY_MINUTES # 区间表覆盖的范围, 跨天班次的时间可超过24点
+
+def clock(hour: int, minute: int=0) -> int:
+    return hour * 60 + minute
+
+def parse_clock(text: str) -> int:
+    hour, minute = str(text).split(':')
+    return clock(int(hour), int(minute))
+
+class ShiftRule:
+    """ 编译后的班次规则 """
+
+    __slots__ = ('name', 'business', 'flexible_business', 'closing', 'flexible_closing', 'flexible_minutes',
+                 'overtime_unit', 'overnight', 'xp', 'fp', 'slope')
+
+    def __init__(self, name: str, config: Mapping):
+        self.name = name
+        self.business = parse_clock(config['business'])
+        self.flexible_business = parse_clock(config['flexible_business'])
+        self.closing = parse_clock(config['closing'])
+        self.flexible_closing = parse_clock(config['flexible_closing'])
+        self.flexible_minutes = round(config.get('flexible_hours', 10) * 60)
+        self.overtime_unit = int(config.get('overtime_unit', 0))
+        self.overnight = self.flexible_closing > DAY_MINUTES # 跨天班次, 下班时间早于上班时间时视为次日
+        if not self.business <= self.flexible_business <= self.flexible_closing or not self.business <= self.closing:
+            raise ValueError(f'班次{name}的时间顺序错误')
+
+        # 断点xp处的累计工作分钟数为fp, [xp[i], xp[i+1])内的斜率为slope[i]
+        self.xp = [0]
+        self.fp = [0]
+        self.slope = []
+        for start, end in sorted((parse_clock(start), parse_clock(end)) for start, end in config.get('breaks', ())):
+            if start < self.xp[-1] or end < start:
+                raise ValueError(f'班次{name}的休息时段重叠或错误')
+            self.slope.append(1)
+            self.xp.append(start)
+            self.fp.append(self.fp[-1] + start - self.xp[-2])
+            self.slope.append(0)
+            self.xp.append(end)
+            self.fp.append(self.fp[-1])
+        self.slope.append(1)
+        self.xp.append(HORIZON)
+        self.fp.append(self.fp[-1] + HORIZON - self.xp[-2])
+
+    def work_minutes(self, minute: int) -> int:
+        """ 从0点到minute的累计工作分钟数 """
+        i = bisect_right(self.xp, minute) - 1
+        if i >= len(self.slope):
+            i = len(self.slope) - 1
+        return self.fp[i] + (minute - self.xp[i]) * self.slope[i]
+
+    def count_window(self, start_time: int) -> tuple[int, int]:
+        """ 按到岗时间确定计算有效工时的起止时间 """
+        if start_time < self.business: # 正点上班
+            return self.business, self.closing
+        if start_time < self.flexible_business: # 弹性上班
+            return start_time, start_time + self.flexible_minutes
+        return start_time, self.flexible_closing # 迟到
+
+    def evaluate(self, start_time: int, end_time: int) -> tuple[float, float]:
+        """ 计算有效工时与总工时(小时), 调用方需保证start_time <= end_time """
+        if end_time < self.business or start_time >= self.flexible_closing: # 无效上班
+            return 0, (end_time - start_time) / 60
+        total = self.work_minutes(end_time) - self.work_minutes(start_time)
+        count_start, count_end = self.count_window(start_time)
+        effect = self.work_minutes(min(end_time, count_end)) - self.work_minutes(count_start)
+        if self.overtime_unit > 0:
+            total = effect + (total - effect) // self.overtime_unit * self.overtime_unit
+        return effect / 60, total / 60
+
+def compile_shifts(config: Mapping[str, Mapping]) -> dict[str, ShiftRule]:
+    return {name: ShiftRule(name, shift) for name, shift in config.items()}
+
+_shift_rules = compile_shifts(DEFAULT_SHIFTS)
+
+def get_shift_rules() -> dict[str, ShiftRule]:
+    return _shift_rules
+
+def set_shift_rules(config: Mapping[str, Mapping]):
+    """ 按配置重新编译班次, 编译失败时保留原有班次并抛出异常 """
+    global _shift_rules
+    rules = compile_shifts(config)
+    if not rules:
+        raise ValueError('至少需要配置一个班次')
+    _shift_rules = rules
+
+def get_curr_day_work_hours(start_time: int | None=None, end_time: int | None=None, classes='8点班次') -> tuple[float, float]:
+    '''
+        return: 有效工时, 总工时
+    '''
+    rule = _shift_rules.get(classes)
+    if rule is None:
+        return -1, -1
+    if start_time is None or end_time is None: # 旷工
+        return 0, 0
+    if rule.overnight and end_time < start_time: # 跨天班次次日下班
+        end_time += DAY_MINUTES
+    if start_time > end_time:
+        return -1, -1
+    return rule.evaluate(start_time, end_time)
+
+@dataclass(slots=True, frozen=True)
+class WorkRecord:
+    """ 单日打卡记录 """
+
+    day: int # 日期序数
+    start_time: int | None # 上班时间, 缺失为None
+    end_time: int | None # 下班时间, 缺失为None
+    classes: str = '8点班次'
+
+def eval_work_records(records: list[WorkRecord], shifts: Mapping[str, Mapping]=None) -> list[tuple[float, float]]:
+    """ 批量重算打卡记录, 可直接提交到进程池并行计算
+
+    Parameters
+    ----------
+    shifts: Mapping[str, Mapping]
+        班次配置, 子进程中没有主进程加载的班次配置, 需随任务一同传入
+    """
+    if shifts is not None:
+        set_shift_rules(shifts)
+    return [get_curr_day_work_hours(record.start_time, record.end_time, record.classes) for record in records]
@@ -2,54 +2,650 @@
 # 作者: 拓跋龙
 # 功能: 数据库操作接口
 
+import datetime
+import itertools
 import os
 import shelve
+import sqlite3
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Callable, Iterable, Iterator
 
-from source.util.default_config import conf
+from source.util.journal import Journal
+from source.util.year_records import YearRecords
 
 g_workspace = os.getcwd()
-CONFIG_FILE = os.path.join(g_workspace, 'config/db/config') # nosql数据库
-config_data = {} # 配置数据
+CONFIG_FILE = os.path.join(g_workspace, 'config/db/config') # 旧版本shelve配置DB, 仅用于迁移
+JOURNAL_FILE = os.path.join(g_workspace, 'config/db/config.journal') # 追加写配置DB
+WORK_HOURS_FILE = os.path.join(g_workspace, 'config/db/work_hours.db') # 工时数据库, 按天存储, 即默认档案的分片
+DEFAULT_PROFILE = '默认' # 默认档案, 工时存放在原有的工时数据库中
+PROFILE_DIR = os.path.join(g_workspace, 'config/db/profiles') # 其他档案的工时分片, 每个档案一个数据库
+WORK_HOURS_COLUMNS = 'work_hours (year, month, day, effect_hours, total_hours, start_time, end_time)'
+HISTORY_FIELDS = ('changed_at, source, year, month, day, old_effect, old_total, old_start, old_end, '
+                  'new_effect, new_total, new_start, new_end')
+HISTORY_COLUMNS = f'work_hours_history ({HISTORY_FIELDS})'
+YEAR_CACHE_SIZE = 8 # 按年缓存的每日工时最多保留的年数
+FLUSH_DELAY = 0.5 # 配置写入的合并延时(秒), 期间的多次修改只落盘一次
+EAGER_KEYS = ('System',) # 启动时加载的配置集, 其余配置集首次使用时再加载
+CONFIG_CHECK_INTERVAL = 2000 # 检查其他进程是否修改配置的间隔(毫秒)
+
+class ConfigSnapshot:
+    """ 不可变的配置快照, 发布后不再修改, 任意线程可无锁读取 """
+
+    __slots__ = ('version', 'data')
+
+    def __init__(self, version: int, data: MappingProxyType):
+        self.version = version
+        self.data = data
+
+    def get(self, key1: str, key2=''):
+        configs = self.data[key1]
+        return configs[key2] if key2 else configs
+
+_config_listeners: list[Callable[[list[str]], Any]] = [] # 配置变化的回调, 参数为发生变化的配置集
+_snapshot = ConfigSnapshot(0, MappingProxyType({})) # 当前发布的配置快照, 替换引用即为原子发布
+_lazy_keys = set() # 配置DB中存在但尚未加载的配置集
+_dirty_keys: dict[str, set[str]] = {} # 已修改未落盘的配置集及其配置项, 空字符串表示整个配置集
+_flush_timer: threading.Timer = None
+_publish_lock = threading.Lock() # 串行化快照发布与_dirty_keys修改, 读取无需加锁
+_write_lock = threading.Lock() # 保证批量写入按顺序落盘
+config_journal = Journal(JOURNAL_FILE)
+
+def _freeze(value):
+    if isinstance(value, (dict, MappingProxyType)):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+# 快照中的只读结构无法序列化, 落盘前还原为dict
+def _thaw(value):
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_thaw(v) for v in value)
+    return value
+
+# 需持有_publish_lock调用, 基于当前快照复制出新快照后整体替换
+def _publish(changes: dict, removed: Iterable[str]=(), bump=True):
+    global _snapshot
+    data = dict(_snapshot.data)
+    for key, value in changes.items():
+        data[key] = _freeze(value)
+    for key in removed:
+        data.pop(key, None)
+    version = _snapshot.version + 1 if bump else _snapshot.version
+    _snapshot = ConfigSnapshot(version, MappingProxyType(data))
+
+def get_config_snapshot() -> ConfigSnapshot:
+    """ 获取当前配置快照, 同一快照内的数据相互一致, 供工作线程使用 """
+    return _snapshot
+
+class WorkHoursDB:
+    """ 工时数据库, 每天一条记录, 以(年, 月, 日)为主键, 保存单日工时的开销与历史数据量无关
+
+    写入时在同一事务中按差值更新月/年汇总表; 每年另缓存按天累加的前缀和,
+    任意日期范围的统计只需查两次前缀和, 写入该年时缓存失效。
+    日历等按天展示的场景整月一次查询, 结果按LRU缓存。
+    """
+
+    def __init__(self, db_file: str, profile=DEFAULT_PROFILE):
+        self.db_file = db_file
+        self.profile = profile
+        self._conn = None
+        self._lock = threading.RLock() # 连接在GUI线程与工作线程间共享
+        self._prefix: dict[int, tuple[list[float], list[float]]] = {} # 年份 -> (有效工时前缀和, 总工时前缀和)
+        self._years: OrderedDict[int, YearRecords] = OrderedDict() # 年份 -> 全年每日工时
+        self.generation = 0 # 每次写入加1, 供依赖工时数据的缓存判断是否失效
+
+    # 首次使用时才连接, 避免拖慢启动
+    def connect(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS work_hours ('
+                               'year INTEGER NOT NULL, month INTEGER NOT NULL, day INTEGER NOT NULL, '
+                               'effect_hours REAL NOT NULL, total_hours REAL NOT NULL, '
+                               'start_time INTEGER, end_time INTEGER, '
+                               'PRIMARY KEY (year, month, day)) WITHOUT ROWID')
+            # 只追加的修改历史, 按(年, 月, 日, 修改时间)建索引用于查询任意时刻的值
+            self._conn.execute('CREATE TABLE IF NOT EXISTS work_hours_history ('
+                               'seq INTEGER PRIMARY KEY, changed_at REAL NOT NULL, source TEXT NOT NULL, '
+                               'year INTEGER NOT NULL, month INTEGER NOT NULL, day INTEGER NOT NULL, '
+                               'old_effect REAL, old_total REAL, old_start INTEGER, old_end INTEGER, '
+                               'new_effect REAL, new_total REAL, new_start INTEGER, new_end INTEGER)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS work_hours_history_day '
+                               'ON work_hours_history (year, month, day, changed_at)')
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(work_hours)')}
+            if 'start_time' not in columns: # 旧版本数据库没有上下班时间
+                self._conn.execute('ALTER TABLE work_hours ADD COLUMN start_time INTEGER')
+                self._conn.execute('ALTER TABLE work_hours ADD COLUMN end_time INTEGER')
+            has_summary = self._conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='work_hours_month'").fetchone()
+            self._conn.execute('CREATE TABLE IF NOT EXISTS work_hours_month ('
+                               'year INTEGER NOT NULL, month INTEGER NOT NULL, '
+                               'effect_hours REAL NOT NULL, total_hours REAL NOT NULL, '
+                               'PRIMARY KEY (year, month)) WITHOUT ROWID')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS work_hours_year ('
+                               'year INTEGER PRIMARY KEY, effect_hours REAL NOT NULL, total_hours REAL NOT NULL)')
+            if not has_summary: # 旧版本数据库没有汇总表, 按已有记录生成
+                self._rebuild_summary()
+            self._conn.commit()
+            if self.profile == DEFAULT_PROFILE:
+                migrate_legacy_work_hours(self)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._prefix.clear()
+            self._years.clear()
+
+    def open_profile(self, profile: str):
+        """ 切换到另一个档案的分片, 下次使用时连接 """
+        with self._lock:
+            self.close()
+            self.profile = profile
+            self.db_file = profile_file(profile)
+            self.generation += 1
+
+    # 需在事务内调用
+    def _rebuild_summary(self, years: Iterable[int]=None):
+        """ 由每日记录重新生成汇总, years为None时生成全部年份 """
+        if years is None:
+            self._conn.execute('DELETE FROM work_hours_month')
+            self._conn.execute('DELETE FROM work_hours_year')
+            self._conn.execute('INSERT INTO work_hours_month SELECT year, month, SUM(effect_hours), SUM(total_hours) '
+                               'FROM work_hours GROUP BY year, month')
+        else:
+            years = [(year,) for year in years]
+            self._conn.executemany('DELETE FROM work_hours_month WHERE year=?', years)
+            self._conn.executemany('DELETE FROM work_hours_year WHERE year=?', years)
+            self._conn.executemany('INSERT INTO work_hours_month SELECT year, month, SUM(effect_hours), SUM(total_hours) '
+                                   'FROM work_hours WHERE year=? GROUP BY month', years)
+        self._conn.execute('INSERT OR REPLACE INTO work_hours_year SELECT year, SUM(effect_hours), SUM(total_hours) '
+                           'FROM work_hours_month GROUP BY year')
+
+    # 需在事务内调用, new为None时删除该天的记录, 返回历史记录的序号, 内容未变化时返回None
+    def _write_day(self, year: int, month: int, day: int, new: tuple | None, source: str) -> int | None:
+        key = year, month, day
+        old = self._conn.execute('SELECT effect_hours, total_hours, start_time, end_time FROM work_hours '
+                                 'WHERE year=? AND month=? AND day=?', key).fetchone()
+        if old == new:
+            return None
+        if new is None:
+            self._conn.execute('DELETE FROM work_hours WHERE year=? AND month=? AND day=?', key)
+        else:
+            self._conn.execute(f'INSERT OR REPLACE INTO {WORK_HOURS_COLUMNS} VALUES (?, ?, ?, ?, ?, ?, ?)', key + new)
+        delta = ((new or (0, 0))[0] - (old or (0, 0))[0], (new or (0, 0))[1] - (old or (0, 0))[1])
+        self._conn.execute('INSERT INTO work_hours_month VALUES (?, ?, ?, ?) ON CONFLICT(year, month) DO UPDATE SET '
+                           'effect_hours=effect_hours+excluded.effect_hours, total_hours=total_hours+excluded.total_hours',
+                           (year, month) + delta)
+        self._conn.execute('INSERT INTO work_hours_year VALUES (?, ?, ?) ON CONFLICT(year) DO UPDATE SET '
+                           'effect_hours=effect_hours+excluded.effect_hours, total_hours=total_hours+excluded.total_hours',
+                           (year,) + delta)
+        seq = self._conn.execute(f'INSERT INTO {HISTORY_COLUMNS} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 (time.time(), source) + key + (old or (None,) * 4) + (new or (None,) * 4)).lastrowid
+        self._prefix.pop(year, None)
+        self._years.pop(year, None)
+        self.generation += 1
+        return seq
+
+    def set_day(self, year: int, month: int, day: int, effect_hours: float, total_hours: float,
+                start_time: int=None, end_time: int=None, source='manual') -> int | None:
+        """ 保存单日工时, 同时追加一条修改历史
+
+        Returns
+        -------
+        int | None
+            修改历史的序号, 内容与原有记录相同时为None
+        """
+        self.connect()
+        with self._lock, self._conn:
+            return self._write_day(year, month, day, (effect_hours, total_hours, start_time, end_time), source)
+
+    def delete_day(self, year: int, month: int, day: int, source='manual') -> int | None:
+        self.connect()
+        with self._lock, self._conn:
+            return self._write_day(year, month, day, None, source)
+
+    def set_days(self, records: Iterable[tuple[int, int, int, float, float, int, int]], overwrite=True, source='import'):
+        """ 批量写入, 所有记录在同一个事务中提交, 涉及年份的汇总整体重新生成
+
+        Parameters
+        ----------
+        records: Iterable[tuple]
+            (年, 月, 日, 有效工时, 总工时, 上班时间, 下班时间), 时间为当天0点起的分钟数, 未知时为None
+
+        overwrite: bool
+            是否覆盖已存在的记录
+
+        source: str
+            修改来源, 记录在修改历史中
+        """
+        # 同一天出现多次时以最后一条为准, 否则修改历史会为同一天记录多条且都以批次前的记录为原值
+        records = list({tuple(record[:3]): record for record in records}.values())
+        years = {record[0] for record in records}
+        # 先按原有记录追加修改历史, 只记录内容有变化的日期
+        history = (f'INSERT INTO {HISTORY_COLUMNS} SELECT ?, ?, r.year, r.month, r.day, '
+                   'w.effect_hours, w.total_hours, w.start_time, w.end_time, r.effect_hours, r.total_hours, r.start_time, r.end_time '
+                   'FROM (SELECT ? AS year, ? AS month, ? AS day, ? AS effect_hours, ? AS total_hours, ? AS start_time, ? AS end_time) r '
+                   'LEFT JOIN work_hours w ON w.year=r.year AND w.month=r.month AND w.day=r.day ')
+        if overwrite:
+            history += ('WHERE NOT (w.effect_hours IS r.effect_hours AND w.total_hours IS r.total_hours '
+                        'AND w.start_time IS r.start_time AND w.end_time IS r.end_time)')
+        else:
+            history += 'WHERE w.effect_hours IS NULL'
+        sql = f'INSERT OR {"REPLACE" if overwrite else "IGNORE"} INTO {WORK_HOURS_COLUMNS} VALUES (?, ?, ?, ?, ?, ?, ?)'
+        changed_at = time.time()
+
+        self.connect()
+        with self._lock, self._conn:
+            self._conn.executemany(history, ((changed_at, source) + tuple(record) for record in records))
+            self._conn.executemany(sql, records)
+            self._rebuild_summary(years)
+            for year in years:
+                self._prefix.pop(year, None)
+                self._years.pop(year, None)
+            self.generation += 1
+
+    def history_entry(self, seq: int) -> tuple | None:
+        """ 单条修改历史: (修改时间, 来源, 年, 月, 日, 原有效工时, 原总工时, 原上班时间, 原下班时间,
+        新有效工时, 新总工时, 新上班时间, 新下班时间), 不存在的记录对应的4个值为None """
+        self.connect()
+        with self._lock:
+            return self._conn.execute(f'SELECT {HISTORY_FIELDS} FROM work_hours_history WHERE seq=?', (seq,)).fetchone()
+
+    def day_history(self, year: int, month: int, day: int) -> list[tuple]:
+        """ 单日的全部修改历史, 按时间先后排列, 格式同history_entry """
+        self.connect()
+        with self._lock:
+            return self._conn.execute(f'SELECT {HISTORY_FIELDS} FROM work_hours_history WHERE year=? AND month=? AND day=? '
+                                      'ORDER BY changed_at, seq', (year, month, day)).fetchall()
+
+    def get_day_as_of(self, year: int, month: int, day: int, timestamp: float) -> tuple | None:
+        """ 查询某一时刻单日的记录, 通过(年, 月, 日, 修改时间)索引定位, 不回放历史
+
+        Returns
+        -------
+        tuple | None
+            (有效工时, 总工时, 上班时间, 下班时间), 当时没有记录时为None
+        """
+        key = year, month, day
+        self.connect()
+        with self._lock:
+            # 该时刻之前的最后一次修改后的值
+            row = self._conn.execute('SELECT new_effect, new_total, new_start, new_end FROM work_hours_history '
+                                     'WHERE year=? AND month=? AND day=? AND changed_at<=? ORDER BY changed_at DESC, seq DESC LIMIT 1',
+                                     key + (timestamp,)).fetchone()
+            if row is None: # 该时刻之后的第一次修改前的值, 早于历史记录的数据也由此得到
+                row = self._conn.execute('SELECT old_effect, old_total, old_start, old_end FROM work_hours_history '
+                                         'WHERE year=? AND month=? AND day=? AND changed_at>? ORDER BY changed_at, seq LIMIT 1',
+                                         key + (timestamp,)).fetchone()
+            if row is None: # 从未修改过
+                row = self._conn.execute('SELECT effect_hours, total_hours, start_time, end_time FROM work_hours '
+                                         'WHERE year=? AND month=? AND day=?', key).fetchone()
+        return None if row is None or row[0] is None else row
+
+    def get_day(self, year: int, month: int, day: int) -> tuple[float, float] | None:
+        self.connect()
+        with self._lock:
+            return self._conn.execute('SELECT effect_hours, total_hours FROM work_hours WHERE year=? AND month=? AND day=?',
+                                      (year, month, day)).fetchone()
+
+    def iter_days(self, start: datetime.date, end: datetime.date, batch_size=1000) -> Iterator[tuple[int, int, int, float, float]]:
+        """ 按日期顺序逐条返回[start, end]内的记录, 每批查询后即释放锁, 不阻塞其他线程写入
+
+        Returns
+        -------
+        Iterator[tuple]
+            (年, 月, 日, 有效工时, 总工时, 上班时间, 下班时间)
+        """
+        self.connect()
+        last = (start.year, start.month, start.day)
+        op = '>='
+        while True:
+            with self._lock:
+                rows = self._conn.execute(f'SELECT year, month, day, effect_hours, total_hours, start_time, end_time FROM work_hours WHERE (year, month, day) {op} (?, ?, ?) '
+                                          'AND (year, month, day) <= (?, ?, ?) ORDER BY year, month, day LIMIT ?',
+                                          last + (end.year, end.month, end.day, batch_size)).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last = rows[-1][:3]
+            op = '>'
+
+    def year_records(self, year: int) -> YearRecords:
+        """ 全年每天的工时, 整年一次查询, 结果按LRU缓存; 返回的是缓存本身, 不可修改 """
+        with self._lock:
+            records = self._years.get(year)
+            if records is not None:
+                self._years.move_to_end(year)
+                return records
+            self.connect()
+            records = YearRecords(year)
+            first_day = datetime.date(year, 1, 1).toordinal()
+            for month, day, effect_hours, total_hours in self._conn.execute(
+                    'SELECT month, day, effect_hours, total_hours FROM work_hours WHERE year=?', (year,)):
+                records.set(datetime.date(year, month, day).toordinal() - first_day, effect_hours, total_hours)
+            self._years[year] = records
+            if len(self._years) > YEAR_CACHE_SIZE:
+                self._years.popitem(last=False)
+            return records
+
+    def month_days(self, year: int, month: int) -> tuple[memoryview, memoryview]:
+        """ 整月每天的工时, 下标为日期-1, 没有记录的为0; 与年缓存共享内存, 不可修改
+
+        Returns
+        -------
+        tuple[memoryview, memoryview]
+            (每日有效工时, 每日总工时)
+        """
+        return self.year_records(year).month_view(month)
+
+    def month_summaries(self) -> dict[tuple[int, int], tuple[float, float]]:
+        """ 全部月汇总, (年, 月) -> (有效工时, 总工时) """
+        self.connect()
+        with self._lock:
+            return {(year, month): (effect_hours, total_hours) for year, month, effect_hours, total_hours
+                    in self._conn.execute('SELECT year, month, effect_hours, total_hours FROM work_hours_month')}
+
+    def sum_month(self, year: int, month: int) -> tuple[float, float]:
+        self.connect()
+        with self._lock:
+            return self._conn.execute('SELECT effect_hours, total_hours FROM work_hours_month WHERE year=? AND month=?',
+                                      (year, month)).fetchone() or (0, 0)
+
+    def sum_year(self, year: int) -> tuple[float, float]:
+        self.connect()
+        with self._lock:
+            return self._conn.execute('SELECT effect_hours, total_hours FROM work_hours_year WHERE year=?',
+                                      (year,)).fetchone() or (0, 0)
+
+    def _year_prefix(self, year: int) -> tuple[list[float], list[float]]:
+        """ 当年按天累加的前缀和, 下标i为当年前i天的合计 """
+        prefix = self._prefix.get(year)
+        if prefix is not None:
+            return prefix
+        self.connect()
+        with self._lock:
+            first_day = datetime.date(year, 1, 1).toordinal()
+            effect = [0.0] * 366
+            total = [0.0] * 366
+            for month, day, effect_hours, total_hours in self._conn.execute(
+                    'SELECT month, day, effect_hours, total_hours FROM work_hours WHERE year=?', (year,)):
+                i = datetime.date(year, month, day).toordinal() - first_day
+                effect[i] = effect_hours
+                total[i] = total_hours
+            prefix = list(itertools.accumulate(effect, initial=0.0)), list(itertools.accumulate(total, initial=0.0))
+            self._prefix[year] = prefix
+            return prefix
+
+    def sum_range(self, start: datetime.date, end: datetime.date) -> tuple[float, float]:
+        """ 统计[start, end]闭区间内的工时, 跨年时中间的整年直接取年汇总 """
+        if start > end:
+            return 0, 0
+        if start.year == end.year:
+            effect, total = self._year_prefix(start.year)
+            i = start.timetuple().tm_yday - 1
+            j = end.timetuple().tm_yday
+            return effect[j] - effect[i], total[j] - total[i]
+        head = self.sum_range(start, datetime.date(start.year, 12, 31))
+        tail = self.sum_range(datetime.date(end.year, 1, 1), end)
+        self.connect()
+        with self._lock:
+            middle = self._conn.execute('SELECT COALESCE(SUM(effect_hours), 0), COALESCE(SUM(total_hours), 0) '
+                                        'FROM work_hours_year WHERE year>? AND year<?', (start.year, end.year)).fetchone()
+        return head[0] + middle[0] + tail[0], head[1] + middle[1] + tail[1]
+
+    def sum_quarter(self, year: int, quarter: int) -> tuple[float, float]:
+        start = datetime.date(year, quarter * 3 - 2, 1)
+        end = datetime.date(year + 1, 1, 1) if quarter == 4 else datetime.date(year, quarter * 3 + 1, 1)
+        return self.sum_range(start, end - datetime.timedelta(days=1))
+
+work_hours_db = WorkHoursDB(WORK_HOURS_FILE) # 当前档案的工时数据库
+_profile_dbs: dict[str, WorkHoursDB] = {} # 其他档案的工时数据库
+_profile_lock = threading.Lock()
+
+def profile_file(profile: str) -> str:
+    if profile == DEFAULT_PROFILE:
+        return WORK_HOURS_FILE
+    return os.path.join(PROFILE_DIR, f'{profile}.db')
+
+def profile_names() -> list[str]:
+    """ 全部档案, 默认档案在前 """
+    names = []
+    if os.path.isdir(PROFILE_DIR):
+        names = sorted(name[:-3] for name in os.listdir(PROFILE_DIR) if name.endswith('.db'))
+    return [DEFAULT_PROFILE] + [name for name in names if name != DEFAULT_PROFILE]
+
+def create_profile(profile: str):
+    """ 新建档案, 档案名用作文件名 """
+    profile = profile.strip()
+    if not profile or profile in ('.', '..') or any(c in profile for c in '\\/:*?"<>|'):
+        raise ValueError(f'无效的档案名: {profile}')
+    if profile in profile_names():
+        raise ValueError(f'档案已存在: {profile}')
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    get_profile_db(profile).connect()
+
+def get_profile_db(profile: str) -> WorkHoursDB:
+    """ 档案的工时数据库, 当前档案即work_hours_db, 其他档案各自一个连接, 可在不同线程中并行查询 """
+    with _profile_lock:
+        if profile == work_hours_db.profile:
+            return work_hours_db
+        db = _profile_dbs.get(profile)
+        if db is None:
+            db = _profile_dbs[profile] = WorkHoursDB(profile_file(profile), profile)
+        return db
+
+def switch_profile(profile: str):
+    """ 切换当前档案, 之后work_hours_db读写该档案的分片 """
+    with _profile_lock:
+        if profile == work_hours_db.profile:
+            return
+        if profile not in profile_names():
+            raise ValueError(f'不存在的档案: {profile}')
+        db = _profile_dbs.pop(profile, None)
+        if db is not None: # 同一分片只保留一个连接
+            db.close()
+        work_hours_db.open_profile(profile)
+
+# 旧版本工时以嵌套dict整体存放在配置DB的WorkHours中, 首次连接默认档案的工时数据库时迁移到该数据库;
+# 连接时当前档案可能已切换到其他档案, 必须写入正在连接的db而不是work_hours_db
+def migrate_legacy_work_hours(db: WorkHoursDB):
+    if not _load_config('WorkHours'):
+        return
+    legacy = _thaw(_snapshot.data['WorkHours'])
+    records = []
+    for year, year_config in legacy.items():
+        for month, month_config in year_config.items():
+            for day, day_config in month_config.items():
+                records.append((year, month, day, day_config['effect_hours'], day_config['total_hours'], None, None))
+    # 迁移中途异常时旧数据仍在, 下次启动重新迁移, 不覆盖已写入的新数据
+    db.set_days(records, overwrite=False, source='migrate')
+    with _write_lock:
+        config_journal.append({}, removed=['WorkHours'])
+    with _publish_lock:
+        _publish({}, removed=['WorkHours'], bump=False)
+
+# 旧版本配置存放在shelve中, 将原始的pickle数据直接复制到日志, 无需反序列化;
+# 日志连同迁移的数据一次性创建, 读取shelve失败或中途崩溃时不会留下日志, 下次启动重新迁移
+def migrate_shelve_config():
+    with shelve.open(CONFIG_FILE, flag='r') as data:
+        raw_items = {key.decode('utf-8'): data.dict[key] for key in data.dict.keys()}
+    config_journal.create(raw_items)
 
 def config_init():
-    global config_data
-    config_not_exists = False
-    if not os.path.exists(f'{CONFIG_FILE}.dat'):
-        config_not_exists = True
-    with shelve.open(CONFIG_FILE) as data:
-        if config_not_exists: # 首次启动或配置DB不存在, 则加载系统默认配置
-            for k, v in conf.items():
-                data[k] = v
-            config_data = conf
+    from source.util.default_config import conf # 默认配置引用了界面库的主题, 只在初始化时导入
+
+    if not config_journal.exists() and os.path.exists(f'{CONFIG_FILE}.dat'):
+        migrate_shelve_config()
+    config_journal.open()
+    missing = {key: value for key, value in conf.items() if key not in config_journal}
+    if missing: # 首次启动时为全部默认配置, 之后为新版本增加的配置集
+        config_journal.append(missing)
+
+    configs = {}
+    for key in config_journal.keys(): # 回放日志只建立索引, 不会反序列化数据
+        if key in EAGER_KEYS:
+            configs[key] = config_journal.read(key)
         else:
-            for key in data: # 若已存在, 则从数据库中读取数据
-                config_data[key] = data[key]
+            _lazy_keys.add(key)
+    with _publish_lock:
+        _publish(configs, bump=False)
+    profile = get_config('Profiles', 'Current')
+    if profile in profile_names(): # 恢复上次使用的档案, 分片已被删除时使用默认档案
+        switch_profile(profile)
 
-def set_config(key1: str, value, key2=''):
+# 按需加载配置集, 返回配置集是否存在
+def _load_config(key1: str) -> bool:
+    if key1 in _snapshot.data:
+        return True
+    if key1 not in _lazy_keys:
+        return False
     try:
-        configs = config_data.get(key1)
-        if configs is None:
-            print(f'不存在的配置集: {key1}')
-            return
+        value = config_journal.read(key1)
+    except KeyError: # 其他进程已删除该配置集
+        _lazy_keys.discard(key1)
+        return False
+    with _publish_lock: # 加载不改变配置内容, 不增加版本号
+        if key1 in _lazy_keys:
+            _publish({key1: value}, bump=False)
+            _lazy_keys.discard(key1)
+    return True
 
-        if key2: # 配置为dict类型
-            if configs.get(key2) is None:
-                print(f'不存在的配置: {key2}')
+def set_config(key1: str, value, key2=''):
+    try:
+        _load_config(key1)
+        with _publish_lock:
+            configs = _snapshot.data.get(key1)
+            if configs is None:
+                print(f'不存在的配置集: {key1}')
                 return
 
-            configs[key2] = value
-            with shelve.open(CONFIG_FILE) as data:
-                data[key1] = configs
-        else: # 配置为str类型
-            config_data[key1] = value
-            with shelve.open(CONFIG_FILE) as data:
-                data[key1] = value
+            if key2: # 配置为dict类型
+                if configs.get(key2) is None:
+                    print(f'不存在的配置: {key2}')
+                    return
+                if configs[key2] == value:
+                    return
+                new_configs = dict(configs)
+                new_configs[key2] = value
+                _publish({key1: new_configs})
+            else: # 配置为str类型
+                _publish({key1: value})
+            _schedule_flush(key1, key2)
+        _notify_config_changed([key1])
+    except Exception:
+        traceback.print_exc()
+
+def add_config_listener(callback: Callable[[list[str]], Any]):
+    """ 注册配置变化的回调, 参数为发生变化的配置集; 回调可能在落盘线程中调用, GUI通过信号转回主线程 """
+    _config_listeners.append(callback)
+
+def _notify_config_changed(keys: list[str]):
+    for callback in _config_listeners:
+        try:
+            callback(keys)
+        except Exception:
+            traceback.print_exc()
+
+# 需持有_publish_lock调用, 每次修改都重新计时, 连续修改合并为一次写入
+def _schedule_flush(key1: str, key2: str):
+    global _flush_timer
+    _dirty_keys.setdefault(key1, set()).add(key2)
+    if _flush_timer is not None:
+        _flush_timer.cancel()
+    _flush_timer = threading.Timer(FLUSH_DELAY, flush)
+    _flush_timer.daemon = True
+    _flush_timer.start()
+
+# 需持有日志锁与_publish_lock调用, 合并其他进程写入的配置, 本进程未落盘的修改优先
+def _merge_external(changed: set[str]) -> list[str]:
+    changes = {}
+    removed = []
+    for key1 in changed:
+        fields = _dirty_keys.get(key1)
+        if fields is not None and '' in fields: # 本进程替换了整个配置集, 以本进程为准
+            continue
+        if key1 not in config_journal:
+            _lazy_keys.discard(key1)
+            if key1 in _snapshot.data and fields is None:
+                removed.append(key1)
+            continue
+        if key1 not in _snapshot.data: # 未加载的配置集在首次使用时再读取最新值
+            _lazy_keys.add(key1)
+            continue
+        value = config_journal.read(key1)
+        if fields:
+            value = dict(value)
+            for key2 in fields:
+                value[key2] = _snapshot.data[key1][key2]
+        changes[key1] = value
+    if changes or removed:
+        _publish(changes, removed)
+    return list(changes) + removed
+
+def check_config_changes():
+    """ 同步其他进程对配置的修改, 只重新加载发生变化且已加载的配置集 """
+    try:
+        if not config_journal.changed_on_disk():
+            return
+        with config_journal.locked() as changed, _publish_lock:
+            changed_keys = _merge_external(changed)
+        if changed_keys:
+            _notify_config_changed(changed_keys)
     except Exception:
         traceback.print_exc()
 
+def flush():
+    """ 将缓存的配置修改批量写入配置DB, 程序退出前需主动调用 """
+    global _flush_timer
+    with _write_lock:
+        with _publish_lock:
+            if _flush_timer is not None:
+                _flush_timer.cancel()
+                _flush_timer = None
+            if not _dirty_keys:
+                return
+
+        changed_keys = []
+        dirty = {}
+        try:
+            # 持有跨进程锁完成先合并后写入, 避免覆盖其他进程的修改
+            with config_journal.locked() as changed:
+                with _publish_lock:
+                    changed_keys = _merge_external(changed)
+                    # 快照不可变, 直接引用即可, 落盘期间GUI线程的修改会发布为新快照
+                    snapshot = _snapshot
+                    dirty = dict(_dirty_keys)
+                    _dirty_keys.clear()
+                config_journal.append({key: _thaw(snapshot.data[key]) for key in dirty})
+        except Exception:
+            traceback.print_exc()
+            with _publish_lock: # 写入失败, 留待下次重试
+                for key1, fields in dirty.items():
+                    _dirty_keys.setdefault(key1, set()).update(fields)
+        if changed_keys:
+            _notify_config_changed(changed_keys)
+
+def config_close():
+    flush()
+    config_journal.close()
+    work_hours_db.close()
+    for db in _profile_dbs.values():
+        db.close()
+
 def get_config(key1: str, key2=''):
-    configs = config_data.get(key1)
+    _load_config(key1)
+    configs = _snapshot.data.get(key1)
     if configs is None:
         print(f'不存在的配置集: {key1}')
         raise Exception(f'不存在的配置集: {key1}')
@@ -61,4 +657,31 @@ def get_config(key1: str, key2=''):
             raise Exception(f'不存在的配置: {key2}')
         return config
     else: # 配置为str类型
-        return configs
\ No newline at end of file
+        return configs
+
+if __name__ == '__main__':
+    # 启动耗时测试: 构造包含大量历史工时的配置DB, 对比全量加载与按需加载
+    import shutil
+    import tempfile
+
+    from source.util.default_config import conf
+
+    tmp_dir = tempfile.mkdtemp()
+    config_journal = Journal(os.path.join(tmp_dir, 'config.journal'))
+    history = {year: {month: {day: {'effect_hours': 8.0, 'total_hours': 9.5} for day in range(1, 29)}
+                      for month in range(1, 13)} for year in range(1925, 2025)}
+    config_journal.open()
+    config_journal.append({'System': conf['System'], 'WorkHours': history})
+
+    start = time.perf_counter()
+    eager_journal = Journal(config_journal.path)
+    eager_journal.open()
+    eager_data = {key: eager_journal.read(key) for key in eager_journal.keys()}
+    eager_cost = time.perf_counter() - start
+
+    start = time.perf_counter()
+    config_init()
+    lazy_cost = time.perf_counter() - start
+
+    print(f'历史工时: {len(history)}年, 全量加载: {eager_cost * 1000:.2f}ms, 按需加载: {lazy_cost * 1000:.2f}ms')
+    shutil.rmtree(tmp_dir)
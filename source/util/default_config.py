@@ -5,7 +5,11 @@
 from qfluentwidgets import Theme
 import logging
 
-# 需保证配置配置最多只有两层结构
+from source.util.db import DEFAULT_PROFILE
+from source.util.default_shifts import DEFAULT_SHIFTS
+
+# 需保证配置最多只有两层结构: 配置集 -> 配置项, 通过set_config(配置集, 值, 配置项)修改
+# 例外: 'Shifts'的配置项为一个班次的全部规则(dict), 只能整体替换, 修改单个字段使用work_hours.set_shift_field
 conf = {
     'System': {
         'Theme': Theme.AUTO,
@@ -14,7 +18,11 @@ conf = {
         'LogLevel': logging.ERROR,
         'PowerOnStartUp': False,
     },
-    'WorkHours': {}
+    'Shifts': DEFAULT_SHIFTS, # 班次名称 -> 班次规则, 格式见work_hours_core
+    'Profiles': {
+        'Current': DEFAULT_PROFILE, # 当前档案
+        'DailyTarget': 8, # 每个工作日的目标有效工时, 用于统计低于目标的档案
+    },
 }
 
 README_URL = 'https://github.com/YZDYSJYC/MindLeader/blob/main/README.md'
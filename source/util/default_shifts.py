@@ -0,0 +1,27 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 默认班次
+
+# 只包含纯数据, 供默认配置与工时计算核心共用, 不依赖界面与工时计算模块
+
+# 时间格式为'时:分', 跨天班次次日的时间写作24点以后, 如次日6点为'30:00'
+DEFAULT_SHIFTS = {
+    '8点班次': {
+        'business': '08:00', # 上班时间
+        'flexible_business': '09:05', # 弹性上班截止时间
+        'closing': '17:30', # 下班时间
+        'flexible_closing': '19:05', # 弹性下班时间
+        'flexible_hours': 10, # 弹性上班需在岗的时长(含休息)
+        'breaks': [['12:00', '13:30'], ['17:30', '18:00']], # 休息时段, 不计工时
+        'overtime_unit': 0, # 加班计算单位(分钟), 不足一个单位的部分不计, 0为按实际时长
+    },
+    '8点半班次': {
+        'business': '08:30',
+        'flexible_business': '09:35',
+        'closing': '18:00',
+        'flexible_closing': '19:35',
+        'flexible_hours': 10,
+        'breaks': [['12:30', '14:00'], ['18:00', '18:30']],
+        'overtime_unit': 0,
+    },
+}
@@ -0,0 +1,344 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 追加写日志存储
+
+'''
+键值对的追加写日志存储, 用于替代原地改写的shelve/dbm.dumb。
+
+文件格式:
+    文件头: 魔数(4字节) + 代数(8字节), 每次压缩后代数加1
+    记录: 数据长度(4字节) + crc32(4字节) + 数据
+    数据: 操作类型(1字节) + key长度(2字节) + key(utf-8) + value(pickle)
+
+每次修改只在文件尾部追加记录, 断电或崩溃造成的半条记录在下次回放时校验失败并被截断,
+最多丢失最后一次写入。启动时流式回放只建立key到value位置的索引, value在首次读取时才反序列化。
+
+多个进程可同时使用同一个日志: 文件访问都在跨进程文件锁内进行, 通过文件大小/修改时间判断是否有
+其他进程写入, 代数未变时只回放新追加的尾部, 代数变化(其他进程完成压缩)时才重建索引。
+'''
+
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Iterable, Iterator
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+from source.util.log import log_error, log_info
+
+MAGIC = b'MLJ1'
+FILE_HEADER = struct.Struct('<4sQ') # 魔数, 代数
+RECORD_HEADER = struct.Struct('<II') # 数据长度, crc32
+BODY_HEADER = struct.Struct('<BH') # 操作类型, key长度
+OP_SET = 0
+OP_DEL = 1
+COMPACT_THRESHOLD = 1024 * 1024 # 日志超过1M且过期记录过半时后台压缩
+
+def _pack_record(op: int, key: str, value: bytes=b'') -> bytes:
+    key_bytes = key.encode('utf-8')
+    body = BODY_HEADER.pack(op, len(key_bytes)) + key_bytes + value
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+def _iter_records(f: BinaryIO, offset: int) -> Iterator[tuple[int, str, int, int, int, int]]:
+    """ 从offset开始流式读取记录, 遇到不完整或校验失败的记录即停止
+
+    Returns
+    -------
+    Iterator[tuple]
+        (操作类型, key, value偏移, value长度, 记录crc, 记录结束位置)
+    """
+    f.seek(offset)
+    while True:
+        head = f.read(RECORD_HEADER.size)
+        if len(head) < RECORD_HEADER.size:
+            return
+        body_len, crc = RECORD_HEADER.unpack(head)
+        body = f.read(body_len)
+        if len(body) < body_len or zlib.crc32(body) != crc or body_len < BODY_HEADER.size:
+            return
+        op, key_len = BODY_HEADER.unpack_from(body)
+        key = body[BODY_HEADER.size:BODY_HEADER.size + key_len].decode('utf-8')
+        value_offset = offset + RECORD_HEADER.size + BODY_HEADER.size + key_len
+        offset += RECORD_HEADER.size + body_len
+        yield op, key, value_offset, offset - value_offset, crc, offset
+
+class FileLock:
+    """ 跨进程文件锁, 同一进程内可重入, 需在线程锁内使用 """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+        self._count = 0
+
+    def acquire(self):
+        if self._count == 0:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+            try:
+                if sys.platform == 'win32':
+                    while True: # LK_LOCK重试10次后仍失败会抛出异常, 继续等待
+                        try:
+                            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            continue
+                else:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+            except Exception:
+                os.close(fd)
+                raise
+            self._fd = fd
+        self._count += 1
+
+    def release(self):
+        self._count -= 1
+        if self._count == 0:
+            if sys.platform == 'win32':
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+class Journal:
+    """ 追加写日志, 写入为顺序追加, 读取按索引定位 """
+
+    def __init__(self, path: str, compact_threshold=COMPACT_THRESHOLD):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self.generation = 0
+        self._index = {} # key -> (value偏移, value长度, 记录crc)
+        self._size = 0 # 有效数据的结束位置
+        self._live_size = 0 # 最新记录占用的大小, 用于判断是否需要压缩
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(f'{path}.lock')
+        self._stat = None # 最近一次读写后的(文件大小, 修改时间), 用于判断其他进程是否写入
+        self._compact_thread: threading.Thread = None
+        self._unreported: set[str] = set() # 读写时顺带同步到的其他进程的修改, 留给下一次locked返回
+
+    def exists(self) -> bool:
+        """ 日志存在且文件头完整, 旧版本创建时崩溃留下的空文件视为不存在 """
+        try:
+            return os.path.getsize(self.path) >= FILE_HEADER.size
+        except OSError:
+            return False
+
+    def _temp_file(self) -> str:
+        """ 与日志在同一目录下(os.replace要求同一文件系统)创建临时文件, 每次使用不同的文件名 """
+        fd, tmp_path = tempfile.mkstemp(prefix=f'{os.path.basename(self.path)}.', suffix='.tmp',
+                                        dir=os.path.dirname(os.path.abspath(self.path)))
+        os.close(fd)
+        return tmp_path
+
+    def create(self, raw_items: dict[str, bytes]=None) -> bool:
+        """ 创建日志, 可带初始记录; 在临时文件中写完并fsync后再替换, 崩溃时要么没有日志, 要么是完整的日志
+
+        Returns
+        -------
+        bool
+            是否由本次调用创建, 日志已存在(如其他进程已创建)时不做修改
+        """
+        records = b''.join(_pack_record(OP_SET, key, value) for key, value in (raw_items or {}).items())
+        with self._lock, self._file_lock:
+            if self.exists():
+                return False
+            tmp_path = self._temp_file()
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(FILE_HEADER.pack(MAGIC, 0) + records)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return True
+
+    def open(self):
+        with self._lock, self._file_lock:
+            if not self.exists():
+                self.create()
+            try:
+                self._replay()
+            except ValueError as e: # 不是日志文件, 改名保留后使用新的日志, 不影响启动
+                aside = f'{self.path}.corrupt.{int(time.time())}'
+                os.replace(self.path, aside)
+                log_error(f'{e}, 已另存为 {aside}')
+                self.create()
+                self._replay()
+
+    # 需持有文件锁调用, 返回内容发生变化的key
+    def _replay(self) -> set[str]:
+        old_index = self._index
+        self._index = {}
+        self._live_size = 0
+        with open(self.path, 'rb') as f:
+            magic, self.generation = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f'无效的日志文件: {self.path}')
+            self._size = FILE_HEADER.size
+            self._replay_tail(f)
+            file_size = f.seek(0, os.SEEK_END)
+        if file_size > self._size: # 截断崩溃时写了一半的记录
+            log_error(f'日志 {self.path} 尾部 {file_size - self._size} 字节损坏, 已丢弃')
+            with open(self.path, 'r+b') as f:
+                f.truncate(self._size)
+        self._stat = self._file_stat()
+        return {key for key in old_index.keys() | self._index.keys()
+                if old_index.get(key, (0, 0, None))[2] != self._index.get(key, (0, 0, None))[2]}
+
+    def _replay_tail(self, f: BinaryIO) -> set[str]:
+        changed = set()
+        for op, key, value_offset, value_len, crc, end in _iter_records(f, self._size):
+            self._apply(op, key, value_offset, value_len, crc)
+            self._size = end
+            changed.add(key)
+        return changed
+
+    def _apply(self, op: int, key: str, value_offset: int, value_len: int, crc: int):
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._live_size -= self._record_size(key, old[1])
+        if op == OP_SET:
+            self._index[key] = (value_offset, value_len, crc)
+            self._live_size += self._record_size(key, value_len)
+
+    def _file_stat(self) -> tuple[int, int]:
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime_ns
+
+    def changed_on_disk(self) -> bool:
+        """ 通过文件大小和修改时间判断其他进程是否写入, 只有一次stat的开销 """
+        return bool(self._unreported) or self._file_stat() != self._stat
+
+    # 需持有文件锁调用
+    def _refresh(self) -> set[str]:
+        with open(self.path, 'rb') as f:
+            _, generation = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if generation == self.generation: # 只回放其他进程追加的记录
+                changed = self._replay_tail(f)
+                self._stat = self._file_stat()
+                return changed
+        return self._replay()
+
+    @contextmanager
+    def locked(self):
+        """ 持有跨进程锁并同步其他进程的写入, 用于先读后写的场景
+
+        Returns
+        -------
+        set[str]
+            其他进程修改过的key
+        """
+        with self._lock, self._file_lock:
+            changed = self._refresh() | self._unreported
+            self._unreported = set()
+            yield changed
+
+    @staticmethod
+    def _record_size(key: str, value_len: int) -> int:
+        return RECORD_HEADER.size + BODY_HEADER.size + len(key.encode('utf-8')) + value_len
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def read_raw(self, key: str) -> bytes:
+        """ 读取key的原始数据, 其他进程已压缩过文件时先重建索引, key已被删除时抛出KeyError """
+        with self._lock, self._file_lock: # 持锁读取, 避免压缩替换文件
+            with open(self.path, 'rb') as f:
+                _, generation = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+                if generation != self.generation: # 缓存的偏移属于压缩前的文件, 已失效
+                    self._unreported |= self._refresh()
+                value_offset, value_len, _ = self._index[key]
+                f.seek(value_offset)
+                return f.read(value_len)
+
+    def read(self, key: str) -> Any:
+        return pickle.loads(self.read_raw(key))
+
+    def append(self, items: dict[str, Any], removed: Iterable[str]=()):
+        """ 追加一批修改, 整批只写入一次并fsync一次 """
+        self.append_raw({key: pickle.dumps(value, pickle.HIGHEST_PROTOCOL) for key, value in items.items()}, removed)
+
+    def append_raw(self, items: dict[str, bytes], removed: Iterable[str]=()):
+        records = [_pack_record(OP_SET, key, value) for key, value in items.items()]
+        records.extend(_pack_record(OP_DEL, key) for key in removed)
+        if not records:
+            return
+        with self._lock, self._file_lock:
+            self._unreported |= self._refresh() # 先追上其他进程的写入, 保证追加在文件末尾
+            with open(self.path, 'r+b') as f:
+                f.seek(self._size)
+                f.write(b''.join(records))
+                f.flush()
+                os.fsync(f.fileno())
+                self._replay_tail(f)
+            self._stat = self._file_stat()
+            if self._need_compact():
+                self._compact_thread = threading.Thread(target=self._compact, daemon=True)
+                self._compact_thread.start()
+
+    def _need_compact(self) -> bool:
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return False
+        return self._size > self.compact_threshold and self._size > 2 * self._live_size
+
+    def _compact(self):
+        """ 将每个key的最新记录复制到新文件后替换旧文件, 复制期间不阻塞读写 """
+        # 多个进程同时压缩时各自使用不同的临时文件, 互不覆盖, 最终只有一个进程的替换生效
+        tmp_path = self._temp_file()
+        try:
+            with self._lock, self._file_lock:
+                self._unreported |= self._refresh()
+                index = dict(self._index)
+                end = self._size
+                generation = self.generation + 1
+            with open(self.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                dst.write(FILE_HEADER.pack(MAGIC, generation))
+                for key, (value_offset, value_len, _) in index.items():
+                    src.seek(value_offset)
+                    dst.write(_pack_record(OP_SET, key, src.read(value_len)))
+
+            with self._lock, self._file_lock:
+                self._unreported |= self._refresh()
+                if self.generation != generation - 1: # 复制期间其他进程已完成压缩
+                    os.remove(tmp_path)
+                    return
+                # 复制期间追加的记录原样接到新文件尾部
+                with open(self.path, 'rb') as src, open(tmp_path, 'ab') as dst:
+                    src.seek(end)
+                    dst.write(src.read(self._size - end))
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.replace(tmp_path, self.path)
+                self._replay()
+            log_info(f'日志 {self.path} 压缩完成, 当前大小: {self._size}')
+        except Exception as e:
+            log_error(f'日志 {self.path} 压缩失败: {e}')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def close(self):
+        if self._compact_thread is not None:
+            self._compact_thread.join()
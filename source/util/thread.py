@@ -9,13 +9,16 @@ from PySide6.QtCore import Signal, QThread
 class Asynchronous(QThread):
 
     finish_signal = Signal()
+    progress_signal = Signal(int) # 进度百分比, 由callback在工作线程中发出
 
-    def __init__(self, callback, stop_func, args: list=None) -> None:
+    def __init__(self, callback, stop_func, args: list=None, progress_func=None) -> None:
         super(Asynchronous, self).__init__()
         self.callback = callback
         self.args = args
         self.ret = None
         self.finish_signal.connect(lambda: stop_func(self, self.ret)) # 线程销毁信号
+        if progress_func is not None:
+            self.progress_signal.connect(progress_func)
 
     def run(self):
         if self.args:
@@ -0,0 +1,166 @@
+# coding=utf-8
+# 作者: 拓跋龙
+# 功能: 按年存储的紧凑工时记录
+
+'''
+一年的工时记录放在一块连续内存中, 约3K字节:
+    文件头: 魔数(4字节) + 年份(2字节)
+    有效工时: 366个float32, 下标为当年第几天(从0开始)
+    总工时: 366个float32
+    存在位图: 46字节, 第i位表示第i天是否有记录
+两列通过memoryview.cast按array('f')的方式访问, 序列化即为这块内存本身;
+从bytes/bytearray加载时不复制数据, 也可通过numpy.frombuffer直接得到数组, 便于缓存与进程间传递。
+float32约7位有效数字, 对以小时为单位、保留两位小数展示的工时足够。
+'''
+
+import datetime
+import struct
+from typing import Iterator
+
+import numpy as np
+
+MAGIC = b'MLY1'
+HEADER = struct.Struct('<4sH') # 魔数, 年份
+DAYS = 366
+COLUMN_BYTES = DAYS * 4
+BITMAP_BYTES = (DAYS + 7) // 8
+EFFECT_OFFSET = HEADER.size
+TOTAL_OFFSET = EFFECT_OFFSET + COLUMN_BYTES
+PRESENT_OFFSET = TOTAL_OFFSET + COLUMN_BYTES
+RECORD_SIZE = PRESENT_OFFSET + BITMAP_BYTES
+
+class YearRecords:
+    """ 一年的工时记录, 两列工时加一张存在位图 """
+
+    __slots__ = ('year', 'buffer', 'effect', 'total', 'present')
+
+    def __init__(self, year: int, buffer=None):
+        """
+        Parameters
+        ----------
+        year: int
+            年份
+
+        buffer: bytes | bytearray | memoryview
+            序列化的数据, 直接引用而不复制; bytes等只读数据加载后不可修改。为None时创建空记录
+        """
+        if buffer is None:
+            buffer = bytearray(RECORD_SIZE)
+            HEADER.pack_into(buffer, 0, MAGIC, year)
+        view = memoryview(buffer)
+        if view.nbytes != RECORD_SIZE:
+            raise ValueError(f'工时记录长度错误: {view.nbytes}')
+        magic, buffer_year = HEADER.unpack_from(view)
+        if magic != MAGIC or buffer_year != year:
+            raise ValueError(f'无效的{year}年工时记录')
+        self.year = year
+        self.buffer = buffer
+        self.effect = view[EFFECT_OFFSET:TOTAL_OFFSET].cast('f')
+        self.total = view[TOTAL_OFFSET:PRESENT_OFFSET].cast('f')
+        self.present = view[PRESENT_OFFSET:]
+
+    @classmethod
+    def from_bytes(cls, data) -> 'YearRecords':
+        _, year = HEADER.unpack_from(data)
+        return cls(year, data)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.buffer)
+
+    def day_index(self, month: int, day: int) -> int:
+        return datetime.date(self.year, month, day).timetuple().tm_yday - 1
+
+    def __contains__(self, i: int) -> bool:
+        return bool(self.present[i >> 3] >> (i & 7) & 1)
+
+    def __len__(self) -> int:
+        return int.from_bytes(self.present, 'little').bit_count()
+
+    def get(self, i: int) -> tuple[float, float] | None:
+        if i not in self:
+            return None
+        return self.effect[i], self.total[i]
+
+    def set(self, i: int, effect_hours: float, total_hours: float):
+        self.effect[i] = effect_hours
+        self.total[i] = total_hours
+        self.present[i >> 3] |= 1 << (i & 7)
+
+    def clear(self, i: int):
+        self.effect[i] = 0
+        self.total[i] = 0
+        self.present[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+    def items(self) -> Iterator[tuple[int, float, float]]:
+        """ 按日期顺序返回有记录的(第几天, 有效工时, 总工时) """
+        bits = int.from_bytes(self.present, 'little')
+        while bits:
+            i = (bits & -bits).bit_length() - 1
+            yield i, self.effect[i], self.total[i]
+            bits &= bits - 1
+
+    def month_view(self, month: int) -> tuple[memoryview, memoryview]:
+        """ 整月每天的(有效工时, 总工时), 下标为日期-1, 与本记录共享内存 """
+        start = self.day_index(month, 1)
+        end = start + (datetime.date(self.year + month // 12, month % 12 + 1, 1) - datetime.date(self.year, month, 1)).days
+        return self.effect[start:end], self.total[start:end]
+
+    def to_numpy(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ 不复制数据的numpy视图
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray, np.ndarray]
+            有效工时, 总工时, 是否有记录; 前两者与本记录共享内存
+        """
+        effect = np.frombuffer(self.buffer, dtype=np.float32, count=DAYS, offset=EFFECT_OFFSET)
+        total = np.frombuffer(self.buffer, dtype=np.float32, count=DAYS, offset=TOTAL_OFFSET)
+        present = np.unpackbits(np.frombuffer(self.buffer, dtype=np.uint8, count=BITMAP_BYTES, offset=PRESENT_OFFSET),
+                                bitorder='little')[:DAYS].astype(bool)
+        return effect, total, present
+
+    @classmethod
+    def from_legacy(cls, year: int, year_config: dict) -> 'YearRecords':
+        """ 由旧版本{月: {日: {'effect_hours': 有效工时, 'total_hours': 总工时}}}格式转换 """
+        records = cls(year)
+        for month, month_config in year_config.items():
+            for day, day_config in month_config.items():
+                records.set(records.day_index(month, day), day_config['effect_hours'], day_config['total_hours'])
+        return records
+
+    def to_legacy(self) -> dict:
+        year_config = {}
+        first_day = datetime.date(self.year, 1, 1).toordinal()
+        for i, effect_hours, total_hours in self.items():
+            date = datetime.date.fromordinal(first_day + i)
+            year_config.setdefault(date.month, {})[date.day] = {'effect_hours': effect_hours, 'total_hours': total_hours}
+        return year_config
+
+if __name__ == '__main__':
+    import pickle
+    import random
+    import time
+
+    # 与旧版本嵌套dict格式对比: 一整年的记录
+    rng = random.Random(0)
+    legacy = {}
+    for i in range(365):
+        date = datetime.date(2023, 1, 1) + datetime.timedelta(days=i)
+        legacy.setdefault(date.month, {})[date.day] = {'effect_hours': rng.randint(0, 48) / 4, 'total_hours': rng.randint(0, 56) / 4}
+    records = YearRecords.from_legacy(2023, legacy)
+    assert records.to_legacy() == legacy and len(records) == 365
+
+    legacy_bytes = pickle.dumps(legacy, pickle.HIGHEST_PROTOCOL)
+    data = records.to_bytes()
+    print(f'序列化大小, 嵌套dict: {len(legacy_bytes)}字节, YearRecords: {len(data)}字节')
+
+    count = 10000
+    begin = time.perf_counter()
+    for _ in range(count):
+        pickle.loads(legacy_bytes)
+    legacy_cost = time.perf_counter() - begin
+    begin = time.perf_counter()
+    for _ in range(count):
+        YearRecords.from_bytes(data).to_numpy()
+    records_cost = time.perf_counter() - begin
+    print(f'加载{count}次, 嵌套dict: {legacy_cost * 1000:.1f}ms, YearRecords(含numpy视图): {records_cost * 1000:.1f}ms')